@@ -1,4 +1,5 @@
 import random
+from gurobipy import GRB, quicksum
 
 from ILP_optiplan.itt_proposition import *
 from ILP_optiplan.runtime_params import RuntimeParam
@@ -9,8 +10,9 @@ __author__ = 'pxsalehi'
 
 
 class ActionCostModel():
-    def __init__(self, model, cost_model_type):
+    def __init__(self, model, cost_model_type, rng=random):
         self.m = model
+        self.rng = rng
         self.cost_model_type = CostModelType[cost_model_type.upper()]
         self.cost_per_action = dict()  # act.tuple, step -> action cost
         # only for RUNTIME cost model
@@ -33,6 +35,8 @@ class ActionCostModel():
     def add_cost_constrs(self, all_acts, action_vars, all_props, plan_steps, runtime_samples):
         if self.cost_model_type != CostModelType.RUNTIME:
             return
+        # actions with a variable in step t, reachability pruning leaves out the others
+        step_acts = {t: [a for a in all_acts if (a.tuple, t) in action_vars] for t in plan_steps[1:]}
         for conn in all_props:
             if isinstance(conn, Conn):
                 x = conn.vi
@@ -44,14 +48,14 @@ class ActionCostModel():
                     self.m.addQConstr(self.cost_vars[RuntimeParam.MSG_RATE, x, y, t], GRB.GREATER_EQUAL,
                         self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vj, t - 1]
-                                  for a in all_acts if a.vi == x and a.vk == y])
+                                  for a in step_acts[t] if a.vi == x and a.vk == y])
                         + self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
                         - quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vj, t - 1]
-                                    for a in all_acts if a.vi == y and a.vk == x])
+                                    for a in step_acts[t] if a.vi == y and a.vk == x])
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vk, t - 1]
-                                    for a in all_acts if a.vj == x and a.vk == y])
+                                    for a in step_acts[t] if a.vj == x and a.vk == y])
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
-                                    for a in all_acts if a.vj == y and a.vk == x])
+                                    for a in step_acts[t] if a.vj == y and a.vk == x])
                         )
                 y = conn.vi
                 x = conn.vj
@@ -61,14 +65,14 @@ class ActionCostModel():
                     self.m.addQConstr(self.cost_vars[RuntimeParam.MSG_RATE, x, y, t], GRB.GREATER_EQUAL,
                         self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vj, t - 1]
-                                  for a in all_acts if a.vi == x and a.vk == y])
+                                  for a in step_acts[t] if a.vi == x and a.vk == y])
                         + self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
                         - quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vj, t - 1]
-                                    for a in all_acts if a.vi == y and a.vk == x])
+                                    for a in step_acts[t] if a.vi == y and a.vk == x])
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, a.vk, t - 1]
-                                    for a in all_acts if a.vj == x and a.vk == y])
+                                    for a in step_acts[t] if a.vj == x and a.vk == y])
                         + quicksum([action_vars[a.tuple, t] * self.cost_vars[RuntimeParam.MSG_RATE, x, y, t - 1]
-                                    for a in all_acts if a.vj == y and a.vk == x])
+                                    for a in step_acts[t] if a.vj == y and a.vk == x])
                         )
 
     def get_cost_per_action(self, all_acts, action_vars, plan_steps):
@@ -79,7 +83,7 @@ class ActionCostModel():
         elif self.cost_model_type == CostModelType.RANDOM:
             for a in all_acts:
                 for t in plan_steps[1:]:
-                    self.cost_per_action[a.tuple, t] = random.randint(1, 10)
+                    self.cost_per_action[a.tuple, t] = self.rng.randint(1, 10)
         elif self.cost_model_type == CostModelType.RUNTIME:
             for a in all_acts:
                 for t in plan_steps[1:]:
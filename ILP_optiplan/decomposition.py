@@ -0,0 +1,160 @@
+import copy
+import re
+import multiprocessing
+import threading
+from timeit import default_timer as timer
+
+import config.planner_config as pconf
+import instrumentation as instr
+import plan_cache
+from topology.topology import Topology
+from topology.tree_index import TreeIndex
+
+__author__ = 'pxsalehi'
+
+
+# partitions the reconfiguration into independent regions: goal edges (target edges not in the initial tree)
+# whose paths in the initial tree share a node are in the same region
+# returns a list of (nodes, goal edges) per region, largest region first
+# every removable edge lies on the path of some goal, and the initial and target edges within a region's nodes
+# both form a tree on them, so each region is an ITT problem of its own and shifts of different regions never
+# touch the same edge
+def find_regions(initial_topo, target_topo):
+    tree = TreeIndex(initial_topo.edges)
+    goals = initial_topo.goal_edges(target_topo)
+    parent = list(range(len(goals)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    paths = []
+    owner = dict()  # node -> a goal whose path uses it
+    for x, g in enumerate(goals):
+        path = tree.path(g[0], g[1])
+        paths.append(path)
+        for v in path:
+            if v in owner:
+                parent[find(x)] = find(owner[v])
+            else:
+                owner[v] = x
+    regions = dict()  # root goal -> (nodes, goals)
+    for x, g in enumerate(goals):
+        nodes, region_goals = regions.setdefault(find(x), (set(), []))
+        nodes.update(paths[x])
+        region_goals.append(g)
+    return sorted(regions.values(), key=lambda r: len(r[0]), reverse=True)
+
+
+# initial and target topology restricted to the given nodes
+def region_topologies(initial_topo, target_topo, nodes):
+    topos = []
+    for topo in (initial_topo, target_topo):
+        region_topo = Topology()
+        region_topo.set_vertices(set(nodes))
+        region_topo.set_edges([e for e in topo.edges if e[0] in nodes and e[1] in nodes])
+        topos.append(region_topo)
+    return topos
+
+
+# plans one region in a worker process of the pool, returns its actions per step (or None), its planning time and
+# whether the plan is final
+def plan_region(args):
+    from ILP_optiplan.itt_optiplan import calculate_plan
+    region, initial_topo, target_topo, options = args
+    print('Planning region %d with %d nodes' % (region, len(initial_topo.vertices)), flush=True)
+    return plan_cache.final_plan(calculate_plan, initial_topo, target_topo, options)
+
+
+# merges plans of independent regions step by step, step t of the result has the actions of the t-th non-empty
+# step of every region, so the plan length is the length of the longest region plan
+def merge_plans(plans):
+    merged = dict()
+    for plan in plans:
+        steps = [plan[t] for t in sorted(plan) if plan[t]]
+        for step, actions in enumerate(steps):
+            merged.setdefault(step + 1, []).extend(actions)
+    return merged
+
+
+# solves one IP per region concurrently and merges the plans, returns the plan and the time it took
+def calculate_plan_regions(initial_topo, target_topo, options):
+    start_time = timer()
+    regions = find_regions(initial_topo, target_topo)
+    if not regions:
+        return dict(), timer() - start_time
+    print('Decomposed into %d regions, nodes per region: %s' % (len(regions), [len(r[0]) for r in regions]))
+    instr.count('regions', len(regions))
+    workers = min(options.region_workers or options.threads, len(regions))
+    region_options = copy.copy(options)
+    region_options.stat_file = None
+    # pool arguments are pickled, a thread event cannot be shared and regions stop by their time limit
+    if isinstance(region_options.stop_event, threading.Event):
+        region_options.stop_event = None
+    # a region is the union of its goal paths, so the paths of its goals cover all of its nodes
+    region_options.search_space = pconf.IPSearchSpaceType.ALL_PATHS.name
+    region_options.threads = max(1, options.threads // workers)
+    # pool workers cannot start processes of their own
+    region_options.bfs_workers = 1
+    if pconf.HorizonSearchType(options.horizon_search.upper()) == pconf.HorizonSearchType.RACE:
+        region_options.horizon_search = pconf.HorizonSearchType.LINEAR.name
+    tasks = [(x, ) + tuple(region_topologies(initial_topo, target_topo, nodes)) + (region_options, )
+             for x, (nodes, goals) in enumerate(regions)]
+    # regions are planned by pool workers, which do not report into the instrumentation of this process
+    with instr.span('regions'), multiprocessing.Pool(workers) as pool:
+        results = pool.map(plan_region, tasks, chunksize=1)
+    plans = []
+    for x, (plan, time, final) in enumerate(results):
+        if plan is None:
+            print('No plan for region %d with nodes %s' % (x, sorted(regions[x][0])))
+            return None, None
+        print('Region %d planned in %.2f s' % (x, time))
+        if not final:
+            plan_cache.incomplete()
+        plans.append(plan)
+    return merge_plans(plans), timer() - start_time
+
+
+# solves one small model per goal edge and concatenates the plans: for goal g with path p in the current tree,
+# the model turns p into p without one removable edge of p plus g, which keeps the tree a tree and adds one
+# target edge; a removable edge always exists as p and g form a cycle that is not in the target
+# models are solved one after the other as the paths change with every goal
+def calculate_plan_paths(initial_topo, target_topo, options):
+    from ILP_optiplan.itt_optiplan import calculate_plan
+    start_time = timer()
+    tree = TreeIndex(initial_topo.edges)
+    path_options = copy.copy(options)
+    path_options.stat_file = None
+    path_options.search_space = pconf.IPSearchSpaceType.ALL.name
+    plan = dict()
+    goals = initial_topo.goal_edges(target_topo)
+    while goals:
+        # shortest path first, it has the smallest model
+        g = min(goals, key=lambda e: tree.path_length(e[0], e[1]))
+        goals.remove(g)
+        path = tree.path(g[0], g[1])
+        path_edges = [(path[x], path[x + 1]) for x in range(0, len(path) - 1)]
+        removed = next(e for e in path_edges if not target_topo.contains_edge(e))
+        path_init = Topology()
+        path_init.set_vertices(set(path))
+        path_init.set_edges(path_edges)
+        path_target = Topology()
+        path_target.set_vertices(set(path))
+        path_target.set_edges([e for e in path_edges if e != removed] + [g])
+        # sliding the removed edge along the path takes at most one step per node
+        path_options.max_steps = max(options.max_steps, len(path))
+        print('Planning goal %s on path %s removing %s' % (str(g), path, str(removed)))
+        with instr.span('path model'):
+            path_plan, _ = calculate_plan(path_init, path_target, path_options)
+        if path_plan is None:
+            print('No plan for goal %s' % str(g))
+            return None, None
+        for t in sorted(path_plan):
+            if not path_plan[t]:
+                continue
+            for act in path_plan[t]:
+                tree.apply_shift(*[int(x) for x in re.findall(r'\d+', act)])
+            plan[len(plan) + 1] = path_plan[t]
+    return plan, timer() - start_time
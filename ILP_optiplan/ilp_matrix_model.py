@@ -0,0 +1,296 @@
+from gurobipy import *
+import numpy as np
+import scipy.sparse as sp
+from ILP_optiplan.itt_proposition import *
+from ILP_optiplan.itt_operator import ActionTable
+from ILP_optiplan.cost_model import *
+import config.planner_config as pconf
+import instrumentation as instr
+
+__author__ = 'pxsalehi'
+
+STATE_VAR_KINDS = ('maintain', 'preadd', 'predel', 'add', 'del')
+
+
+# same model as ilp_model.create_model, but every constraint family is assembled from sparse
+# proposition x action incidence matrices and added to the model with one matrix call per step
+def create_model_matrix(initial_topo, target_topo, runtime_samples, plan_len, all_props, all_acts, options,
+                        acts_per_step=None):
+    instr.begin('create model')
+    assert plan_len > 0
+    itt_model = MatrixModel(initial_topo, target_topo, runtime_samples, all_props, all_acts, options,
+                            acts_per_step)
+    itt_model.extend(plan_len)
+    instr.begin('update constrs')
+    itt_model.m.update()
+    instr.end('update constrs')
+    instr.end('create model')
+    return itt_model.init_f, itt_model.m, itt_model.action_vars
+
+
+# IP model whose horizon can be extended step by step: the variables and constraints of new steps
+# are appended and the goal constraint (3) is moved to the new final step
+# if acts_per_step is given, step t -> list of actions, action variables are only created for those
+class MatrixModel:
+    def __init__(self, initial_topo, target_topo, runtime_samples, all_props, all_acts, options,
+                 acts_per_step=None):
+        self.all_acts = all_acts
+        self.acts_per_step = acts_per_step
+        self.runtime_samples = runtime_samples
+        self.plan_len = 0
+        # create set of initial and target propositions
+        self.init_f = set()
+        for e in initial_topo.edges:
+            self.init_f.add(Conn(e[0], e[1]))
+            if e not in target_topo.edges:
+                self.init_f.add(Rem(e[0], e[1]))
+        target_f = set()
+        for e in target_topo.edges:
+            target_f.add(Conn(e[0], e[1]))
+        # update set of props with init and target props
+        all_props.update(self.init_f)
+        all_props.update(target_f)
+        self.all_props = all_props
+        print('number of props:', len(all_props))
+        instr.peak('propositions', len(all_props))
+        instr.peak('actions', len(all_acts))
+        self.props = list(all_props)
+        # proposition id -> row
+        row_of = np.full(Proposition.count(), -1, dtype=np.int64)
+        row_of[np.array([f.id for f in self.props], dtype=np.int64)] = np.arange(len(self.props))
+        init_idx = row_of[np.array([f.id for f in self.init_f], dtype=np.int64)]
+        non_init = np.ones(len(self.props), dtype=bool)
+        non_init[init_idx] = False
+        non_init_idx = np.flatnonzero(non_init)
+        self.target_idx = row_of[np.array([f.id for f in target_f], dtype=np.int64)]
+        # incidence matrices pre, add, del: prop x action
+        instr.begin('basic sets')
+        table = self.table = ActionTable(all_acts)
+        pre_m = incidence_matrix(table.pre_ptr, table.pre_ids, row_of, len(self.props))
+        add_m = incidence_matrix(table.add_ptr, table.add_ids, row_of, len(self.props))
+        del_m = incidence_matrix(table.del_ptr, table.del_ids, row_of, len(self.props))
+        instr.end('basic sets')
+        instr.begin('subt sets')
+        self.add_subt_pre = (add_m - add_m.multiply(pre_m)).tocsr()
+        self.del_subt_pre = (del_m - del_m.multiply(pre_m)).tocsr()
+        self.pre_subt_del = (pre_m - pre_m.multiply(del_m)).tocsr()
+        self.pre_and_del = pre_m.multiply(del_m).tocsr()
+        for mat in (self.add_subt_pre, self.del_subt_pre, self.pre_subt_del, self.pre_and_del):
+            mat.eliminate_zeros()
+        instr.end('subt sets')
+        # create model with the variables and constraints of the initial state
+        self.m = Model('itt')
+        self.m.ModelSense = GRB.MINIMIZE
+        self.cost_model = ActionCostModel(self.m, options.action_cost_model, pconf.planner_random(options))
+        self.action_vars = {}
+        self.x = [None]
+        self.s = {kind: [self.add_state_mvar(kind, 0)] for kind in STATE_VAR_KINDS}
+        s = self.s
+        instr.begin('constr 1')
+        if len(init_idx):
+            self.m.addConstr(s['add'][0][init_idx] == 1)
+        instr.end('constr 1')
+        instr.begin('constr 2')
+        if len(non_init_idx):
+            self.m.addConstr(s['add'][0][non_init_idx] + s['maintain'][0][non_init_idx]
+                             + s['preadd'][0][non_init_idx] == 0)
+        instr.end('constr 2')
+        # 11 also holds in the initial state
+        self.m.addConstr(s['add'][0] + s['maintain'][0] + s['del'][0] + s['predel'][0] <= 1)
+        self.goal_constr = None
+        self.step_acts = [None]
+
+    def add_state_mvar(self, kind, t):
+        return add_named_mvar(self.m, ['%s_%s_%d' % (kind, str(f), t) for f in self.props])
+
+    # append steps self.plan_len + 1, ..., plan_len to the model
+    def extend(self, plan_len):
+        assert plan_len > self.plan_len
+        runtime_cost = self.cost_model.cost_model_type == CostModelType.RUNTIME
+        if runtime_cost and self.plan_len > 0:
+            # flow variables of the runtime cost model couple all steps, it is built in one go
+            raise RuntimeError('Runtime cost model does not support extending the plan length')
+        new_steps = list(range(self.plan_len + 1, plan_len + 1))
+        instr.begin('vars')
+        for t in new_steps:
+            self.step_acts.append(self.all_acts if self.acts_per_step is None else self.acts_per_step[t])
+            self.x.append(add_named_mvar(self.m, ['x_%s_%d' % (str(a), t) for a in self.step_acts[t]]))
+            for kind in STATE_VAR_KINDS:
+                self.s[kind].append(self.add_state_mvar(kind, t))
+            for a, var in zip(self.step_acts[t], self.x[t].tolist()):
+                self.action_vars[a.tuple, t] = var
+        # create cost model variables, if any
+        plan_steps = list(range(0, plan_len + 1))
+        if runtime_cost:
+            self.cost_model.add_cost_decision_variables(self.all_props, plan_steps)
+        instr.end('vars')
+        instr.begin('update vars')
+        self.m.update()
+        instr.end('update vars')
+        # objective, steps before the new ones are already priced
+        cost_per_action = self.cost_model.get_cost_per_action(self.all_acts, self.action_vars,
+                                                              [self.plan_len] + new_steps)
+        if runtime_cost:
+            # generate constraints defining cost model
+            self.cost_model.add_cost_constrs(self.all_acts, self.action_vars, self.all_props, plan_steps,
+                                             self.runtime_samples)
+            obj = LinExpr()
+            for a in self.all_acts:
+                for t in plan_steps[1:]:
+                    if (a.tuple, t) in self.action_vars:
+                        obj += cost_per_action[a.tuple, t] * self.action_vars[a.tuple, t]
+            self.m.setObjective(obj, GRB.MINIMIZE)
+        else:
+            for t in new_steps:
+                self.x[t].Obj = np.array([cost_per_action[a.tuple, t] for a in self.step_acts[t]], dtype=float)
+        instr.begin('constrs')
+        instr.begin('constr 4-13')
+        for t in new_steps:
+            mats = (self.add_subt_pre, self.del_subt_pre, self.pre_subt_del, self.pre_and_del)
+            if self.acts_per_step is not None:
+                # only the columns of the actions of this step
+                cols = np.array([self.table.index[a] for a in self.step_acts[t]], dtype=np.int64)
+                mats = tuple(mat[:, cols] for mat in mats)
+            add_step_constrs(self.m, self.x, self.s, t, *mats)
+        instr.end('constr 4-13')
+        # move goal to the new final step
+        if self.goal_constr is not None:
+            self.m.remove(self.goal_constr)
+        self.goal_constr = add_goal_constr(self.m, self.s, plan_len, self.target_idx)
+        instr.end('constrs')
+        self.plan_len = plan_len
+
+    # extend the horizon; if the model has a solution, use it padded with empty steps as MIP start
+    def extend_and_warm_start(self, plan_len):
+        prev_len = self.plan_len
+        start = None
+        if self.m.SolCount > 0:
+            start = {kind: [mvar.X for mvar in self.s[kind]] for kind in STATE_VAR_KINDS}
+            start['x'] = [None] + [mvar.X for mvar in self.x[1:]]
+        self.extend(plan_len)
+        if start is None:
+            return False
+        # propositions true at the old final step are maintained over the new empty steps
+        holds = start['add'][prev_len] + start['maintain'][prev_len] + start['preadd'][prev_len]
+        zeros = np.zeros(len(self.props))
+        for t in range(0, plan_len + 1):
+            for kind in STATE_VAR_KINDS:
+                if t <= prev_len:
+                    self.s[kind][t].Start = start[kind][t]
+                else:
+                    self.s[kind][t].Start = holds if kind == 'maintain' else zeros
+            if t > 0:
+                self.x[t].Start = start['x'][t] if t <= prev_len else np.zeros(len(self.step_acts[t]))
+        return True
+
+
+# sparse 0/1 matrix with a row per proposition and a column per action from the CSR arrays
+# of an ActionTable
+def incidence_matrix(ptr, prop_ids, row_of, num_props):
+    rows = row_of[prop_ids]
+    assert (rows >= 0).all(), 'actions use propositions that are not in the model'
+    cols = np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))
+    return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(num_props, len(ptr) - 1))
+
+
+def add_named_mvar(m, names):
+    mvar = m.addMVar(len(names), vtype=GRB.BINARY)
+    m.setAttr('VarName', mvar.tolist(), names)
+    return mvar
+
+
+# constraint 3: target propositions hold at the final step
+def add_goal_constr(m, s, t, target_idx):
+    if len(target_idx) == 0:
+        return None
+    return m.addConstr(s['add'][t][target_idx] + s['maintain'][t][target_idx] + s['preadd'][t][target_idx] >= 1)
+
+
+# constraints 4-13 of step t
+def add_step_constrs(m, x, s, t, add_subt_pre, del_subt_pre, pre_subt_del, pre_and_del):
+    constrs = []
+    for mat, kind in ((add_subt_pre, 'add'), (del_subt_pre, 'del'), (pre_subt_del, 'preadd')):
+        # 4, 6, 8: a state change needs a supporting action
+        constrs.append(m.addConstr(mat @ x[t] - s[kind][t] >= 0))
+        # 5, 7, 9: a supporting action implies the state change
+        rows, cols = mat.nonzero()
+        if len(rows):
+            constrs.append(m.addConstr(x[t][cols] - s[kind][t][rows] <= 0))
+    # 10
+    constrs.append(m.addConstr(pre_and_del @ x[t] - s['predel'][t] == 0))
+    # 11
+    constrs.append(m.addConstr(s['add'][t] + s['maintain'][t] + s['del'][t] + s['predel'][t] <= 1))
+    # 12
+    constrs.append(m.addConstr(s['preadd'][t] + s['maintain'][t] + s['del'][t] + s['predel'][t] <= 1))
+    # 13
+    constrs.append(m.addConstr(s['preadd'][t] + s['maintain'][t] + s['predel'][t]
+                               - s['preadd'][t - 1] - s['add'][t - 1] - s['maintain'][t - 1] <= 0))
+    return constrs
+
+
+# canonical form of a model: variables by name and constraints as a multiset of
+# (sorted (var name, coeff) pairs, sense, rhs), with <= rows turned into >= rows
+def model_signature(m):
+    m.update()
+    variables = sorted((v.VarName, v.VType, v.LB, v.UB, v.Obj) for v in m.getVars())
+    constrs = []
+    for c in m.getConstrs():
+        row = m.getRow(c)
+        coeffs = [(row.getVar(i).VarName, row.getCoeff(i)) for i in range(row.size())]
+        sense = c.Sense
+        rhs = c.RHS
+        if sense == GRB.LESS_EQUAL:
+            coeffs = [(n, -v) for n, v in coeffs]
+            sense = GRB.GREATER_EQUAL
+            rhs = -rhs
+        coeffs = tuple(sorted((n, v) for n, v in coeffs if v != 0))
+        constrs.append((coeffs, sense, rhs + 0.0))
+    constrs.sort()
+    return variables, constrs
+
+
+def models_equal(m1, m2):
+    return model_signature(m1) == model_signature(m2) and m1.ModelSense == m2.ModelSense
+
+
+if __name__ == '__main__':
+    # equivalence check of the matrix, incremental and loop builders on small topologies, for the all and
+    # each_path search spaces, with and without reachability pruning
+    import copy
+    import itertools
+    from ILP_optiplan.ilp_model import create_model
+    from ILP_optiplan.itt_optiplan import gen_shift_acts, generate_propositions
+    from ILP_optiplan.reachability import prune_unreachable
+    from config.planner_config import PlannerConfig, IPSearchSpaceType
+    from topology.generator import generate_tree, change_links
+
+    def check_builders(init_topo, target_topo, plan_len, props, acts, options, acts_per_step, case):
+        _, loop_model, _ = create_model(init_topo, target_topo, {}, plan_len, set(props), acts, options,
+                                        acts_per_step)
+        _, matrix_model, _ = create_model_matrix(init_topo, target_topo, {}, plan_len, set(props), acts, options,
+                                                 acts_per_step)
+        assert models_equal(loop_model, matrix_model), ('matrix', ) + case
+        # growing the horizon one step at a time gives the same model as building it in one go
+        incremental = MatrixModel(init_topo, target_topo, {}, set(props), acts, options, acts_per_step)
+        for t in range(1, plan_len + 1):
+            incremental.extend(t)
+        assert models_equal(loop_model, incremental.m), ('incremental', ) + case
+
+    for size, plan_len, seed in itertools.product([4, 5], [1, 2], [11, 23]):
+        init_topo = generate_tree(size, max_child=2, seed=seed)
+        target_topo = change_links(init_topo, 0.5, seed)
+        for search_space in (IPSearchSpaceType.ALL, IPSearchSpaceType.EACH_PATH):
+            options = PlannerConfig('ip', size=size, change_rate=0.5, seed=seed, search_space=search_space.name,
+                                    gen_props_from_actions=search_space == IPSearchSpaceType.EACH_PATH)
+            acts = gen_shift_acts(init_topo, target_topo, options)
+            props = generate_propositions(acts, options, init_topo.vertices)
+            case = (search_space.name, size, plan_len, seed)
+            check_builders(init_topo, target_topo, plan_len, props, acts, options, None, case)
+            # and with actions pruned by reachability
+            pruned_options = copy.copy(options)
+            pruned_options.prune_reachability = True
+            kept, kept_props, acts_per_step, _ = prune_unreachable(init_topo, target_topo, acts, props, plan_len,
+                                                                   plan_len)
+            check_builders(init_topo, target_topo, plan_len, kept_props, kept, pruned_options, acts_per_step,
+                           case + ('pruned', ))
+    print('matrix, incremental and loop builders produce identical models')
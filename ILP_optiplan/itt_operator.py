@@ -1,3 +1,4 @@
+import numpy as np
 from .itt_proposition import *
 
 __author__ = 'pxsalehi'
@@ -10,49 +11,43 @@ class Operator:
     # add = {conn(i, k), if conn(i,k) not in G: rem(i, k)}
     # del = {conn(i, j), rem(i, j)}
     class Shift:
+        __slots__ = ('vi', 'vj', 'vk', 'adds_rem', 'tuple', '_hash')
+
         def __init__(self, target_topo, vi, vj, vk):
             self.vi = vi
             self.vj = vj
             self.vk = vk
-            self.target_topo = target_topo
-            self.preconds = self.add_effects = self.del_effects = None
+            # only the effect of the target topology is kept, not the topology itself
+            self.adds_rem = not target_topo.contains_edge((vi, vk))
             self.tuple = ('shift', self.vi, self.vj, self.vk)
+            self._hash = hash(self.tuple)
 
         # return set of preconditions
         def get_pre(self):
-            if self.preconds is None:
-                self.preconds = {
-                    Conn(self.vi, self.vj),
-                    Conn(self.vj, self.vk),
-                    Rem (self.vi, self.vj),
-                }
-            return self.preconds
+            return {
+                Conn(self.vi, self.vj),
+                Conn(self.vj, self.vk),
+                Rem (self.vi, self.vj),
+            }
 
         # return set of add effects
         def get_add(self):
-            if self.add_effects is None:
-                self.add_effects = {Conn(self.vi, self.vk)}
-                if not self.target_topo.contains_edge((self.vi, self.vk)):
-                    self.add_effects.add(Rem(self.vi, self.vk))
-            return self.add_effects
+            if self.adds_rem:
+                return {Conn(self.vi, self.vk), Rem(self.vi, self.vk)}
+            return {Conn(self.vi, self.vk)}
 
         # return set of del effects
         def get_del(self):
-            if self.del_effects is None:
-                self.del_effects = {
-                    Conn(self.vi, self.vj),
-                    Rem(self.vi, self.vj)
-                }
-            return self.del_effects
+            return {
+                Conn(self.vi, self.vj),
+                Rem(self.vi, self.vj)
+            }
 
         def __str__(self):
             return 'shift(%d,%d,%d)' % (self.vi, self.vj, self.vk)
 
-        # def tuple(self):
-        #     return 'shift', self.vi, self.vj, self.vk
-
         def __hash__(self):
-            return hash(self.tuple)
+            return self._hash
 
         def __eq__(self, other):
             if isinstance(other, self.__class__):
@@ -66,47 +61,72 @@ class Operator:
     # add = {conn(k, l), if (k, l) not in G: rem(k, l)}
     # del = {conn(i, j), rem(i, j)}
     class Move:
+        __slots__ = ('vi', 'vj', 'vk', 'vl', 'adds_rem', 'tuple', '_hash')
+
         def __init__(self, target_topo, vi, vj, vk, vl):
             self.vi = vi
             self.vj = vj
             self.vk = vk
             self.vl = vl
-            self.target_topo = target_topo
-            self.preconds = self.add_effects = self.del_effects = None
+            self.adds_rem = not target_topo.contains_edge((vk, vl))
             self.tuple = ('move', self.vi, self.vj, self.vk, self.vl)
+            self._hash = hash(self.tuple)
 
         # return set of preconditions
         def get_pre(self):
-            if self.preconds is None:
-                self.preconds = {
-                    Conn(self.vi, self.vl),
-                    Conn(self.vj, self.vk),
-                    Conn(self.vi, self.vj),
-                    Rem (self.vi, self.vj),
-                }
-            return self.preconds
+            return {
+                Conn(self.vi, self.vl),
+                Conn(self.vj, self.vk),
+                Conn(self.vi, self.vj),
+                Rem (self.vi, self.vj),
+            }
 
         # return set of add effects
         def get_add(self):
-            if self.add_effects is None:
-                self.add_effects = {Conn(self.vk, self.vl)}
-                if not self.target_topo.contains_edge((self.vk, self.vl)):
-                    self.add_effects.add(Rem(self.vk, self.vl))
-            return self.add_effects
+            if self.adds_rem:
+                return {Conn(self.vk, self.vl), Rem(self.vk, self.vl)}
+            return {Conn(self.vk, self.vl)}
 
         # return set of del effects
         def get_del(self):
-            if self.del_effects is None:
-                self.del_effects = {
-                    Conn(self.vi, self.vj),
-                    Rem(self.vi, self.vj)
-                }
-            return self.del_effects
+            return {
+                Conn(self.vi, self.vj),
+                Rem(self.vi, self.vj)
+            }
 
         def __str__(self):
             return 'move(%d,%d,%d,%d)' % (self.vi, self.vj, self.vk, self.vl)
 
-        # def tuple(self):
-        #     return 'move', self.vi, self.vj, self.vk, self.vl
+        def __hash__(self):
+            return self._hash
+
+        def __eq__(self, other):
+            if isinstance(other, self.__class__):
+                return self.tuple == other.tuple
+            else:
+                return False
+
 
-            
+# dense integer ids for a list of actions (the action's position, index maps an action to it) and the
+# proposition ids of their pre, add and del sets in CSR form: the ids of action a are
+# pre_ids[pre_ptr[a]:pre_ptr[a + 1]]
+# the index is kept in the table, actions are shared by the tables of different models
+class ActionTable:
+    __slots__ = ('acts', 'index', 'pre_ptr', 'pre_ids', 'add_ptr', 'add_ids', 'del_ptr', 'del_ids')
+
+    def __init__(self, acts):
+        self.acts = acts
+        self.index = {a: i for i, a in enumerate(acts)}
+        self.pre_ptr, self.pre_ids = self.to_csr([[f.id for f in a.get_pre()] for a in acts])
+        self.add_ptr, self.add_ids = self.to_csr([[f.id for f in a.get_add()] for a in acts])
+        self.del_ptr, self.del_ids = self.to_csr([[f.id for f in a.get_del()] for a in acts])
+
+    @staticmethod
+    def to_csr(id_lists):
+        ptr = np.zeros(len(id_lists) + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum([len(ids) for ids in id_lists])
+        ids = np.fromiter((i for ids in id_lists for i in ids), dtype=np.int64, count=ptr[-1])
+        return ptr, ids
+
+    def __len__(self):
+        return len(self.acts)
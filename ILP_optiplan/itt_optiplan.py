@@ -8,14 +8,22 @@ import os
 import sys
 from timeit import default_timer as timer
 import re
+import multiprocessing
+import multiprocessing.connection
 import config.planner_config as pconf
 from ILP_optiplan.ilp_model import create_model
+from ILP_optiplan.reachability import prune_unreachable
+from ILP_optiplan.warm_start import heuristic_plan, set_plan_start
+from ILP_optiplan.decomposition import find_regions, calculate_plan_regions, calculate_plan_paths
 from ILP_optiplan.cost_model import *
 from ILP_optiplan.runtime_params import *
-from topology.generator import convert_topo_to_networkx, generate_tree, change_links
-import networkx as nx
+from topology.generator import generate_tree, change_links
+import plan_cache
+from plan_cache import cached_plan, get_cache, model_key
+import instrumentation as instr
 from topology.reader import create_topology_from_file
 from topology.topology import Topology
+from topology.tree_index import TreeIndex
 
 __author__ = 'pxsalehi'
 
@@ -27,7 +35,7 @@ def extract_sort_actions(action_vars, plan_steps):
     for t in plan_steps:
         actions[t] = list()
     for a in action_vars.values():
-        if a.x > 0:
+        if a.x > 0.5:
             toks = a.getAttr('VarName').split('_')
             step = int(toks[2])
             op = toks[1]
@@ -73,21 +81,22 @@ def gen_shift_acts(initial_topo, target_topo, options):
         shift_perm = itertools.permutations(initial_topo.vertices, 3)
         shift_actions = [Operator.Shift(target_topo, sh[0], sh[1], sh[2]) for sh in shift_perm]
     elif search_space_type == pconf.IPSearchSpaceType.ALL_PATHS:
-        new_edges = {e for e in target_topo.edges if e not in initial_topo.edges}
-        initial_topo_nx = convert_topo_to_networkx(initial_topo)
         reconf_nodes = set()
-        for e in new_edges:
-            reconf_nodes.update(nx.shortest_path(initial_topo_nx, e[0], e[1]))
+        for path in reconf_paths(initial_topo, target_topo):
+            reconf_nodes.update(path)
         print('**** reconf nodes size: %d' % len(reconf_nodes))
         shift_perm = itertools.permutations(reconf_nodes, 3)
         shift_actions = [Operator.Shift(target_topo, sh[0], sh[1], sh[2]) for sh in shift_perm]
     elif search_space_type == pconf.IPSearchSpaceType.EACH_PATH:
-        new_edges = {e for e in target_topo.edges if e not in initial_topo.edges}
-        initial_topo_nx = convert_topo_to_networkx(initial_topo)
+        # paths share nodes, each shift is created once
+        shifts = set()
+        for path in reconf_paths(initial_topo, target_topo):
+            shifts.update(itertools.permutations(path, 3))
+        shift_actions = [Operator.Shift(target_topo, sh[0], sh[1], sh[2]) for sh in sorted(shifts)]
+    elif search_space_type == pconf.IPSearchSpaceType.EACH_SUBTREE:
         shift_actions = []
-        for e in new_edges:
-            reconf_nodes = nx.shortest_path(initial_topo_nx, e[0], e[1])
-            shift_perm = itertools.permutations(reconf_nodes, 3)
+        for nodes, goals in find_regions(initial_topo, target_topo):
+            shift_perm = itertools.permutations(nodes, 3)
             shift_actions.extend([Operator.Shift(target_topo, sh[0], sh[1], sh[2]) for sh in shift_perm])
     # elif search_space_type == heuristic:
     else:
@@ -95,6 +104,32 @@ def gen_shift_acts(initial_topo, target_topo, options):
     return shift_actions
 
 
+# paths in the initial topology between the nodes of each goal edge (target edges not in the initial topology)
+def reconf_paths(initial_topo, target_topo):
+    tree = TreeIndex(initial_topo.edges)
+    return [tree.path(g[0], g[1]) for g in initial_topo.goal_edges(target_topo)]
+
+
+# number of shift actions of each search space, without creating them
+# enumerates the shifts of every goal path, only for reports of a run, not on the planning path
+def count_shift_acts(initial_topo, target_topo):
+    def perms(n):
+        return n * (n - 1) * (n - 2)
+    paths = reconf_paths(initial_topo, target_topo)
+    path_shifts = set()
+    path_nodes = set()
+    for path in paths:
+        path_shifts.update(itertools.permutations(path, 3))
+        path_nodes.update(path)
+    counts = dict()
+    counts[pconf.IPSearchSpaceType.ALL.name] = perms(len(initial_topo.vertices))
+    counts[pconf.IPSearchSpaceType.ALL_PATHS.name] = perms(len(path_nodes))
+    counts[pconf.IPSearchSpaceType.EACH_PATH.name] = len(path_shifts)
+    counts[pconf.IPSearchSpaceType.EACH_SUBTREE.name] = \
+        sum(perms(len(nodes)) for nodes, goals in find_regions(initial_topo, target_topo))
+    return counts
+
+
 def parse_action(act_str):
     nodes = [int(s) for s in re.findall(r"[\w']+", act_str) if s.isdigit()]
     return Operator.Shift()
@@ -166,6 +201,33 @@ def set_solver_params(model, options):
     if options.time_limit:
         model.params.timelimit = options.time_limit
 
+stop_callback_wheres = (GRB.Callback.SIMPLEX, GRB.Callback.BARRIER, GRB.Callback.MIP, GRB.Callback.MIPSOL,
+                        GRB.Callback.MIPNODE)
+
+
+# optimizes the model, terminates it once options.stop_event is set
+# only once the solver searches, so that a MIP start is still loaded and returned as incumbent
+def optimize(model, options):
+    instr.begin('solve')
+    if options.stop_event is None:
+        model.optimize()
+    else:
+        def stop_callback(model, where):
+            if where in stop_callback_wheres and options.stop_event.is_set():
+                model.terminate()
+        model.optimize(stop_callback)
+    instr.end('solve')
+    instr.count('mip nodes', int(model.NodeCount))
+    instr.count('simplex iterations', int(model.IterCount))
+
+
+# size of the largest model and number of models solved
+def record_model_size(model):
+    instr.count('models')
+    instr.peak('variables', model.NumVars)
+    instr.peak('constraints', model.NumConstrs)
+
+
 def tune_model(model, options):
     tune_file = './itt_%d_%.2f.prm' % (options.size, options.change_rate)
     if os.path.exists(tune_file):
@@ -184,83 +246,328 @@ def tune_model(model, options):
             model.write(tune_file)
 
 
-# returns model and actions (can be None)
-def plan_itt(initial_topo, target_topo, runtime_samples, plan_len, options):
-    start_model = timer()
+# returns initial propositions, model and action variables
+def build_itt_model(initial_topo, target_topo, runtime_samples, plan_len, options):
     # create shift actions
+    instr.begin('shift actions')
     shift_acts = gen_shift_acts(initial_topo, target_topo, options)
+    instr.end('shift actions')
     print('number of shift actions:', len(shift_acts))
     all_acts = shift_acts
     # generate propositions
+    instr.begin('propositions')
     all_props = generate_propositions(all_acts, options, initial_topo.vertices)
+    instr.end('propositions')
     # print('Number of conns:', len([f for f in all_props if isinstance(f, Conn)]))
+    acts_per_step = None
+    if options.prune_reachability:
+        instr.begin('prune')
+        all_acts, all_props, acts_per_step, _ = \
+            prune_unreachable(initial_topo, target_topo, all_acts, all_props, plan_len, plan_len)
+        instr.end('prune')
     # assign cost to each action
     # cost_model = create_cost_model(all_acts, list(range(plan_len + 1)), options)
-    init_props, model, action_vars = \
-        create_model(initial_topo, target_topo, runtime_samples, plan_len, all_props, all_acts, options)
+    if pconf.ModelBuilderType(options.model_builder.upper()) == pconf.ModelBuilderType.MATRIX:
+        from ILP_optiplan.ilp_matrix_model import create_model_matrix as build_model
+    else:
+        build_model = create_model
+    return build_model(initial_topo, target_topo, runtime_samples, plan_len, all_props, all_acts, options,
+                       acts_per_step)
+
+
+# reads a model written by the plan cache, returns the same as build_itt_model
+def read_itt_model(model_file, initial_topo, target_topo):
+    model = read(model_file)
+    action_vars = {v.VarName: v for v in model.getVars() if v.VarName.startswith('x_')}
+    init_props = set()
+    for e in initial_topo.edges:
+        init_props.add(Conn(e[0], e[1]))
+        if e not in target_topo.edges:
+            init_props.add(Rem(e[0], e[1]))
+    return init_props, model, action_vars
+
+
+# returns model and actions (can be None)
+# start_plan: list of steps of a heuristic plan used as MIP start if it fits into plan_len steps
+def plan_itt(initial_topo, target_topo, runtime_samples, plan_len, options, start_plan=None):
+    instr.begin('model')
+    cache = get_cache(options)
+    model_file = None
+    if cache is not None:
+        key = model_key(initial_topo, target_topo, plan_len, options)
+        model_file = cache.get_model(key)
+    if model_file is not None:
+        print('   reading cached model', model_file)
+        init_props, model, action_vars = read_itt_model(model_file, initial_topo, target_topo)
+    else:
+        init_props, model, action_vars = build_itt_model(initial_topo, target_topo, runtime_samples, plan_len, options)
     # model.setParam('TimeLimit', 2*60)
-    end_model = timer()
+    instr.end('model')
     plan_steps = list(range(0, plan_len + 1))
     vars = model.getVars()
     print('   number of variables: %d' % len(vars))
     constrs = model.getConstrs()
     print('   number of constraints: %d' % len(constrs))
+    record_model_size(model)
     if options.no_solve:
         sys.exit()
     set_solver_params(model, options)
     if options.tune:
         tune_model(model, options)
-    start_solve = timer()
-    model.optimize()
-    end_solve = timer()
+    if start_plan is not None:
+        set_plan_start(model, init_props, target_topo, start_plan, plan_len)
+    optimize(model, options)
+    # only the model of the plan length the search ends at is worth caching, not those of infeasible plan lengths
+    if cache is not None and model_file is None and model.status != GRB.INFEASIBLE:
+        cache.put_model(key, model)
     actions = None
-    # check results
-    if model.status == GRB.OPTIMAL:
+    # check results, a model stopped by time limit or interrupted may have a feasible incumbent
+    if model.status == GRB.OPTIMAL or model.SolCount > 0:
         actions = extract_sort_actions(action_vars, plan_steps[1:])
         print('Calculated shift actions:')
         for t in actions.keys():
             print('%d: %s' % (t, str(actions[t])))
-        end = timer()
-        rem_edges = [e for e in initial_topo.edges if e not in target_topo.edges]
-        goal_edges = [e for e in target_topo.edges if e not in initial_topo.edges]
-        print('* removable edges:', rem_edges)
-        print('* goal edges:', goal_edges)
-        print('*** total time =', end - start_model)
-        print('*** time to create feasible model =', (end_model - start_model))
-        print('*** time to solve model =', (end_solve - start_solve))
+        print('* removable edges:', initial_topo.removable_edges(target_topo))
+        print('* goal edges:', initial_topo.goal_edges(target_topo))
     else:
         print('Model not feasible.')
     return model, actions
 
 
+# yields plan length, model and actions (can be None) for each plan length, the model is built once
+# and extended by the steps of the next plan length instead of being regenerated
+def plan_itt_incremental(initial_topo, target_topo, runtime_samples, plan_lens, options, start_plan=None):
+    from ILP_optiplan.ilp_matrix_model import MatrixModel
+    instr.begin('model')
+    shift_acts = gen_shift_acts(initial_topo, target_topo, options)
+    print('number of shift actions:', len(shift_acts))
+    all_acts = shift_acts
+    all_props = generate_propositions(all_acts, options, initial_topo.vertices)
+    acts_per_step = None
+    if options.prune_reachability:
+        # not bounded by the plan length, so that earlier steps stay valid when the model is extended
+        all_acts, all_props, acts_per_step, _ = \
+            prune_unreachable(initial_topo, target_topo, all_acts, all_props, plan_lens[-1])
+    itt_model = MatrixModel(initial_topo, target_topo, runtime_samples, all_props, all_acts, options,
+                            acts_per_step)
+    model = itt_model.m
+    set_solver_params(model, options)
+    instr.end('model')
+    for plan_len in plan_lens:
+        instr.begin('extend model')
+        warm = itt_model.extend_and_warm_start(plan_len)
+        if warm:
+            print('   warm start from plan of length %d' % itt_model.plan_len)
+        model.update()
+        if not warm and start_plan is not None:
+            set_plan_start(model, itt_model.init_f, target_topo, start_plan, plan_len)
+        instr.end('extend model')
+        print('   plan length %d, number of variables: %d' % (plan_len, model.NumVars))
+        print('   number of constraints: %d' % model.NumConstrs)
+        record_model_size(model)
+        if options.no_solve:
+            sys.exit()
+        if options.tune:
+            tune_model(model, options)
+        optimize(model, options)
+        actions = None
+        if model.status == GRB.OPTIMAL or model.SolCount > 0:
+            actions = extract_sort_actions(itt_model.action_vars, list(range(1, plan_len + 1)))
+            print('Calculated shift actions:')
+            for t in actions.keys():
+                print('%d: %s' % (t, str(actions[t])))
+        else:
+            print('Model not feasible.')
+        yield plan_len, model, actions
+
+
+# binary search for the shortest feasible plan length, relies on a plan of length t being
+# extendable to t + 1 with an empty step; returns plan length, model and actions of the
+# shortest feasible plan length or of the last tried one if none is feasible
+def bisect_plan_lens(initial_topo, target_topo, runtime_samples, plan_lens, options, start_plan=None):
+    lo = 0
+    hi = len(plan_lens) - 1
+    best = last = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        model, actions = plan_itt(initial_topo, target_topo, runtime_samples, plan_lens[mid], options, start_plan)
+        last = (plan_lens[mid], model, actions)
+        if model.status == GRB.OPTIMAL:
+            best = last
+            hi = mid - 1
+        elif model.status == GRB.INFEASIBLE:
+            print('Plan length %d infeasible, searching [%d, %d]'
+                  % (plan_lens[mid], plan_lens[min(mid + 1, len(plan_lens) - 1)], plan_lens[hi]))
+            lo = mid + 1
+        else:
+            # shorter plan lengths than best are not ruled out
+            plan_cache.incomplete()
+            break
+    return best if best is not None else last
+
+
+# solves one plan length in a worker process of race_plan_lens, sends model status and actions to conn
+def race_worker(initial_topo, target_topo, runtime_samples, plan_len, options, conn, start_plan=None):
+    model, actions = plan_itt(initial_topo, target_topo, runtime_samples, plan_len, options, start_plan)
+    conn.send((model.status, actions))
+    conn.close()
+
+
+# kills a worker of race_plan_lens and waits for it to exit
+def cancel_worker(proc, conn):
+    proc.terminate()
+    proc.join()
+    conn.close()
+
+
+# solves several plan lengths concurrently in worker processes; once a plan length is feasible, longer
+# ones are cancelled, once it is infeasible, shorter ones are cancelled as they cannot be feasible either
+# every worker sends its result through a pipe of its own, so killing a worker while it sends only breaks its pipe
+# returns the actions of the shortest feasible plan length and the time to find it
+def race_plan_lens(initial_topo, target_topo, runtime_samples, plan_lens, options, start_plan=None):
+    workers = min(options.horizon_workers or options.threads, len(plan_lens))
+    worker_options = copy.copy(options)
+    worker_options.stat_file = None
+    worker_options.threads = max(1, options.threads // workers)
+    print('Racing %d plan lengths with %d threads each' % (workers, worker_options.threads))
+    start_time = timer()
+    pending = list(plan_lens)
+    running = dict()  # plan length -> process and receiving end of its pipe
+    best_len = best_actions = best_time = None
+    incumbent = None  # plan length, actions and time of a plan that is feasible but not proven optimal
+    unresolved = []  # plan lengths whose solve ended without a proof
+    try:
+        while pending or running:
+            if pconf.stop_requested(options):
+                print('Stopped, cancelling plan lengths', sorted(running))
+                break
+            while pending and len(running) < workers:
+                plan_len = pending.pop(0)
+                conn, worker_conn = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(target=race_worker, args=(initial_topo, target_topo,
+                                                                         runtime_samples, plan_len, worker_options,
+                                                                         worker_conn, start_plan))
+                proc.start()
+                worker_conn.close()
+                running[plan_len] = (proc, conn)
+            conn_lens = {conn: l for l, (_, conn) in running.items()}
+            # a pipe is also ready when its worker exits without sending
+            for conn in multiprocessing.connection.wait(list(conn_lens), timeout=1):
+                plan_len = conn_lens[conn]
+                if plan_len not in running:  # cancelled by a result received before
+                    continue
+                proc, _ = running.pop(plan_len)
+                try:
+                    status, actions = conn.recv()
+                except EOFError:
+                    print('Worker for plan length %d failed' % plan_len)
+                    cancel_worker(proc, conn)
+                    continue
+                conn.close()
+                proc.join()
+                if status == GRB.OPTIMAL and (best_len is None or plan_len < best_len):
+                    best_len, best_actions, best_time = plan_len, actions, timer() - start_time
+                    pending = [l for l in pending if l < plan_len]
+                    cancel = [l for l in running if l > plan_len]
+                elif status == GRB.INFEASIBLE:
+                    pending = [l for l in pending if l > plan_len]
+                    cancel = [l for l in running if l < plan_len]
+                else:
+                    print('Plan length %d model status: %d' % (plan_len, status))
+                    unresolved.append(plan_len)
+                    if actions is not None and (incumbent is None or plan_len < incumbent[0]):
+                        incumbent = (plan_len, actions, timer() - start_time)
+                    cancel = []
+                for l in cancel:
+                    print('Cancelling plan length', l)
+                    cancel_worker(*running.pop(l))
+    finally:
+        for proc, conn in running.values():
+            cancel_worker(proc, conn)
+    if best_len is None and incumbent is not None:
+        print('Returning incumbent of plan length %d' % incumbent[0])
+        plan_cache.incomplete()
+        return incumbent[1], incumbent[2]
+    if best_len is None:
+        print('No feasible plan length up to %d' % plan_lens[-1])
+        return None, None
+    print('Shortest feasible plan length: %d' % best_len)
+    if any(l < best_len for l in unresolved):
+        plan_cache.incomplete()
+    return best_actions, best_time
+
+
 # returns calculated plan and the time it took to calculate (ms)
+@cached_plan
 def calculate_plan(initial_topo, target_topo, options):
     # make sure init and target topo have the same broker set
     assert len(initial_topo.vertices) == len(target_topo.vertices)
+    # instrumented runs only, region and path models have no stat file
+    if instr.enabled() and options.stat_file is not None:
+        print('number of shift actions per search space:', count_shift_acts(initial_topo, target_topo))
+    search_space_type = pconf.IPSearchSpaceType(options.search_space.upper())
+    if search_space_type == pconf.IPSearchSpaceType.EACH_SUBTREE:
+        # independent regions are planned separately
+        return calculate_plan_regions(initial_topo, target_topo, options)
+    if search_space_type == pconf.IPSearchSpaceType.EACH_PATH and options.per_path_models:
+        return calculate_plan_paths(initial_topo, target_topo, options)
     options.size = len(initial_topo.vertices)
     # compute change rate
-    u = initial_topo.edges.intersection(target_topo.edges)
+    u = initial_topo.common_edges(target_topo)
     eff_change_rate = 1 - (float(len(u))/len(initial_topo.edges))
     print('effective change rate =', str(eff_change_rate))
     # create a dictionary for runtime parameters
     runtim_samples = dict()
     if options.action_cost_model.upper() == CostModelType.RUNTIME.name:
         print('Using %s action cost model' % CostModelType.RUNTIME)
-        runtim_samples = get_samples(initial_topo.v)
-    for plan_len in gen_plan_lens(options.plan_len_start, options.plan_len_inc, options.max_steps):
-        planning_start_time = timer()
-        model, actions = plan_itt(initial_topo, target_topo, runtim_samples, plan_len, options)
+        runtim_samples = get_samples(initial_topo.vertices, pconf.planner_random(options))
+    plan_len_start = options.plan_len_start
+    max_steps = options.max_steps
+    start_plan = None
+    if options.warm_start:
+        with instr.span('warm start'):
+            start_plan = heuristic_plan(initial_topo, target_topo, options)
+        if start_plan is not None:
+            # the heuristic plan is feasible with its own length, start there with an incumbent
+            print('Heuristic plan has %d steps, using it as initial plan length and MIP start' % len(start_plan))
+            plan_len_start = len(start_plan)
+            max_steps = max(max_steps, plan_len_start)
+    plan_lens = gen_plan_lens(plan_len_start, options.plan_len_inc, max_steps)
+    horizon_search = pconf.HorizonSearchType(options.horizon_search.upper())
+    if horizon_search == pconf.HorizonSearchType.RACE:
+        # the workers do not report into the instrumentation of this process
+        with instr.span('race'):
+            return race_plan_lens(initial_topo, target_topo, runtim_samples, plan_lens, options, start_plan)
+    planning_start_time = timer()
+    if horizon_search == pconf.HorizonSearchType.BINARY:
+        horizons = [bisect_plan_lens(initial_topo, target_topo, runtim_samples, plan_lens, options, start_plan)]
+    elif options.incremental_horizon:
+        horizons = plan_itt_incremental(initial_topo, target_topo, runtim_samples, plan_lens, options, start_plan)
+    else:
+        horizons = ((plan_len,) + plan_itt(initial_topo, target_topo, runtim_samples, plan_len, options,
+                                           start_plan)
+                    for plan_len in plan_lens)
+    for plan_len, model, actions in horizons:
         planning_end_time = timer()
+        instr.count('plan lengths')
         if model.status == GRB.OPTIMAL:
             assert actions is not None
             if options.write_model:
                 model.write('itt_%d_%.2f_%d.lp' % (options.size, eff_change_rate, options.seed))
             return actions, planning_end_time - planning_start_time
-        elif model.status == GRB.INFEASIBLE:
+        elif model.status == GRB.INFEASIBLE and plan_len < plan_lens[-1]:
             print('Increasing steps to %d' % (plan_len + options.plan_len_inc))
         elif model.status == GRB.TIME_LIMIT or model.status == GRB.INTERRUPTED:
             print('model status:', model.status)
+            if actions is not None:
+                print('Returning incumbent of plan length %d' % plan_len)
+                plan_cache.incomplete()
+                return actions, planning_end_time - planning_start_time
             break;
+        if pconf.stop_requested(options):
+            print('Stopped at plan length %d' % plan_len)
+            break
+        planning_start_time = timer()
     # after trying with up to max_steps length, report as infeasible
     if model.status == GRB.INFEASIBLE:
         print('Infeasible model with size=%d change_rate=%.2f max_steps=%d seed=%d'
@@ -1,61 +1,78 @@
+import threading
+
 __author__ = 'pxsalehi'
 
 # propositions
 # they should all provide a __bool__ interface that evaluates their truth based on their value
+# propositions are interned: Conn(i, j) always returns the same object, which carries a dense integer id
+# shared by all kinds of propositions, so that they can be hashed by id and used as array indices
+# creating a proposition takes a lock, so planners in threads of one process get the same objects and ids
 
 
 class Proposition:
+    __slots__ = ('vi', 'vj', 'tuple', 'id')
+    _interned = dict()  # (kind, vi, vj) -> proposition
+    _by_id = []  # id -> proposition
+    _lock = threading.Lock()
+    kind = None
+
+    def __new__(cls, vi, vj):
+        if vi > vj:
+            vi, vj = vj, vi
+        key = (cls.kind, vi, vj)
+        prop = Proposition._interned.get(key)
+        if prop is None:
+            with Proposition._lock:
+                prop = Proposition._interned.get(key)
+                if prop is None:
+                    prop = object.__new__(cls)
+                    prop.vi = vi
+                    prop.vj = vj
+                    prop.tuple = key
+                    prop.id = len(Proposition._by_id)
+                    Proposition._by_id.append(prop)
+                    Proposition._interned[key] = prop
+        return prop
+
+    # re-intern when unpickled or copied, e.g. in another process
+    def __reduce__(self):
+        return self.__class__, (self.vi, self.vj)
+
     def __hash__(self):
-        return hash(self.tuple)
+        return self.id
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.tuple == other.tuple
-        else:
-            return False
+        return self is other
+
+    @staticmethod
+    def count():
+        return len(Proposition._by_id)
+
+    @staticmethod
+    def from_id(prop_id):
+        return Proposition._by_id[prop_id]
 
 
 class Conn(Proposition):
-    def __init__(self, vi, vj):
-        if vi <= vj:
-            self.vi = vi
-            self.vj = vj
-        else:
-            self.vi = vj
-            self.vj = vi
-        self.tuple = ('conn', self.vi, self.vj)
+    __slots__ = ()
+    kind = 'conn'
 
     def __str__(self):
         return 'conn(%d,%d)' % (self.vi, self.vj)
 
-    # def tuple(self):
-    #     return 'conn', self.vi, self.vj
-
-    def __hash__(self):
-        return hash(self.tuple)
-
 
 class Rem(Proposition):
-    def __init__(self, vi, vj):
-        if vi <= vj:
-            self.vi = vi
-            self.vj = vj
-        else:
-            self.vi = vj
-            self.vj = vi
-        self.tuple = ('rem', self.vi, self.vj)
+    __slots__ = ()
+    kind = 'rem'
 
     def __str__(self):
         return 'rem(%d,%d)' % (self.vi, self.vj)
 
-    # def tuple(self):
-    #     return 'rem', self.vi, self.vj
-
-    def __hash__(self):
-        return hash(self.tuple)
 
 if __name__ == '__main__':
     test = set()
     test.add(Conn(2, 3))
     c1 = Conn(3, 2)
-    print(c1 in test)
\ No newline at end of file
+    print(c1 in test)
+    assert c1 is Conn(2, 3) and c1 != Rem(2, 3)
+    assert Proposition.from_id(Rem(2, 3).id) is Rem(3, 2)
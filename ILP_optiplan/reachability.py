@@ -0,0 +1,113 @@
+from collections import defaultdict, deque
+from ILP_optiplan.itt_proposition import *
+
+__author__ = 'pxsalehi'
+
+
+# relaxed planning graph analysis of the actions (delete effects are ignored):
+# - forward, from the initial conn/rem facts: an action can first be applied in the step after
+#   all its preconditions are reachable
+# - backward, from the target conn facts: an action is only useful if one of its add effects is a goal
+#   or a precondition of a useful action in a later step, so it has to leave enough steps for that chain
+# an action is kept at step t if it is applicable at t and useful at t for the given plan length,
+# if plan_len is None, the backward analysis is not bounded by the plan length (safe for any horizon)
+# returns kept actions, propositions used by them, actions per step (1..max_step) and pruning statistics
+def prune_unreachable(initial_topo, target_topo, all_acts, all_props, max_step, plan_len=None):
+    init_f, target_f = get_init_target_props(initial_topo, target_topo)
+    first_step = forward_levels(init_f, all_acts, max_step)
+    reachable = [a for a in all_acts if a in first_step]
+    steps_to_goal = backward_distances(target_f, reachable)
+    acts_per_step = {t: [] for t in range(1, max_step + 1)}
+    kept = []
+    for a in reachable:
+        dist = steps_to_goal.get(a)
+        if dist is None:
+            continue
+        last_step = max_step if plan_len is None else plan_len - dist
+        for t in range(first_step[a], last_step + 1):
+            acts_per_step[t].append(a)
+        if first_step[a] <= last_step:
+            kept.append(a)
+    kept_props = set(init_f)
+    kept_props.update(target_f)
+    for a in kept:
+        kept_props.update(a.get_pre())
+        kept_props.update(a.get_add())
+        kept_props.update(a.get_del())
+    stats = {
+        'actions': len(all_acts),
+        'kept_actions': len(kept),
+        'action_steps': len(all_acts) * max_step,
+        'kept_action_steps': sum(len(acts) for acts in acts_per_step.values()),
+        'props': len(all_props),
+        'kept_props': len(kept_props),
+    }
+    print('reachability: kept %d of %d actions, %d of %d action steps, %d of %d props'
+          % (stats['kept_actions'], stats['actions'], stats['kept_action_steps'], stats['action_steps'],
+             stats['kept_props'], stats['props']))
+    return kept, kept_props, acts_per_step, stats
+
+
+# same initial and target propositions as the model builders use
+def get_init_target_props(initial_topo, target_topo):
+    init_f = set()
+    for e in initial_topo.edges:
+        init_f.add(Conn(e[0], e[1]))
+        if e not in target_topo.edges:
+            init_f.add(Rem(e[0], e[1]))
+    target_f = {Conn(e[0], e[1]) for e in target_topo.edges}
+    return init_f, target_f
+
+
+# action -> first step (1-based) in which the action can be applied, up to max_step
+def forward_levels(init_f, all_acts, max_step):
+    users = defaultdict(list)  # fact id -> actions having it as precondition
+    missing = dict()  # action -> number of preconditions not reached yet
+    for a in all_acts:
+        pre = a.get_pre()
+        missing[a] = len(pre)
+        for f in pre:
+            users[f.id].append(a)
+    reached = {f.id for f in init_f}
+    layer = list(reached)
+    first_step = dict()
+    for t in range(1, max_step + 1):
+        applicable = []
+        for f in layer:
+            for a in users[f]:
+                missing[a] -= 1
+                if missing[a] == 0:
+                    applicable.append(a)
+        layer = []
+        for a in applicable:
+            first_step[a] = t
+            for f in a.get_add():
+                if f.id not in reached:
+                    reached.add(f.id)
+                    layer.append(f.id)
+        if not layer:  # fixpoint, later steps add nothing new
+            break
+    return first_step
+
+
+# action -> minimum number of steps that have to follow the action so that its effects can
+# contribute to the goal (0 if it adds a goal fact directly)
+def backward_distances(target_f, acts):
+    adders = defaultdict(list)  # fact id -> actions adding it
+    for a in acts:
+        for f in a.get_add():
+            adders[f.id].append(a)
+    fact_dist = {f.id: 0 for f in target_f}
+    act_dist = dict()
+    queue = deque(fact_dist.keys())
+    while queue:
+        f = queue.popleft()
+        for a in adders[f]:
+            if a in act_dist:
+                continue
+            act_dist[a] = fact_dist[f]
+            for p in a.get_pre():
+                if p.id not in fact_dist:
+                    fact_dist[p.id] = fact_dist[f] + 1
+                    queue.append(p.id)
+    return act_dist
@@ -11,8 +11,8 @@ class RuntimeParam(Enum):
 
 # runtime_param,x,y -> value
 # e.g. MSG_RATE,x,y -> msg rate of flow from x to y
-def get_samples(nodes):
+def get_samples(nodes, rng=random):
     samples = dict()
     for x, y in itertools.permutations(nodes, 2):
-        samples[RuntimeParam.MSG_RATE, x, y] = random.randint(1, 20)
+        samples[RuntimeParam.MSG_RATE, x, y] = rng.randint(1, 20)
     return samples
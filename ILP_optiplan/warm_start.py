@@ -0,0 +1,77 @@
+import copy
+
+from ILP_optiplan.itt_operator import Operator
+import config.planner_config as pconf
+
+__author__ = 'pxsalehi'
+
+
+# runs the heuristic planner chosen by --warm-start, returns its plan as a list of steps, each a list of
+# shift tuples (i, j, k), or None if it did not find one
+def heuristic_plan(initial_topo, target_topo, options):
+    warm_start = pconf.WarmStartType(options.warm_start.upper())
+    heuristic_options = copy.copy(options)
+    heuristic_options.stat_file = None
+    if warm_start == pconf.WarmStartType.GREEDY:
+        from heuristics import greedy_planner
+        # fewer steps make a shorter horizon
+        heuristic_options.parallel_steps = True
+        plan, _ = greedy_planner.calculate_plan(initial_topo, target_topo, heuristic_options)
+    else:
+        from heuristics import bfs_planner
+        plan, _ = bfs_planner.calculate_plan(initial_topo, target_topo, heuristic_options)
+    if plan is None:
+        return None
+    return [plan[t] for t in sorted(plan)]
+
+
+# names of the model variables that are 1 when the plan is executed over plan_len steps (padded with empty
+# steps), following the state change formulation of create_model: for proposition f at step t
+#   add: an action adds f without requiring it, del: deletes f without requiring it,
+#   preadd: requires f without deleting it, predel: requires and deletes f,
+#   maintain: f is true at t - 1 and no action of step t touches it
+# returns None if an action's preconditions do not hold
+def plan_start_values(plan_steps, init_f, target_topo, plan_len):
+    ones = ['add_%s_0' % str(f) for f in init_f]
+    true = set(init_f)
+    for t in range(1, plan_len + 1):
+        acts = [Operator.Shift(target_topo, *op) for op in plan_steps[t - 1]] if t <= len(plan_steps) else []
+        changes = {'add': set(), 'del': set(), 'preadd': set(), 'predel': set()}
+        for a in acts:
+            pre = a.get_pre()
+            if not pre <= true:
+                print('Warm start: preconditions of %s do not hold in step %d' % (str(a), t))
+                return None
+            add = a.get_add()
+            dele = a.get_del()
+            changes['add'].update(add - pre)
+            changes['del'].update(dele - pre)
+            changes['preadd'].update(pre - dele)
+            changes['predel'].update(pre & dele)
+            ones.append('x_%s_%d' % (str(a), t))
+        touched = set().union(*changes.values())
+        changes['maintain'] = true - touched
+        for kind, props in changes.items():
+            ones.extend('%s_%s_%d' % (kind, str(f), t) for f in props)
+        true = changes['add'] | changes['preadd'] | changes['maintain']
+    return ones
+
+
+# sets the plan as MIP start of the model, all other variables start at 0
+# returns False if the plan does not fit the model (too long, or uses actions that are not in the model)
+def set_plan_start(model, init_f, target_topo, plan_steps, plan_len):
+    if len(plan_steps) > plan_len:
+        return False
+    ones = plan_start_values(plan_steps, init_f, target_topo, plan_len)
+    if ones is None:
+        return False
+    one_vars = [model.getVarByName(name) for name in ones]
+    missing = [name for name, var in zip(ones, one_vars) if var is None]
+    if missing:
+        print('Warm start: %d variables of the plan are not in the model, e.g. %s' % (len(missing), missing[0]))
+        return False
+    all_vars = model.getVars()
+    model.setAttr('Start', all_vars, [0.0] * len(all_vars))
+    model.setAttr('Start', one_vars, [1.0] * len(one_vars))
+    print('   MIP start from heuristic plan with %d steps' % len(plan_steps))
+    return True
@@ -0,0 +1,287 @@
+import concurrent.futures
+import csv
+import itertools
+import math
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+from optparse import OptionParser
+from timeit import default_timer as timer
+
+import config.planner_config as pconf
+import instrumentation as instr
+
+__author__ = 'pxsalehi'
+
+# benchmark runner: sweeps planner, search space, size, change rate and seed, plans every instance with planner.py in
+# a process of its own (so a run can be killed at its time limit and limited in memory), several at a time, and
+# writes one row per run to a CSV results file; a baseline results file can be compared against to find regressions
+#
+# python3 benchmark.py --planners=ip,greedy --sizes=10,20 --change-rates=0.1,0.3 --seeds=1,2,3 \
+#   --search-spaces=all,each_path --baseline=baseline.csv -- --plan-len-start=1 --max-steps=20
+# options after -- are passed to every run of planner.py
+
+key_columns = ['planner', 'search_space', 'size', 'change_rate', 'seed']
+metric_columns = ['status', 'wall_time', 'plan_time', 'model_time', 'solve_time', 'nodes', 'plan_steps', 'plan_ops',
+                  'peak_rss_mb']
+# metrics compared to the baseline, a larger value is worse
+time_metrics = ['wall_time', 'plan_time', 'model_time', 'solve_time']
+quality_metrics = ['plan_steps', 'plan_ops']
+min_time_diff = 0.05  # s, smaller differences are noise
+
+# columns from the instrumentation report of a run: spans whose times are added up, counters that are added up
+report_spans = {'model_time': ('model', 'extend model'), 'solve_time': ('solve', )}
+report_counters = {'nodes': ('mip nodes', 'expanded states')}  # gurobi branch and bound nodes, search expansions
+
+
+def split_list(value, convert=str):
+    return [convert(v) for v in value.split(',') if v]
+
+
+# runs of the sweep, search spaces only apply to the ip planner
+def instances(options):
+    runs = []
+    for planner in split_list(options.planners, str.lower):
+        spaces = split_list(options.search_spaces, str.lower) if planner == pconf.Planner.IP.value else ['-']
+        for space, size, rate, seed in itertools.product(spaces, split_list(options.sizes, int),
+                                                         split_list(options.change_rates, float),
+                                                         split_list(options.seeds, int)):
+            runs.append({'planner': planner, 'search_space': space, 'size': size, 'change_rate': rate, 'seed': seed})
+    return runs
+
+
+def run_name(run):
+    return '{planner}_{search_space}_n{size}_c{change_rate}_s{seed}'.format(**run)
+
+
+def planner_args(run, options, extra_args):
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'planner.py')]
+    # runs share the cores
+    if not any(a.startswith('--threads') for a in extra_args):
+        args.append('--threads=%d' % max(1, (os.cpu_count() or 1) // options.bench_workers))
+    if run['planner'] == pconf.Planner.BFS.value and not any(a.startswith('--time-limit') for a in extra_args):
+        args.append('--time-limit=%d' % max(1, int(options.run_time_limit * 0.9)))
+    args += extra_args
+    args += ['--planner=' + run['planner'], '--size=%d' % run['size'], '--change-rate=%s' % run['change_rate'],
+             '--seed=%d' % run['seed']]
+    if run['search_space'] != '-':
+        args.append('--search-space=' + run['search_space'])
+    return args
+
+
+def limit_memory(megabytes):
+    def limit():
+        limit_bytes = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+    return limit
+
+
+def read_plan_stat(filename):
+    stat = dict()
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                stat[name.strip()] = float(value)
+    return stat
+
+
+def read_report(filename):
+    reports = instr.read_reports(filename) if os.path.exists(filename) else []
+    if not reports:
+        return dict()
+    report = reports[-1]
+    values = dict()
+    for column, names in report_spans.items():
+        time = sum(instr.span_time(report, name) for name in names)
+        if time:
+            values[column] = time
+    for column, names in report_counters.items():
+        if any(name in report['counters'] for name in names):
+            values[column] = sum(report['counters'].get(name, 0) for name in names)
+    return values
+
+
+# plans one instance in a new process group, so the workers of a planner are killed with it
+def run_instance(run, options, extra_args):
+    name = run_name(run)
+    out_dir = os.path.join(options.bench_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    log_file = os.path.join(out_dir, 'log.txt')
+    args = planner_args(run, options, extra_args)
+    stat_file = os.path.join(out_dir, 'stats.txt')
+    if os.path.exists(stat_file):
+        os.remove(stat_file)
+    args += ['--output-dir=' + out_dir, '--stat-file=' + stat_file]
+    status = 'ok'
+    start = timer()
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                                   preexec_fn=limit_memory(options.run_memory_limit) if options.run_memory_limit
+                                   else None)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        killer = threading.Timer(options.run_time_limit, kill) if options.run_time_limit else None
+        if killer is not None:
+            killer.start()
+        # wait4 gives the peak rss of the run, ru_maxrss is in KB on Linux
+        _, exit_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(exit_status)
+        if killer is not None:
+            killer.cancel()
+    wall_time = timer() - start
+    if timed_out.is_set():
+        status = 'timeout'
+    elif process.returncode != 0:
+        status = 'error %d' % process.returncode
+    row = dict(run, status=status, wall_time=wall_time, peak_rss_mb=usage.ru_maxrss / 1024.0)
+    row.update(read_report(stat_file))
+    stat = read_plan_stat(os.path.join(out_dir, 'plan_stat%d.txt' % run['seed']))
+    row['plan_time'] = stat.get('plan_time', float('nan'))
+    row['plan_steps'] = stat.get('plan_steps', float('nan'))
+    row['plan_ops'] = stat.get('plan_ops', float('nan'))
+    if status == 'ok' and math.isnan(row['plan_ops']):
+        row['status'] = 'no plan'
+    return row
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '' if math.isnan(value) else '%.6g' % value
+    return value
+
+
+# runs the sweep, rows are written as runs complete so an interrupted benchmark keeps its results
+def run_benchmark(options, extra_args):
+    runs = instances(options)
+    os.makedirs(options.bench_dir, exist_ok=True)
+    results = options.results or os.path.join(options.bench_dir, 'results.csv')
+    print('Running %d instances with %d workers, results in %s' % (len(runs), options.bench_workers, results))
+    rows = []
+    with open(results, 'w', newline='') as out:
+        writer = csv.DictWriter(out, key_columns + metric_columns, restval='')
+        writer.writeheader()
+        with concurrent.futures.ThreadPoolExecutor(options.bench_workers) as executor:
+            futures = [executor.submit(run_instance, run, options, extra_args) for run in runs]
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                row = future.result()
+                rows.append(row)
+                writer.writerow({c: format_value(v) for c, v in row.items()})
+                out.flush()
+                print('[%d/%d] %s: %s, %.2f s, %s ops, %.0f MB' % (done, len(runs), run_name(row), row['status'],
+                                                                    row['wall_time'], format_value(row['plan_ops']),
+                                                                    row['peak_rss_mb']), flush=True)
+    return results
+
+
+def read_results(filename):
+    rows = dict()
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            for c in metric_columns:
+                if c != 'status':
+                    row[c] = float(row[c]) if row.get(c) else float('nan')
+            rows[tuple(row[c] for c in key_columns)] = row
+    return rows
+
+
+def geometric_mean(values):
+    values = [v for v in values if v > 0]
+    return math.exp(sum(math.log(v) for v in values) / len(values)) if values else float('nan')
+
+
+# compares results to a baseline: runs that fail now but did not, times more than tolerance slower (and by more
+# than min_time_diff), and longer plans are regressions; also prints the geometric mean time ratio per group of
+# runs that differ only in the seed
+# returns the number of regressions
+def compare(results_file, baseline_file, tolerance):
+    results = read_results(results_file)
+    baseline = read_results(baseline_file)
+    regressions = []
+    groups = dict()
+    for key, row in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        name = ' '.join('%s=%s' % kv for kv in zip(key_columns, key))
+        if row['status'] != 'ok':
+            if base['status'] == 'ok':
+                regressions.append('%s: %s, was ok' % (name, row['status']))
+            continue
+        for c in time_metrics:
+            if row[c] > base[c] * (1 + tolerance) and row[c] - base[c] > min_time_diff:
+                regressions.append('%s: %s %.3f s, was %.3f s' % (name, c, row[c], base[c]))
+        for c in quality_metrics:
+            if row[c] > base[c]:
+                regressions.append('%s: %s %d, was %d' % (name, c, row[c], base[c]))
+        if base['plan_time'] > 0:
+            groups.setdefault(key[:-1], []).append(row['plan_time'] / base['plan_time'])
+    missing = len(set(baseline) - set(results))
+    print('Compared %d runs to baseline %s (%d baseline runs not in results)' % (
+        len(set(results) & set(baseline)), baseline_file, missing))
+    for group, ratios in sorted(groups.items()):
+        print('  %s: plan time x%.2f (geometric mean of %d seeds)' % (
+            ' '.join('%s=%s' % kv for kv in zip(key_columns, group)), geometric_mean(ratios), len(ratios)))
+    if regressions:
+        print('%d regressions:' % len(regressions))
+        for r in regressions:
+            print('  ' + r)
+    else:
+        print('No regressions')
+    return len(regressions)
+
+
+def create_parser():
+    parser = OptionParser(usage='%prog [options] [-- planner options]')
+    parser.add_option('--planners', type='string', dest='planners', default='ip,greedy',
+                      help='comma separated planners to run')
+    parser.add_option('--search-spaces', type='string', dest='search_spaces', default=pconf.search_space_default,
+                      help='comma separated search spaces of the ip planner')
+    parser.add_option('--sizes', type='string', dest='sizes', default='10,20', help='comma separated overlay sizes')
+    parser.add_option('--change-rates', type='string', dest='change_rates', default='0.1,0.2',
+                      help='comma separated change rates')
+    parser.add_option('--seeds', type='string', dest='seeds', default='1,2,3', help='comma separated seeds')
+    parser.add_option('--bench-workers', type='int', dest='bench_workers', default=os.cpu_count(),
+                      help='number of runs at the same time, cores are split among them unless --threads is given')
+    parser.add_option('--run-time-limit', type='int', dest='run_time_limit', default=600,
+                      help='seconds after which a run is killed, 0 for no limit')
+    parser.add_option('--run-memory-limit', type='int', dest='run_memory_limit', default=None,
+                      help='address space limit of a run in MB')
+    parser.add_option('--bench-dir', type='string', dest='bench_dir', default='./benchmark',
+                      help='directory with a log and the plan of each run')
+    parser.add_option('--results', type='string', dest='results', default=None,
+                      help='results CSV file, <bench-dir>/results.csv if not given')
+    parser.add_option('--baseline', type='string', dest='baseline', default=None,
+                      help='results CSV file of an earlier benchmark to compare to')
+    parser.add_option('--tolerance', type='float', dest='tolerance', default=0.2,
+                      help='relative slowdown allowed before a time is a regression')
+    parser.add_option('--compare-only', action='store_true', dest='compare_only', default=False,
+                      help='compare --results to --baseline without running')
+    return parser
+
+
+def main():
+    parser = create_parser()
+    (options, extra_args) = parser.parse_args()
+    options.bench_workers = max(1, options.bench_workers)
+    if options.compare_only:
+        if not options.results or not options.baseline:
+            parser.error('--compare-only needs --results and --baseline')
+        results = options.results
+    else:
+        results = run_benchmark(options, extra_args)
+    if options.baseline:
+        sys.exit(1 if compare(results, options.baseline, options.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 from optparse import OptionParser
 from enum import Enum
+import random
 import sys
+import time
 
 __author__ = 'pxsalehi'
 
@@ -9,6 +11,15 @@ class Planner(Enum):
     GREEDY = 'greedy'
     BFS = 'bfs'
     IP = 'ip'
+    # best-first search engine in heuristics.search
+    ASTAR = 'astar'
+    WASTAR = 'wastar'  # weighted A*, --search-weight
+    IDASTAR = 'idastar'  # iterative deepening A*, memory linear in plan length
+    ARASTAR = 'arastar'  # anytime repairing A*, weight decreases by --search-weight-dec down to 1
+
+
+search_planners = (Planner.ASTAR, Planner.WASTAR, Planner.IDASTAR, Planner.ARASTAR)
+optimal_search_planners = (Planner.ASTAR, Planner.IDASTAR)  # plans are optimal with an admissible heuristic
 
 
 # search space for the IP-based solver
@@ -19,6 +30,44 @@ class IPSearchSpaceType(Enum):
     EACH_SUBTREE = 'EACH_SUBTREE'  # consider combination of each subtree
 
 
+# how the IP model is assembled
+class ModelBuilderType(Enum):
+    MATRIX = 'MATRIX'  # bulk construction from sparse incidence matrices
+    LOOP = 'LOOP'  # one constraint per proposition and step, kept as reference
+
+
+# how the IP planner searches for the shortest feasible plan length
+class HorizonSearchType(Enum):
+    LINEAR = 'LINEAR'  # try plan lengths one after the other
+    BINARY = 'BINARY'  # binary search over plan lengths
+    RACE = 'RACE'  # solve several plan lengths concurrently in a process pool
+
+
+# state encoding of the bfs planner's open and closed lists
+class BFSStateType(Enum):
+    SETS = 'SETS'  # sets of edge tuples, keyed by frozensets
+    ZOBRIST = 'ZOBRIST'  # edge bitsets with an incrementally updated Zobrist hash
+
+
+# heuristic planner whose plan is the MIP start and initial horizon of the IP planner
+class WarmStartType(Enum):
+    GREEDY = 'GREEDY'  # greedy planner with parallel steps
+    BFS = 'BFS'
+
+
+# estimator of the remaining plan length used by the bfs planner and the search engine
+class HeuristicType(Enum):
+    GREEDY = 'GREEDY'  # goals greedily paired with removable edges on their path, not admissible
+    MATCHING = 'MATCHING'  # admissible: goals matched to distinct plan steps and degree surplus
+    PDB = 'PDB'  # admissible: pattern database over pairs of goals, at least the matching bound
+
+
+# generator of random initial and target topologies
+class TopologyGeneratorType(Enum):
+    LEGACY = 'LEGACY'  # generate_tree and change_links, reproduces earlier instances
+    FAST = 'FAST'  # generate_tree_fast and change_links_fast, for large overlays
+
+
 class CostModelType(Enum):
         FIXED = 0
         RANDOM = 1
@@ -33,8 +82,17 @@ presolve_pass_default = -1
 presolve_default = -1  # -1: automatic, 0: off, 1: conservative, 2: aggressive
 search_space_default = IPSearchSpaceType.ALL.name
 action_cost_default = CostModelType.FIXED.name
+model_builder_default = ModelBuilderType.MATRIX.name
+horizon_search_default = HorizonSearchType.LINEAR.name
 bfs_max_qsize_default = 10**5
+bfs_state_default = BFSStateType.ZOBRIST.name
+heuristic_default = HeuristicType.GREEDY.name
+optimal_heuristic_default = HeuristicType.MATCHING.name  # of A* and IDA*
+search_weight_default = 3.0
+search_weight_dec_default = 0.5
 stat_filename_default = './stats.txt'
+cache_size_default = 1024  # MB
+topo_generator_default = TopologyGeneratorType.LEGACY.name
 
 
 class PlannerConfig():
@@ -43,7 +101,14 @@ class PlannerConfig():
                  use_move=False, search_space=search_space_default, plan_len_start=plan_len_start_default,
                  plan_len_inc=plan_len_inc_default, action_cost=action_cost_default, write_model=False,
                  compute_iis=False, gen_props_from_actions=False, cost_file=None, stat_filename=stat_filename_default,
-                 no_solve=False, time_limit=None, bfs_qsize=bfs_max_qsize_default):
+                 no_solve=False, time_limit=None, bfs_qsize=bfs_max_qsize_default,
+                 model_builder=model_builder_default, incremental_horizon=False,
+                 horizon_search=horizon_search_default, horizon_workers=None, region_workers=None,
+                 per_path_models=False, prune_reachability=False,
+                 bfs_state=bfs_state_default, search_weight=search_weight_default,
+                 search_weight_dec=search_weight_dec_default, bfs_workers=1,
+                 heuristic=None, parallel_steps=False, warm_start=None, cache_dir=None,
+                 cache_size=cache_size_default, topo_generator=topo_generator_default):
         self.planner = Planner(planner.lower())
         if (size is None or size < 1) and src is None:
             raise RuntimeError('Please provide topology size or initial topology')
@@ -72,21 +137,86 @@ class PlannerConfig():
         self.cost_file = cost_file
         self.stat_filename = stat_filename
         self.stat_file = None
+        self.stop_event = None  # threading.Event or a PolledEvent, set to stop planning
+        self.rng = None  # random.Random of the plan, None for the module random
         self.no_solve = no_solve
         self.time_limit = time_limit
         self.bfs_qsize = bfs_qsize
+        self.model_builder = model_builder
+        self.incremental_horizon = incremental_horizon
+        self.horizon_search = horizon_search
+        self.horizon_workers = horizon_workers
+        self.region_workers = region_workers
+        self.per_path_models = per_path_models
+        self.prune_reachability = prune_reachability
+        self.bfs_state = bfs_state
+        self.bfs_workers = bfs_workers
+        self.heuristic = heuristic
+        self.parallel_steps = parallel_steps
+        self.warm_start = warm_start
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.topo_generator = topo_generator
+        self.search_weight = search_weight
+        self.search_weight_dec = search_weight_dec
+
+
+# stop event of a plan in another process: is_set of a multiprocessing manager event is a round trip to the
+# manager process, which is too slow for solver callbacks and search expansions, so its answer is reused for
+# interval seconds; picklable, every process polls on its own
+class PolledEvent:
+    def __init__(self, event, interval=0.1):
+        self.event = event
+        self.interval = interval
+        self.checked = float('-inf')
+        self.stopped = False
+
+    def set(self):
+        self.stopped = True
+        self.event.set()
+
+    def is_set(self):
+        if not self.stopped:
+            now = time.monotonic()
+            if now - self.checked >= self.interval:
+                self.checked = now
+                self.stopped = self.event.is_set()
+        return self.stopped
+
+
+# true if the planner was asked to stop early and return what it has
+def stop_requested(options):
+    return options is not None and options.stop_event is not None and options.stop_event.is_set()
+
+
+# random number generator of a plan: plans running next to each other in one process (planner_async threads)
+# each have their own in options.rng, otherwise the planners use the module random seeded by main
+def planner_random(options):
+    if options is None or options.rng is None:
+        return random
+    return options.rng
+
+
+# heuristic of the bfs and search planners: --heuristic if given, otherwise the admissible matching heuristic for
+# A* and IDA*, whose plans are only optimal with an admissible heuristic, and greedy for bfs, WA* and ARA*
+def heuristic_type(options):
+    if options.heuristic:
+        return HeuristicType(options.heuristic.upper())
+    if options.planner in optimal_search_planners:
+        return HeuristicType(optimal_heuristic_default)
+    return HeuristicType(heuristic_default)
 
 
 def parse_cl(arg_list=sys.argv[1:]):
     parser = create_parser()
     (options, args) = parser.parse_args(arg_list)
     if not options.planner:
-        parser.error('Choose planner type: greedy, bfs, ip')
+        parser.error('Choose planner type: greedy, bfs, ip, astar, wastar, idastar, arastar')
     else:
         try:
             options.planner = Planner(options.planner.lower())
         except ValueError as e:
-            parser.error('Incorrect planner name! Choose planner type: greedy, bfs, ip')
+            parser.error('Incorrect planner name! Choose planner type: greedy, bfs, ip, astar, wastar, idastar, arastar')
     if not options.seed:
         parser.error('You forgot --seed!')
     if not options.src_topo and not options.size:
@@ -95,6 +225,13 @@ def parse_cl(arg_list=sys.argv[1:]):
         parser.error('Please provide either --change-rate or --dest!')
     if options.planner == Planner.BFS and options.time_limit is None:
         parser.error('Please provide --time-limit for BFS planner!')
+    if options.warm_start is not None:
+        try:
+            warm_start = WarmStartType(options.warm_start.upper())
+        except ValueError as e:
+            parser.error('Incorrect --warm-start! Choose greedy or bfs')
+        if warm_start == WarmStartType.BFS and options.time_limit is None:
+            parser.error('Please provide --time-limit for a bfs warm start!')
     return options, args
 
 
@@ -123,10 +260,33 @@ def create_parser():
                       help='Whether to include move operations')
     parser.add_option('--topo-max-child', type='int', dest='topo_max_child', default=topo_max_child_default,
                       help='maximum broker children for generated topologies')
+    parser.add_option('--topo-generator', type='string', dest='topo_generator', default=topo_generator_default,
+                      help='generator of random topologies: legacy, fast (numpy, for large overlays)')
     parser.add_option('--search-space', type='string', dest='search_space', default=search_space_default,
                       help='type of search space: all, all_paths, each_path, each_subtree')
+    parser.add_option('--model-builder', type='string', dest='model_builder', default=model_builder_default,
+                      help='IP model builder: matrix, loop')
     parser.add_option('--plan-len-start', type='int', dest='plan_len_start', default=plan_len_start_default,
                       help='initial length of plan')
+    parser.add_option('--incremental-horizon', action='store_true', dest='incremental_horizon', default=False,
+                      help='extend one IP model with the steps of each new plan length instead of rebuilding it')
+    parser.add_option('--horizon-search', type='string', dest='horizon_search', default=horizon_search_default,
+                      help='search over plan lengths: linear, binary, race')
+    parser.add_option('--horizon-workers', type='int', dest='horizon_workers', default=None,
+                      help='number of plan lengths solved concurrently in race mode, --threads are split among them')
+    parser.add_option('--region-workers', type='int', dest='region_workers', default=None,
+                      help='number of regions solved concurrently with search space each_subtree, '
+                           '--threads are split among them')
+    parser.add_option('--per-path-models', action='store_true', dest='per_path_models', default=False,
+                      help='with search space each_path, solve one small model per goal edge on its path '
+                           'and concatenate the plans')
+    parser.add_option('--warm-start', type='string', dest='warm_start', default=None,
+                      help='start the IP solver from the plan of a heuristic planner and use its length as the '
+                           'initial plan length: greedy, bfs')
+    parser.add_option('--cache-dir', type='string', dest='cache_dir', default=None,
+                      help='directory of a persistent cache of plans and IP models, disabled if not given')
+    parser.add_option('--cache-size', type='int', dest='cache_size', default=cache_size_default,
+                      help='size of the plan cache in MB, least recently used entries are evicted')
     parser.add_option('--plan-len-inc', type='int', dest='plan_len_inc', default=plan_len_inc_default,
                       help='increment plan length upon infeasible plan')
     parser.add_option('--action-cost', type='string', dest='action_cost_model', default=action_cost_default,
@@ -135,14 +295,31 @@ def create_parser():
                       help='dump generated IP model to file')
     parser.add_option('--compute-iis', action='store_true', dest='compute_iis', default=False,
                       help='compute infeasible set')
+    parser.add_option('--prune-reachability', action='store_true', dest='prune_reachability', default=False,
+                      help='drop actions and propositions that are unreachable or irrelevant at a plan step')
     parser.add_option('--gen-props-from-actions', action='store_true', dest='gen_props_from_actions', default=False)
     parser.add_option('--cost-file', type='string', dest='cost_file', default=None, help='action cost file')
     parser.add_option('--stat-file', type='string', dest='stat_filename', default=stat_filename_default,
-                      help='output file for statistics')
+                      help='file the JSON report of a run (timing spans, counters, peak memory) is appended to, '
+                           'empty for none')
     parser.add_option('--no-solve', action='store_true', dest='no_solve', default=False,
                       help='only generate the model, do not solve it!')
     parser.add_option('--time-limit', type='int', dest='time_limit', default=None)
     parser.add_option('--bfs-qsize', type='int', dest='bfs_qsize', default=bfs_max_qsize_default)
+    parser.add_option('--bfs-state', type='string', dest='bfs_state', default=bfs_state_default,
+                      help='state encoding of the bfs planner: zobrist, sets')
+    parser.add_option('--bfs-workers', type='int', dest='bfs_workers', default=1,
+                      help='number of bfs worker processes with different seeds sharing the best plan length')
+    parser.add_option('--heuristic', type='string', dest='heuristic', default=None,
+                      help='heuristic of the bfs and search planners: greedy, matching, pdb; default matching for '
+                           'astar and idastar, greedy otherwise')
+    parser.add_option('--parallel-steps', action='store_true', dest='parallel_steps', default=False,
+                      help='greedy planner: apply a maximal set of non-interfering shifts in each step')
+    parser.add_option('--search-weight', type='float', dest='search_weight', default=search_weight_default,
+                      help='heuristic weight of weighted A* and initial weight of ARA*')
+    parser.add_option('--search-weight-dec', type='float', dest='search_weight_dec',
+                      default=search_weight_dec_default, help='decrease of the ARA* weight after each plan')
     parser.add_option('--output-dir', type='string', dest='output_dir', default=None,
                       help='output dir to write stats and plan')
+    parser.set_defaults(stop_event=None, rng=None)
     return parser
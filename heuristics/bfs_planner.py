@@ -1,14 +1,23 @@
 from queue import PriorityQueue
+import copy
 import functools
+import multiprocessing
+import queue
 import random
+import resource
 from timeit import default_timer as timer
 from collections import OrderedDict
 
-import networkx as nx
 import sys
 
-from topology.generator import change_links, generate_tree, convert_edges_to_networkx, read_topology_from_json
+from topology.generator import change_links, generate_tree, read_topology_from_json
+from topology.tree_index import TreeIndex
+from heuristics.state_encoding import EdgeSetStates, ZobristStates
+from heuristics.plan_arena import PlanArena
 import config.planner_config as pconf
+import plan_cache
+from plan_cache import cached_plan
+import instrumentation as instr
 
 
 __author__ = 'pxsalehi'
@@ -17,21 +26,22 @@ TIME_LIMIT_SEC = 10*60
 SIZE_LIMIT = 100000
 
 
+# node is the index of the search node in the PlanArena, the plan leading to it is stored there
 class ClosedListElm:
-    def __init__(self, step_count, hval, actions=[], closed=False):
+    def __init__(self, step_count, hval, node=PlanArena.ROOT, closed=False):
         self.step_count = step_count
         self.hval = hval
-        self.actions = actions
+        self.node = node
         self.closed = closed
 
 
 @functools.total_ordering
 class OpenListElm:
-    def __init__(self, state, step_count, hval, actions=[]):
+    def __init__(self, state, step_count, hval, node=PlanArena.ROOT):
         self.state = state
         self.step_count = step_count
         self.hval = hval
-        self.actions = actions
+        self.node = node
 
     def get_plan_estimate(self):
         return self.hval + self.step_count
@@ -43,64 +53,110 @@ class OpenListElm:
         return self.step_count + self.hval < other.step_count + other.hval
 
     def __str__(self):
-        return '{}, steps={}, hval={}, a={}'.format(self.state, self.step_count, self.hval, self.actions)
+        return '{}, steps={}, hval={}, node={}'.format(self.state, self.step_count, self.hval, self.node)
 
 
 def create_hashable_state(edges):
     return frozenset([frozenset(e) for e in edges])
 
 
+def create_state_encoding(options):
+    if pconf.BFSStateType(options.bfs_state.upper()) == pconf.BFSStateType.ZOBRIST:
+        return ZobristStates(options.seed)
+    return EdgeSetStates()
+
+
 # returns calculated plan and the time it took to calculate the best plan
+@cached_plan
 def calculate_plan(initial_topo, target_topo, options=None):
+    # bfs restarts until its time limit, its plan depends on the time it had
+    plan_cache.incomplete()
+    if options.bfs_workers and options.bfs_workers > 1:
+        return calculate_plan_parallel(initial_topo, target_topo, options)
+    return search(initial_topo, target_topo, options)
+
+
+# bound: optional shared multiprocessing.Value with the best plan length any worker found so far
+def search(initial_topo, target_topo, options, bound=None):
     TIME_LIMIT_SEC = options.time_limit
     SIZE_LIMIT = options.bfs_qsize
-    s0 = initial_topo.edges
-    s0_hval = estimate(s0, target_topo)
+    from heuristics.heuristic import create_heuristic
+    states = create_state_encoding(options)
+    heuristic = create_heuristic(options, target_topo)
+    rng = pconf.planner_random(options)
+    s0 = states.initial(initial_topo.edges)
+    s0_hval = heuristic.value(states.key(s0), set(initial_topo.edges))
     closed_list = dict()
-    open_list = PriorityQueue()
+    arena = PlanArena()
+    mem_stats = {'max_nodes': 0, 'max_arena_bytes': 0, 'max_closed': 0, 'max_open': 0}
+    search_stats = {'restarts': 0, 'expanded': 0, 'generated': 0}
     best_score = float('inf')
     best_plan = None
     best_plan_time = None
     start_time = timer()
-    while timer() - start_time < TIME_LIMIT_SEC:
+    while timer() - start_time < TIME_LIMIT_SEC and not pconf.stop_requested(options):
         print('.', flush=True, end='')
+        search_stats['restarts'] += 1
         closed_list.clear()
-        closed_list[create_hashable_state(s0)] = ClosedListElm(0, s0_hval)
+        arena.clear()
+        open_list = PriorityQueue()
+        closed_list[states.key(s0)] = ClosedListElm(0, s0_hval)
         open_list.put(OpenListElm(s0, 0, s0_hval))
         last_state = None
-        while not open_list.empty() and (timer() - start_time) < TIME_LIMIT_SEC:
+        while not open_list.empty() and (timer() - start_time) < TIME_LIMIT_SEC \
+                and not pconf.stop_requested(options):
             # print('.', end='', flush=True)
             # check size limit
             if len(closed_list) > SIZE_LIMIT:
                 # print('closed list reached size limit', flush=True, end='')
                 break
-            next_state = get_next_state_to_search(open_list, closed_list, best_score)
+            mem_stats['max_open'] = max(mem_stats['max_open'], open_list.qsize())
+            if bound is not None and bound.value < best_score:
+                best_score = bound.value
+            next_state = get_next_state_to_search(open_list, closed_list, best_score, states, rng)
             if next_state is not None:
                 last_state = next_state
-            if next_state is None or is_state_subset(target_topo.edges, next_state.state):
+                next_edges = states.edges(next_state.state)
+            if next_state is None or is_state_subset(target_topo.edges, next_edges):
                 # print('search reached an end state', flush=True, end='')
                 break
-            all_ops = set()
-            for edge in next_state.state:
-                if not is_edge_in(edge, target_topo.edges):
-                    # all_ops.update(find_all_shifts(edge, next_state.state))
-                    all_ops.update(find_all_shifts_smart(edge, next_state.state, target_topo))
-            for op in all_ops:
-                new_state = compute_state(next_state.state, op)
-                hashable_new_state = create_hashable_state(new_state)
+            # all_ops = set()
+            # for edge in next_state.state:
+            #     if not is_edge_in(edge, target_topo.edges):
+            #         all_ops.update(find_all_shifts_smart(edge, next_state.state, target_topo))
+            search_stats['expanded'] += 1
+            tree = TreeIndex(next_edges)
+            h_ctx = None  # heuristic context of next_state, created for its first new successor
+            for op in generate_shifts(next_edges, target_topo, tree):
+                new_state = states.successor(next_state.state, op)
+                hashable_new_state = states.key(new_state)
                 previous = closed_list.get(hashable_new_state)
                 if (previous is None or next_state.step_count + 1 < previous.step_count) and next_state.step_count + 1 < best_score:
-                    hval = estimate(new_state, target_topo)
-                    closed_list[hashable_new_state] = ClosedListElm(next_state.step_count + 1,
-                                                                    hval, next_state.actions + [op], True)
-                    open_list.put(OpenListElm(new_state, next_state.step_count + 1, hval, next_state.actions + [op]))
-        if last_state is not None and is_state_subset(target_topo.edges, last_state.state):
+                    if h_ctx is None:
+                        h_ctx = heuristic.context(states.key(next_state.state), next_edges, tree)
+                    hval = heuristic.child_value(h_ctx, op, hashable_new_state)
+                    search_stats['generated'] += 1
+                    node = arena.add(next_state.node, op)
+                    closed_list[hashable_new_state] = ClosedListElm(next_state.step_count + 1, hval, node, True)
+                    open_list.put(OpenListElm(new_state, next_state.step_count + 1, hval, node))
+        if last_state is not None and is_state_subset(target_topo.edges, states.edges(last_state.state)):
             print('Found a plan with len', last_state.step_count, 'time left', TIME_LIMIT_SEC - (timer()-start_time), 'sec')
-            if best_plan is None or len(last_state.actions) < len(best_plan):
-                best_plan = last_state.actions
+            if best_plan is None or last_state.step_count < len(best_plan):
+                best_plan = arena.plan(last_state.node)
                 best_plan_time = timer() - start_time
+                best_score = len(best_plan)
                 print('New best plan length:', len(best_plan))
+                if bound is not None:
+                    with bound.get_lock():
+                        if best_score < bound.value:
+                            bound.value = best_score
+        update_memory_stats(mem_stats, arena, closed_list)
     end_time = timer()
+    report_memory_stats(mem_stats)
+    instr.count('bfs restarts', search_stats['restarts'])
+    instr.count('expanded states', search_stats['expanded'])
+    instr.count('generated states', search_stats['generated'])
+    heuristic.report()
     if best_plan:
         plan = dict()
         step = 1
@@ -112,25 +168,84 @@ def calculate_plan(initial_topo, target_topo, options=None):
     return best_plan, best_plan_time
 
 
+def search_worker(initial_topo, target_topo, options, bound, results):
+    random.seed(options.seed)
+    plan, plan_time = search(initial_topo, target_topo, options, bound)
+    results.put((options.seed, plan, plan_time))
+
+
+# portfolio of bfs searches with different seeds (random tie breaking and Zobrist keys) in worker processes,
+# each worker prunes states at least as deep as the shortest plan found by any worker
+# returns the shortest plan of all workers and the time it took to find it
+def calculate_plan_parallel(initial_topo, target_topo, options):
+    workers = options.bfs_workers
+    print('Running bfs with %d workers' % workers)
+    bound = multiprocessing.Value('l', 2**62)
+    results = multiprocessing.Queue()
+    procs = []
+    for w in range(0, workers):
+        worker_options = copy.copy(options)
+        worker_options.stat_file = None
+        worker_options.seed = options.seed + w
+        proc = multiprocessing.Process(target=search_worker, args=(initial_topo, target_topo, worker_options,
+                                                                   bound, results))
+        proc.start()
+        procs.append(proc)
+    best_plan = best_plan_time = None
+    reported = 0
+    while reported < workers:
+        try:
+            seed, plan, plan_time = results.get(timeout=1)
+        except queue.Empty:
+            # stop waiting for workers that died without reporting
+            if all(not p.is_alive() for p in procs) and results.empty():
+                print('%d bfs workers died without a result' % (workers - reported))
+                break
+            continue
+        reported += 1
+        if plan is not None and (best_plan is None or len(plan) < len(best_plan)):
+            best_plan = plan
+            best_plan_time = plan_time
+            print('Worker with seed %d found the best plan so far, length %d' % (seed, len(plan)))
+    for proc in procs:
+        proc.join()
+    return best_plan, best_plan_time
+
+
+def update_memory_stats(mem_stats, arena, closed_list):
+    mem_stats['max_nodes'] = max(mem_stats['max_nodes'], len(arena))
+    mem_stats['max_arena_bytes'] = max(mem_stats['max_arena_bytes'], arena.nbytes())
+    mem_stats['max_closed'] = max(mem_stats['max_closed'], len(closed_list))
+
+
+def report_memory_stats(mem_stats):
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    instr.peak('bfs max nodes', mem_stats['max_nodes'])
+    instr.peak('bfs max closed list', mem_stats['max_closed'])
+    instr.peak('bfs max open list', mem_stats['max_open'])
+    instr.peak('bfs plan arena bytes', mem_stats['max_arena_bytes'])
+    print('\nbfs memory: max nodes={} plan arena={} bytes ({:.1f} bytes/node) max closed list={} max open list={} '
+          'peak rss={} KB'.format(mem_stats['max_nodes'], mem_stats['max_arena_bytes'],
+                                  mem_stats['max_arena_bytes'] / max(1, mem_stats['max_nodes']),
+                                  mem_stats['max_closed'], mem_stats['max_open'], peak_rss))
+
+
 def estimate(topo_edges, target_topo):
     # find goal edges
-    goal_edges = []
-    for e in target_topo.edges:
-        if not is_edge_in(e, topo_edges):
-            goal_edges.append(e)
+    goal_edges = target_topo.missing_edges(topo_edges)
     rem_edges = [e for e in topo_edges if not target_topo.contains_edge(e)]
-    topo_nx = convert_edges_to_networkx(topo_edges)
+    tree = TreeIndex(topo_edges)
     # for each goal edge, find all removables located on the path
     total_ops = 0
     for g in goal_edges:
-        path = nx.shortest_path(topo_nx, g[0], g[1])
-        path_edges = {(path[i], path[i+1]) for i in range(0, len(path) - 1)}
+        path_edges = set(tree.path_edges(g[0], g[1]))
         rems_on_path = {e for e in rem_edges if is_edge_in(e, path_edges)}
         # find the closest removable
         closest_rem = None
         min_ops = float('inf')
         for rem in rems_on_path:
-            dist = estimate_distance(topo_nx, rem, g)
+            dist = estimate_distance(tree, rem, g)
             if dist < min_ops:
                 min_ops = dist
                 closest_rem = rem
@@ -140,12 +255,12 @@ def estimate(topo_edges, target_topo):
     return total_ops
 
 
-# given a topology as a nx graph, estimates number of shifts it takes to remove rem and establish goal edge
-def estimate_distance(topo_nx, rem, goal):
-    path = nx.shortest_path(topo_nx, goal[0], goal[1])
-    if len(path) <= 1:
+# given a topology as a tree index, estimates number of shifts it takes to remove rem and establish goal edge
+def estimate_distance(tree, rem, goal):
+    path_len = tree.path_length(goal[0], goal[1])
+    if path_len == 0:
         return 0
-    return max(len(path) - 2, 1)
+    return max(path_len - 1, 1)
 
 
 def compute_state(state, shift):
@@ -161,14 +276,14 @@ def compute_state(state, shift):
     return new_state
 
 
-def get_next_state_to_search(open_list, closed_list, best_score):
+def get_next_state_to_search(open_list, closed_list, best_score, states, rng=random):
     candidates = []
     while not open_list.empty():
         ol_elm = open_list.get()
         if len(candidates) > 0 and ol_elm.get_plan_estimate() != candidates[0].get_plan_estimate():
             open_list.put(ol_elm)
             break
-        hashable_state = create_hashable_state(ol_elm.state)
+        hashable_state = states.key(ol_elm.state)
         cl_elm = closed_list.get(hashable_state)
         if cl_elm is None:
             continue
@@ -176,61 +291,60 @@ def get_next_state_to_search(open_list, closed_list, best_score):
             candidates.append(ol_elm);
     if len(candidates) > 0:
         # return a random state among equal ones
-        return candidates[random.randint(0, len(candidates)-1)]
+        return candidates[rng.randint(0, len(candidates)-1)]
     return None
 
 
+# lazily yields the shifts of all removable edges of a state that find_all_shifts_smart would find, but
+# the tree is built once per state and shifts are checked against goal edges by the change they make
+# to the goal paths: shift(i, j, k) shortens path(g) by one iff i, j, k are consecutive on path(g),
+# keeps it if (i, j) is not on path(g) and lengthens it otherwise
+def generate_shifts(state, target_topo, tree=None):
+    goals = target_topo.missing_edges(state)
+    if tree is None:
+        tree = TreeIndex(state)
+    shortening = set()  # (i, j, k) consecutive on some goal path
+    goal_paths_on_edge = dict()  # frozenset edge -> number of goal paths using it
+    for g in goals:
+        path = tree.path(g[0], g[1])
+        for x in range(0, len(path) - 2):
+            shortening.add((path[x], path[x + 1], path[x + 2]))
+            shortening.add((path[x + 2], path[x + 1], path[x]))
+        for x in range(0, len(path) - 1):
+            e = frozenset((path[x], path[x + 1]))
+            goal_paths_on_edge[e] = goal_paths_on_edge.get(e, 0) + 1
+    for r in state:
+        if target_topo.contains_edge(r):
+            continue
+        # some goal path does not use r, so any shift of r keeps its length
+        off_some_path = goal_paths_on_edge.get(frozenset(r), 0) < len(goals)
+        # case 1: r[0]=i, r[1]=j, shift may also keep the length of path(g)
+        # case 2: r[1]=i, r[0]=j, shift must shorten path(g)
+        for i, j, keep_ok in ((r[0], r[1], off_some_path), (r[1], r[0], False)):
+            # any neighbor of j except i is a potential k
+            for k in tree.neighbors(j):
+                if k != i and (keep_ok or (i, j, k) in shortening):
+                    yield (i, j, k)
+
+
 # given a removable edge and a topology, find set of all possible shifts
 def find_all_shifts_smart(r, state, target_topo):
-    goals = [e for e in target_topo.edges if not is_edge_in(e, state)]
-    topo_nx = nx.Graph()
-    topo_nx.add_edges_from(state)
+    goals = target_topo.missing_edges(state)
+    tree = TreeIndex(state)
     res = []
-    # case 1: r[0]=i, r[1]=j
-    i = r[0]
-    j = r[1]
-    # any neighbor of j except i is a potential k
-    ks = []
-    for e in topo_nx.edges():
-        if e[0] == j and e[1] != i:
-            ks.append(e[1])
-        if e[1] == j and e[0] != i:
-            ks.append(e[0])
-    for g in goals:
-        path_g = nx.shortest_path(topo_nx, g[0], g[1])
-        for k in ks:
-            if not topo_nx.has_edge(i, k) and topo_nx.has_edge(j, k):
-                op = (i, j, k)
-                # make sure this shift moves r towards g, which means, if applied, the shift decreases the length of path(g)
-                new_topo = topo_nx.copy()
-                new_topo.remove_edge(i, j)
-                new_topo.add_edge(i, k)
-                # if nx.is_connected(new_topo):
-                new_path_g = nx.shortest_path(new_topo, g[0], g[1])
-                if len(new_path_g) <= len(path_g):
-                    res.append(op)
-    # case 2: r[1]=i, r[0]=j
-    i = r[1]
-    j = r[0]
-    # any neighbor of j except i is a potential k
-    ks = []
-    for e in topo_nx.edges():
-        if e[0] == j and e[1] != i:
-            ks.append(e[1])
-        if e[1] == j and e[0] != i:
-            ks.append(e[0])
-    for g in goals:
-        path_g = nx.shortest_path(topo_nx, g[0], g[1])
-        for k in ks:
-            if not topo_nx.has_edge(i, k) and topo_nx.has_edge(j, k):
+    # case 1: r[0]=i, r[1]=j, case 2: r[1]=i, r[0]=j
+    for i, j, case in ((r[0], r[1], 1), (r[1], r[0], 2)):
+        # any neighbor of j except i is a potential k
+        ks = [k for k in tree.neighbors(j) if k != i and not tree.has_edge(i, k)]
+        for g in goals:
+            path_len_g = tree.path_length(g[0], g[1])
+            for k in ks:
                 op = (i, j, k)
                 # make sure this shift moves r towards g, which means, if applied, the shift decreases the length of path(g)
-                new_topo = topo_nx.copy()
-                new_topo.remove_edge(i, j)
-                new_topo.add_edge(i, k)
-                # if nx.is_connected(new_topo):
-                new_path_g = nx.shortest_path(new_topo, g[0], g[1])
-                if len(new_path_g) < len(path_g):
+                tree.apply_shift(i, j, k)
+                new_path_len_g = tree.path_length(g[0], g[1])
+                tree.apply_shift(i, k, j)
+                if new_path_len_g < path_len_g or (case == 1 and new_path_len_g == path_len_g):
                     res.append(op)
     return set(res)
 
@@ -282,6 +396,7 @@ def main():
     (options, args) = pconf.parse_cl()
     print('Running with', sorted(sys.argv[1:]))
     options.stat_file = open(options.stat_filename, 'a')
+    instr.enable()
     random.seed(options.seed)
     # create initial topology
     if options.src_topo:
@@ -307,6 +422,7 @@ def main():
     print('best plan len:', 0 if plan is None else len(plan))
     print(plan)
     print('time:', time)
+    instr.write_report(options, planner='bfs', size=len(init_topo.vertices), seed=options.seed, time=time)
 
 
 if __name__ == '__main__':
@@ -1,107 +1,208 @@
-import copy
 import random
 from timeit import default_timer as timer
 
-import networkx as nx
-
-from topology.generator import convert_topo_to_networkx, generate_tree, change_links
+from topology.generator import generate_tree, change_links
 from topology.reader import create_topology_from_file
 import config.planner_config as pconf
-from topology.topology import Topology
+from plan_cache import cached_plan
+import instrumentation as instr
+from topology.topology import Topology, edge_key
+from topology.tree_index import TreeIndex
 
 
 __author__ = 'pxsalehi'
 
 
 # returns calculated plan and the time it took to calculate (ms)
+@cached_plan
 def calculate_plan(initial_topo, target_topo, options=None):
-    random.seed()
     planning_start = timer()
-    # find set of goal edges
-    init_topo = copy.deepcopy(initial_topo)
     plan = dict()
-    plan_ops = set()
     step = 1
-    while not init_topo.equals(target_topo):
-        goal_edges = {edge for edge in target_topo.edges if edge not in init_topo.edges}
-        init_topo_nx = convert_topo_to_networkx(init_topo)
-        rem_edges = set()
-        for goal_edge in goal_edges:
-            path = nx.shortest_path(init_topo_nx, goal_edge[0], goal_edge[1])
-            # add removable edges on the path to the set
-            path_edges = {(path[i], path[i+1]) for i in range(0, len(path) - 1)}
-            rem_edges.update({edge for edge in path_edges if not target_topo.contains_edge(edge)})
-        candidate_ops = set()
-        for g in goal_edges:
-            for r in rem_edges:
-                candidate_ops.update(find_all_shifts(r, g, init_topo_nx, check_effect_on_goal=True))
-        candidate_ops.difference_update(plan_ops)
-        if len(candidate_ops) == 0:
+    parallel_steps = options is not None and options.parallel_steps
+    instr.begin('candidates')
+    tree = TreeIndex(initial_topo.edges)
+    candidates = ShiftCandidates(tree, target_topo, initial_topo.goal_edges(target_topo),
+                                 pconf.planner_random(options))
+    instr.end('candidates')
+    instr.peak('goal edges', len(candidates.goals))
+    instr.peak('candidate shifts', len(candidates))
+    while candidates.goals:
+        if len(candidates) == 0:
             print("Error: cannot find a plan!")
             return None, None
-        op = list(candidate_ops)[random.randint(0, len(candidate_ops)-1)]
-        # apply shift(i, j, k) to init_topo, remove (i, j) and add (i, k)
-        init_topo.rem_edge(op[0], op[1])
-        init_topo.add_edge(op[0], op[2])
-        print('step', step, op, flush=True)
-        plan[step] = op
-        plan_ops.add(op)
+        if pconf.stop_requested(options):
+            print('Stopped at step', step)
+            return None, None
+        ops = candidates.choose_batch() if parallel_steps else [candidates.choose()]
+        for op in ops:
+            candidates.apply(op)
+        instr.count('shifts', len(ops))
+        print('step', step, ops if parallel_steps else ops[0], flush=True)
+        plan[step] = ops
         step += 1
     planning_end = timer()
     return plan, planning_end - planning_start
 
 
-# given a removable edge and a topology, find set of all possible shifts
-def find_all_shifts(r, g, topo_nx, check_effect_on_goal=False):
+# shifts the greedy planner chooses from: shift(i, j, k) of a removable edge (i, j) on some goal path that
+# does not lengthen the path of at least one goal, i.e. some goal path does not use (i, j) or uses i, j, k
+# consecutively; shifts already in the plan are excluded
+# shifts that shorten more goal paths than they lengthen are chosen first, the others only if there are none,
+# otherwise the plan is a random walk that rarely reaches the target
+# the set is kept up to date with the tree: after a shift only the goals whose path used the shifted edge get
+# new paths, and only shifts of edges on their old and new paths or next to the shift are re-evaluated
+class ShiftCandidates:
+    def __init__(self, tree, target_topo, goals, rng=random):
+        self.tree = tree
+        self.rng = rng
+        self.target_topo = target_topo
+        self.goals = dict()  # goal edge -> nodes on its path
+        self.edge_goals = dict()  # edge key -> goals whose path uses the edge
+        self.triples = dict()  # (i, j, k) -> number of goal paths with i, j, k consecutive
+        self.used = set()  # shifts already in the plan
+        self.ops = ([], [])  # improving and other candidate shifts, indexed for uniform random choice
+        self.op_index = dict()  # shift -> position in its list of ops
+        self.edge_ops = dict()  # edge key -> candidate shifts of the edge
+        for g in goals:
+            self.add_path(g)
+        for e in list(self.edge_goals):
+            self.refresh_edge(e)
+
+    def __len__(self):
+        return len(self.ops[0]) + len(self.ops[1])
+
+    def choose(self):
+        ops = self.ops[0] if self.ops[0] else self.ops[1]
+        return ops[self.rng.randint(0, len(ops) - 1)]
+
+    # maximal set of mutually non-interfering improving shifts in random order: no shift deletes a precondition of
+    # another (shift(i, j, k) needs conn(i, j), conn(j, k), rem(i, j) and deletes conn(i, j), rem(i, j), see
+    # Operator.Shift) and no two shifts add the same edge, so they can be applied in one step in any order
+    def choose_batch(self):
+        if not self.ops[0]:
+            return [self.choose()]
+        ops = self.ops[0][:]
+        self.rng.shuffle(ops)
+        batch = []
+        required = set()  # edges the chosen shifts need
+        deleted = set()
+        added = set()
+        for i, j, k in ops:
+            ij = edge_key(i, j)
+            jk = edge_key(j, k)
+            ik = edge_key(i, k)
+            if ij in required or jk in deleted or ik in added:
+                continue
+            batch.append((i, j, k))
+            required.add(ij)
+            required.add(jk)
+            deleted.add(ij)
+            added.add(ik)
+        return batch
+
+    def add_path(self, g):
+        path = self.tree.path(g[0], g[1])
+        self.goals[g] = path
+        for x in range(0, len(path) - 1):
+            self.edge_goals.setdefault(edge_key(path[x], path[x + 1]), set()).add(g)
+        for x in range(0, len(path) - 2):
+            for t in ((path[x], path[x + 1], path[x + 2]), (path[x + 2], path[x + 1], path[x])):
+                self.triples[t] = self.triples.get(t, 0) + 1
+
+    def remove_path(self, g):
+        path = self.goals.pop(g)
+        for x in range(0, len(path) - 1):
+            e = edge_key(path[x], path[x + 1])
+            self.edge_goals[e].discard(g)
+            if not self.edge_goals[e]:
+                del self.edge_goals[e]
+        for x in range(0, len(path) - 2):
+            for t in ((path[x], path[x + 1], path[x + 2]), (path[x + 2], path[x + 1], path[x])):
+                self.triples[t] -= 1
+                if self.triples[t] == 0:
+                    del self.triples[t]
+        return path
+
+    def add_op(self, op, e):
+        # goal paths using (i, j) get shorter if i, j, k are consecutive on them and longer otherwise
+        improving = 2 * self.triples.get(op, 0) > len(self.edge_goals[e])
+        ops = self.ops[0] if improving else self.ops[1]
+        self.op_index[op] = len(ops)
+        ops.append(op)
+        self.edge_ops.setdefault(e, []).append(op)
+
+    def remove_op(self, op):
+        pos = self.op_index.pop(op)
+        ops = self.ops[0] if pos < len(self.ops[0]) and self.ops[0][pos] == op else self.ops[1]
+        last = ops.pop()
+        if last != op:
+            ops[pos] = last
+            self.op_index[last] = pos
+
+    # re-evaluate the shifts of edge e = (a, b)
+    def refresh_edge(self, e):
+        for op in self.edge_ops.pop(e, ()):
+            self.remove_op(op)
+        a, b = e
+        goals = self.edge_goals.get(e)
+        if not goals or self.target_topo.contains_edge(e) or not self.tree.has_edge(a, b):
+            return
+        # some goal path does not use e, so any shift of e keeps its length
+        off_some_path = len(goals) < len(self.goals)
+        for i, j in ((a, b), (b, a)):
+            # any neighbor of j except i is a potential k
+            for k in self.tree.neighbors(j):
+                op = (i, j, k)
+                if k != i and op not in self.used and (off_some_path or op in self.triples):
+                    self.add_op(op, e)
+
+    # apply shift(i, j, k) to the tree: remove (i, j) and add (i, k)
+    def apply(self, op):
+        i, j, k = op
+        changed = list(self.edge_goals.get(edge_key(i, j), ()))
+        affected = set()
+        for g in changed:
+            path = self.remove_path(g)
+            affected.update(edge_key(path[x], path[x + 1]) for x in range(0, len(path) - 1))
+        self.tree.apply_shift(i, j, k)
+        self.used.add(op)
+        goal_count = len(self.goals) + len(changed)
+        for g in changed:
+            if not self.tree.has_edge(*g):
+                self.add_path(g)
+                path = self.goals[g]
+                affected.update(edge_key(path[x], path[x + 1]) for x in range(0, len(path) - 1))
+        if len(self.goals) < goal_count:
+            # a goal was reached: edges now used by all remaining goals may lose shifts
+            affected.update(e for e, goals in self.edge_goals.items() if len(goals) >= len(self.goals))
+        # neighbors of i, j and k changed
+        affected.add(edge_key(i, j))
+        for v in (i, j, k):
+            affected.update(edge_key(v, w) for w in self.tree.neighbors(v))
+        for e in affected:
+            self.refresh_edge(e)
+
+
+# given a removable edge and a topology as a tree index, find set of all possible shifts
+def find_all_shifts(r, g, tree, check_effect_on_goal=False):
     res = []
-    # case 1: r[0]=i, r[1]=j
-    i = r[0]
-    j = r[1]
-    # any neighbor of j except i is a potential k
-    ks = []
-    for e in topo_nx.edges():
-        if e[0] == j and e[1] != i:
-            ks.append(e[1])
-        if e[1] == j and e[0] != i:
-            ks.append(e[0])
-    path_g = nx.shortest_path(topo_nx, g[0], g[1])
-    for k in ks:
-        if not topo_nx.has_edge(i, k) and topo_nx.has_edge(j, k):
-            op = (i, j, k)
-            if check_effect_on_goal:
-                # make sure this shift moves r towards g, which means, if applied, the shift decreases the length of path(g)
-                new_topo = topo_nx.copy()
-                new_topo.remove_edge(i, j)
-                new_topo.add_edge(i, k)
-                if nx.is_connected(new_topo):
-                    new_path_g = nx.shortest_path(new_topo, g[0], g[1])
-                    if len(new_path_g) <= len(path_g):
-                        res.append(op)
-            else:
-                res.append(op)
-    # case 2: r[1]=i, r[0]=j
-    i = r[1]
-    j = r[0]
-    # any neighbor of j except i is a potential k
-    ks = []
-    for e in topo_nx.edges():
-        if e[0] == j and e[1] != i:
-            ks.append(e[1])
-        if e[1] == j and e[0] != i:
-            ks.append(e[0])
-    path_g = nx.shortest_path(topo_nx, g[0], g[1])
-    for k in ks:
-        if not topo_nx.has_edge(i, k) and topo_nx.has_edge(j, k):
+    path_len_g = tree.path_length(g[0], g[1])
+    # case 1: r[0]=i, r[1]=j, case 2: r[1]=i, r[0]=j
+    for i, j in ((r[0], r[1]), (r[1], r[0])):
+        # any neighbor of j except i is a potential k
+        for k in tree.neighbors(j):
+            if k == i or tree.has_edge(i, k):
+                continue
             op = (i, j, k)
             if check_effect_on_goal:
                 # make sure this shift moves r towards g, which means, if applied, the shift decreases the length of path(g)
-                new_topo = topo_nx.copy()
-                new_topo.remove_edge(i, j)
-                new_topo.add_edge(i, k)
-                if nx.is_connected(new_topo):
-                    new_path_g = nx.shortest_path(new_topo, g[0], g[1])
-                    if len(new_path_g) <= len(path_g):
-                        res.append(op)
+                # a shift keeps the tree connected, apply it and undo it again
+                tree.apply_shift(i, j, k)
+                new_path_len_g = tree.path_length(g[0], g[1])
+                tree.apply_shift(i, k, j)
+                if new_path_len_g <= path_len_g:
+                    res.append(op)
             else:
                 res.append(op)
     return set(res)
@@ -110,6 +211,7 @@ def find_all_shifts(r, g, topo_nx, check_effect_on_goal=False):
 def main():
     (options, args) = pconf.parse_cl()
     options.stat_file = open(options.stat_filename, 'a')
+    instr.enable()
     random.seed(options.seed)
     # create initial topology
     if options.src_topo:
@@ -134,6 +236,7 @@ def main():
     plan, time = calculate_plan(init_topo, target_topo, options)
     print(plan)
     print('time:', time)
+    instr.write_report(options, planner='greedy', size=len(init_topo.vertices), seed=options.seed, time=time)
 
 
 if __name__ == '__main__':
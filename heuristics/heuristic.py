@@ -0,0 +1,343 @@
+from topology.tree_index import TreeIndex
+from heuristics.bfs_planner import estimate, compute_state
+import config.planner_config as pconf
+
+__author__ = 'pxsalehi'
+
+
+# estimators of the number of shifts left until the target topology is reached
+# a state is evaluated from scratch with value(key, edges), the successors of an expanded state are
+# evaluated incrementally from the expanded state and the applied shift:
+#   ctx = h.context(key, edges, tree)  once per expanded state, tree is the TreeIndex of its edges
+#   h.child_value(ctx, shift, key)     once per successor
+# values are cached by state key (up to max_cache states), cache hits and misses are counted
+class Heuristic:
+    name = None
+
+    def __init__(self, target_topo, max_cache):
+        self.target_topo = target_topo
+        self.max_cache = max_cache
+        self.cache = dict()  # state key -> (value, info)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, key, value, info):
+        if len(self.cache) < self.max_cache:
+            self.cache[key] = (value, info)
+        return value
+
+    def value(self, key, edges):
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry[0]
+        value, info = self.compute(edges, TreeIndex(edges))
+        return self.store(key, value, info)
+
+    def context(self, key, edges, tree):
+        # not counted as a lookup, the expanded state was evaluated when it was generated
+        entry = self.cache.get(key)
+        info = entry[1] if entry is not None else self.compute(edges, tree)[1]
+        return self.make_context(info, edges, tree)
+
+    def child_value(self, ctx, shift, key):
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry[0]
+        value, info = self.update(ctx, shift)
+        return self.store(key, value, info)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        print('heuristic {}: cache hits={} misses={} hit rate={:.1f}% cached states={}'.format(
+            self.name, self.hits, self.misses, 100.0 * self.hits / max(1, lookups), len(self.cache)))
+
+
+# the bfs planner's estimate: goals are greedily paired with a removable edge on their path and each pair
+# costs max(len(path) - 1, 1), informative but not admissible
+class GreedyHeuristic(Heuristic):
+    name = 'greedy'
+
+    def compute(self, edges, tree):
+        return estimate(edges, self.target_topo), None
+
+    def make_context(self, info, edges, tree):
+        return edges
+
+    def update(self, ctx, shift):
+        return estimate(compute_state(ctx, shift), self.target_topo), None
+
+
+# per expanded state: path of each target edge and the target edges whose path uses a (directed) edge
+class PathContext:
+    __slots__ = ('info', 'tree', 'on_path', 'through', 'pairs')
+
+    def __init__(self, info, tree, targets):
+        self.info = info
+        self.tree = tree
+        self.on_path = []  # target index -> set of directed edges on its path
+        self.through = dict()  # directed edge -> indices of targets whose path uses it
+        for t, (u, v) in enumerate(targets):
+            path = tree.path(u, v)
+            edges = set()
+            for x in range(0, len(path) - 1):
+                edges.add((path[x], path[x + 1]))
+                edges.add((path[x + 1], path[x]))
+            for e in edges:
+                self.through.setdefault(e, []).append(t)
+            self.on_path.append(edges)
+        self.pairs = None
+
+
+# admissible lower bound, the larger of two counts:
+# - goals matched to distinct plan steps: a shift shortens a path by at most one and adds a single edge, so
+#   goal g cannot be completed before step len(path(g)) - 1 and no two goals complete in the same step
+# - degree surplus: a shift moves one unit of degree from j to k, so each surplus unit costs a shift
+# info of a state is (path length per target edge, degree surplus), both updated per shift
+class MatchingHeuristic(Heuristic):
+    name = 'matching'
+
+    def __init__(self, target_topo, max_cache):
+        Heuristic.__init__(self, target_topo, max_cache)
+        self.targets = sorted(target_topo.edges)
+        self.target_degree = dict()
+        for u, v in self.targets:
+            self.target_degree[u] = self.target_degree.get(u, 0) + 1
+            self.target_degree[v] = self.target_degree.get(v, 0) + 1
+
+    def degree(self, tree, v):
+        return len(tree.adj[tree.index[v]])
+
+    def compute(self, edges, tree):
+        lengths = tuple(tree.path_length(u, v) for u, v in self.targets)
+        surplus = sum(max(0, self.degree(tree, v) - self.target_degree.get(v, 0)) for v in tree.nodes)
+        info = (lengths, surplus)
+        return self.bound(info), info
+
+    @staticmethod
+    def bound(info):
+        lengths, surplus = info
+        step = 0
+        for d in sorted(l - 1 for l in lengths if l > 1):
+            step = max(d, step + 1)
+        return max(step, surplus)
+
+    def make_context(self, info, edges, tree):
+        return PathContext(info, tree, self.targets)
+
+    # path lengths after shift(i, j, k): paths using (i, j) get one shorter if they also use (j, k), otherwise
+    # one longer; returns the new lengths and the changed targets (index -> shortened or not)
+    def shifted(self, ctx, shift):
+        i, j, k = shift
+        lengths, surplus = ctx.info
+        new_lengths = list(lengths)
+        changed = dict()
+        for t in ctx.through.get((i, j), ()):
+            shortened = (j, k) in ctx.on_path[t]
+            new_lengths[t] += -1 if shortened else 1
+            changed[t] = shortened
+        tree = ctx.tree
+        if self.degree(tree, j) > self.target_degree.get(j, 0):
+            surplus -= 1
+        if self.degree(tree, k) >= self.target_degree.get(k, 0):
+            surplus += 1
+        return (tuple(new_lengths), surplus), changed
+
+    def update(self, ctx, shift):
+        info, _ = self.shifted(ctx, shift)
+        return self.bound(info), info
+
+
+# pattern database bound: every pair of targets (at least one not yet in the topology) is abstracted to
+# (len(path(g1)), len(path(g2)), number of edges both paths share), the exact cost of the abstract problem is
+# looked up in a PatternDatabase and the bound is the max over all pairs and the matching bound
+class PDBHeuristic(MatchingHeuristic):
+    name = 'pdb'
+
+    def __init__(self, target_topo, max_cache):
+        MatchingHeuristic.__init__(self, target_topo, max_cache)
+        self.pdb = PatternDatabase()
+
+    def compute(self, edges, tree):
+        _, info = MatchingHeuristic.compute(self, edges, tree)
+        ctx = self.make_context(info, edges, tree)
+        return self.pdb_bound(info, ctx.pairs), info
+
+    def make_context(self, info, edges, tree):
+        ctx = PathContext(info, tree, self.targets)
+        lengths = info[0]
+        on_path = ctx.on_path
+        ctx.pairs = [(a, b, len(on_path[a] & on_path[b]) // 2)
+                     for a in range(0, len(lengths)) for b in range(a + 1, len(lengths))
+                     if lengths[a] > 1 or lengths[b] > 1]
+        return ctx
+
+    def pdb_bound(self, info, pairs):
+        lengths = info[0]
+        best = self.bound(info)
+        lookup = self.pdb.lookup
+        for a, b, shared in pairs:
+            best = max(best, lookup(lengths[a], lengths[b], shared))
+        return best
+
+    def update(self, ctx, shift):
+        info, changed = self.shifted(ctx, shift)
+        if not changed:
+            return self.pdb_bound(info, ctx.pairs), info
+        i, j, k = shift
+        on_path = ctx.on_path
+        shift_edges = ((i, j), (j, k), (i, k))
+
+        # membership of the edges touched by the shift in the path of t after the shift
+        def after(t):
+            if t not in changed:
+                return tuple(e in on_path[t] for e in shift_edges)
+            return False, not changed[t], True
+
+        pairs = []
+        for a, b, shared in ctx.pairs:
+            if a in changed or b in changed:
+                before_a = tuple(e in on_path[a] for e in shift_edges)
+                before_b = tuple(e in on_path[b] for e in shift_edges)
+                after_a = after(a)
+                after_b = after(b)
+                for x in range(0, 3):
+                    shared += (after_a[x] and after_b[x]) - (before_a[x] and before_b[x])
+            pairs.append((a, b, shared))
+        return self.pdb_bound(info, pairs), info
+
+
+# exact costs of the two-goal abstraction (d1, d2, s): path lengths of two goals and the number of edges
+# their paths share; a shift changes each length by at most one and s by at most one, shortens both paths
+# only if they share the two edges it touches (s >= 2), and cannot complete both goals at once
+# the table covers lengths up to cap and is rebuilt with a larger cap by backward search from (1, 1, 0)
+class PatternDatabase:
+    # (delta d1, delta d2) -> possible delta s
+    DELTA_SHARED = {
+        (0, 0): (0,),
+        (-1, 0): (-1, 0), (0, -1): (-1, 0),
+        (1, 0): (0, 1), (0, 1): (0, 1),
+        (-1, -1): (-1,),
+        (1, 1): (1,),
+        (-1, 1): (0,), (1, -1): (0,),
+    }
+
+    def __init__(self, cap=8):
+        self.cap = 0
+        self.dist = dict()
+        self.build(cap)
+
+    @staticmethod
+    def valid(d1, d2, s):
+        return d1 >= 1 and d2 >= 1 and 0 <= s <= min(d1, d2) and (s == 0 or d1 > 1 or d2 > 1)
+
+    def successors(self, d1, d2, s, cap):
+        for (x, y), deltas in PatternDatabase.DELTA_SHARED.items():
+            if x == y == 0:
+                continue
+            if x == -1 and y == -1 and s < 2:
+                continue
+            if x != y and min(x, y) == -1 and max(x, y) == 1 and s < 1:
+                continue
+            if x == y == 1 and s < 1:
+                continue
+            for z in deltas:
+                n = (d1 + x, d2 + y, s + z)
+                if n[0] <= cap and n[1] <= cap and PatternDatabase.valid(*n):
+                    yield n
+
+    def build(self, cap):
+        self.cap = cap
+        predecessors = dict()
+        for d1 in range(1, cap + 1):
+            for d2 in range(1, cap + 1):
+                for s in range(0, min(d1, d2) + 1):
+                    if not PatternDatabase.valid(d1, d2, s):
+                        continue
+                    for n in self.successors(d1, d2, s, cap):
+                        predecessors.setdefault(n, []).append((d1, d2, s))
+        dist = {(1, 1, 0): 0}
+        queue = [(1, 1, 0)]
+        for state in queue:
+            for p in predecessors.get(state, ()):
+                if p not in dist:
+                    dist[p] = dist[state] + 1
+                    queue.append(p)
+        self.dist = dist
+
+    def lookup(self, d1, d2, s):
+        if d1 > self.cap or d2 > self.cap:
+            self.build(max(2 * self.cap, d1, d2))
+        return self.dist.get((d1, d2, s), 0)
+
+
+def create_heuristic(options, target_topo, max_cache=None):
+    if max_cache is None:
+        max_cache = options.bfs_qsize
+    heuristic_type = pconf.heuristic_type(options)
+    if heuristic_type == pconf.HeuristicType.MATCHING:
+        return MatchingHeuristic(target_topo, max_cache)
+    if heuristic_type == pconf.HeuristicType.PDB:
+        return PDBHeuristic(target_topo, max_cache)
+    return GreedyHeuristic(target_topo, max_cache)
+
+
+if __name__ == '__main__':
+    import random
+    from topology.generator import generate_tree, change_links
+    from heuristics.bfs_planner import find_all_shifts, is_state_subset
+    from heuristics.state_encoding import EdgeSetStates
+
+    # the table does not depend on its cap
+    small = PatternDatabase(10)
+    large = PatternDatabase(16)
+    for state, d in small.dist.items():
+        assert large.dist[state] == d, (state, d, large.dist[state])
+
+    # incremental values agree with values from scratch and the admissible ones never exceed the exact
+    # number of shifts left (plain breadth first search over all shifts)
+    states = EdgeSetStates()
+    rand = random.Random(3)
+    for seed in range(1, 6):
+        init = generate_tree(7, max_child=3, seed=seed)
+        target = change_links(init, 0.5, seed)
+        dist = {states.key(target.edges): 0}
+        frontier = [set(target.edges)]
+        while frontier:
+            next_frontier = []
+            for edges in frontier:
+                for r in list(edges):
+                    # shifts are reversible, so distances from the target are distances to it
+                    for op in find_all_shifts(r, edges):
+                        succ = states.successor(edges, op)
+                        if states.key(succ) not in dist:
+                            dist[states.key(succ)] = dist[states.key(edges)] + 1
+                            next_frontier.append(succ)
+            frontier = next_frontier
+        for cls in (GreedyHeuristic, MatchingHeuristic, PDBHeuristic):
+            h = cls(target, 10**6)
+            fresh = cls(target, 0)
+            edges = set(init.edges)
+            for _ in range(200):
+                tree = TreeIndex(edges)
+                ctx = h.context(states.key(edges), edges, tree)
+                ops = [op for r in edges for op in find_all_shifts(r, edges)]
+                op = rand.choice(sorted(ops))
+                edges = states.successor(edges, op)
+                key = states.key(edges)
+                value = h.child_value(ctx, op, key)
+                # the greedy estimate depends on the iteration order of the edge set, so it is not compared
+                if cls is not GreedyHeuristic:
+                    assert value == fresh.value(key, edges), (cls.name, edges, op)
+                    assert value <= dist[key], (cls.name, value, dist[key])
+                if is_state_subset(target.edges, edges):
+                    break
+            h.report()
+    print('heuristics agree with their incremental updates, matching and pdb are admissible')
@@ -0,0 +1,49 @@
+from array import array
+
+__author__ = 'pxsalehi'
+
+
+# search nodes stored as back pointers in flat arrays: node n was reached from node parent[n] by
+# shift (op_i[n], op_j[n], op_k[n]), so a node costs a few bytes regardless of its depth and
+# plans are only materialized for goal nodes
+class PlanArena:
+    ROOT = 0
+
+    def __init__(self):
+        self.parent = array('l')
+        self.op_i = array('l')
+        self.op_j = array('l')
+        self.op_k = array('l')
+        self.clear()
+
+    def clear(self):
+        for a in (self.parent, self.op_i, self.op_j, self.op_k):
+            del a[:]
+        # root node, the initial state
+        self.parent.append(-1)
+        self.op_i.append(-1)
+        self.op_j.append(-1)
+        self.op_k.append(-1)
+
+    # returns index of the new node
+    def add(self, parent, op):
+        self.parent.append(parent)
+        self.op_i.append(op[0])
+        self.op_j.append(op[1])
+        self.op_k.append(op[2])
+        return len(self.parent) - 1
+
+    # list of shifts leading from the root to node
+    def plan(self, node):
+        ops = []
+        while node != PlanArena.ROOT:
+            ops.append((self.op_i[node], self.op_j[node], self.op_k[node]))
+            node = self.parent[node]
+        ops.reverse()
+        return ops
+
+    def __len__(self):
+        return len(self.parent)
+
+    def nbytes(self):
+        return sum(a.itemsize * a.buffer_info()[1] for a in (self.parent, self.op_i, self.op_j, self.op_k))
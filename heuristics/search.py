@@ -0,0 +1,237 @@
+import heapq
+import itertools
+from timeit import default_timer as timer
+
+from heuristics.bfs_planner import create_state_encoding, generate_shifts, compute_state
+from heuristics.heuristic import create_heuristic
+from heuristics.plan_arena import PlanArena
+from topology.tree_index import TreeIndex
+import config.planner_config as pconf
+import plan_cache
+from plan_cache import cached_plan
+import instrumentation as instr
+
+__author__ = 'pxsalehi'
+
+
+# best-first search engine for the itt problem: A*, weighted A*, IDA* and anytime repairing A* (ARA*)
+# all algorithms share one transposition table: state key -> TTEntry, which keeps the heuristic of a
+# state and the best known cost to reach it, and a PlanArena for plan reconstruction
+# successors are evaluated incrementally from the TreeIndex of the expanded state
+class TTEntry:
+    __slots__ = ('g', 'h', 'node', 'state', 'closed', 'stamp')
+
+    def __init__(self, g, h, node, state):
+        self.g = g
+        self.h = h
+        self.node = node
+        self.state = state
+        self.closed = False
+        self.stamp = 0  # search iteration the entry was last updated in
+
+
+class SearchEngine:
+    def __init__(self, initial_topo, target_topo, options):
+        self.target_topo = target_topo
+        self.options = options
+        self.time_limit = options.time_limit if options.time_limit else float('inf')
+        self.max_states = options.bfs_qsize
+        self.states = create_state_encoding(options)
+        self.h = create_heuristic(options, target_topo)
+        self.s0 = self.states.initial(initial_topo.edges)
+        self.s0_edges = set(initial_topo.edges)
+        self.goal_key = self.states.key(self.states.initial(target_topo.edges))
+        self.tt = dict()
+        self.arena = PlanArena()
+        self.counter = itertools.count()  # FIFO tie breaking in the open list
+        self.start_time = None
+        self.best_plan = None
+        self.best_plan_time = None
+        self.truncated = False  # the transposition table reached max_states
+        self.stats = {'expanded': 0, 'generated': 0, 'iterations': 0}
+
+    # false once the time limit passed or the planner was asked to stop
+    def time_left(self):
+        return timer() - self.start_time < self.time_limit and not pconf.stop_requested(self.options)
+
+    def successors(self, state, edges, tree):
+        for op in generate_shifts(edges, self.target_topo, tree):
+            self.stats['generated'] += 1
+            yield op, self.states.successor(state, op)
+
+    def new_plan(self, ops):
+        if self.best_plan is None or len(ops) < len(self.best_plan):
+            self.best_plan = ops
+            self.best_plan_time = timer() - self.start_time
+            print('New best plan length:', len(ops), 'after', self.best_plan_time, 'sec')
+
+    # returns calculated plan and the time it took to calculate the best plan
+    def run(self, algorithm):
+        self.start_time = timer()
+        if self.states.key(self.s0) == self.goal_key:
+            return dict(), 0.0
+        if algorithm == pconf.Planner.ASTAR:
+            self.weighted_astar(1.0)
+        elif algorithm == pconf.Planner.WASTAR:
+            self.weighted_astar(self.options.search_weight)
+        elif algorithm == pconf.Planner.IDASTAR:
+            self.idastar()
+        elif algorithm == pconf.Planner.ARASTAR:
+            self.arastar(self.options.search_weight, self.options.search_weight_dec)
+        else:
+            raise RuntimeError('Unknown search algorithm %s' % algorithm)
+        print('search: expanded={} generated={} iterations={} tt size={}'.format(
+            self.stats['expanded'], self.stats['generated'], self.stats['iterations'], len(self.tt)))
+        instr.count('expanded states', self.stats['expanded'])
+        instr.count('generated states', self.stats['generated'])
+        instr.count('search iterations', self.stats['iterations'])
+        instr.peak('transposition table', len(self.tt))
+        self.h.report()
+        if self.truncated or not self.time_left():
+            plan_cache.incomplete()
+        if self.best_plan is None:
+            return None, None
+        plan = {step: [op] for step, op in enumerate(self.best_plan, start=1)}
+        return plan, self.best_plan_time
+
+    def root_entry(self):
+        key = self.states.key(self.s0)
+        entry = self.tt.get(key)
+        if entry is None:
+            entry = TTEntry(0, self.h.value(key, self.s0_edges), PlanArena.ROOT, self.s0)
+            self.tt[key] = entry
+        return key, entry
+
+    def weighted_astar(self, weight):
+        self.stats['iterations'] += 1
+        key, entry = self.root_entry()
+        open_list = [(weight * entry.h, entry.h, next(self.counter), key)]
+        self.improve_path(open_list, weight, None)
+
+    # expands states in order of g + weight * h until the goal cannot be improved by the open list
+    # if incons is not None (ARA*), improved states that were already closed are collected there; A* (weight 1)
+    # reopens them, so its plans are optimal with an admissible heuristic that is not consistent
+    def improve_path(self, open_list, weight, incons):
+        while open_list and self.time_left():
+            f, h, _, key = heapq.heappop(open_list)
+            entry = self.tt[key]
+            if entry.closed:
+                continue
+            goal = self.tt.get(self.goal_key)
+            if goal is not None and goal.g <= f:
+                break
+            if key == self.goal_key:
+                continue
+            entry.closed = True
+            self.stats['expanded'] += 1
+            edges = self.states.edges(entry.state)
+            tree = TreeIndex(edges)
+            ctx = None
+            g = entry.g + 1
+            for op, succ in self.successors(entry.state, edges, tree):
+                succ_key = self.states.key(succ)
+                succ_entry = self.tt.get(succ_key)
+                if succ_entry is None:
+                    if len(self.tt) >= self.max_states:
+                        print('transposition table reached size limit')
+                        self.truncated = True
+                        return
+                    if ctx is None:
+                        ctx = self.h.context(key, edges, tree)
+                    succ_entry = TTEntry(g, self.h.child_value(ctx, op, succ_key), None, succ)
+                    self.tt[succ_key] = succ_entry
+                elif succ_entry.g <= g:
+                    continue
+                succ_entry.g = g
+                succ_entry.node = self.arena.add(entry.node, op)
+                if succ_key == self.goal_key:
+                    self.new_plan(self.arena.plan(succ_entry.node))
+                if succ_entry.closed and incons is None and weight == 1.0:
+                    succ_entry.closed = False
+                if not succ_entry.closed:
+                    heapq.heappush(open_list, (g + weight * succ_entry.h, succ_entry.h, next(self.counter),
+                                               succ_key))
+                elif incons is not None:
+                    incons.add(succ_key)
+
+    # anytime repairing A*: weighted A* with a decreasing weight, each iteration reuses the costs found so
+    # far and only re-expands states whose cost improved, so plan quality improves monotonically
+    def arastar(self, weight, weight_dec):
+        key, entry = self.root_entry()
+        open_list = [(weight * entry.h, entry.h, next(self.counter), key)]
+        while self.time_left():
+            self.stats['iterations'] += 1
+            incons = set()
+            self.improve_path(open_list, weight, incons)
+            print('ARA* weight %.2f: plan length %s' % (weight, None if self.best_plan is None
+                                                         else len(self.best_plan)))
+            if weight <= 1.0 or not self.time_left():
+                break
+            weight = max(1.0, weight - weight_dec)
+            # move inconsistent states to open, recompute priorities and reopen closed states
+            keys = {k for _, _, _, k in open_list if not self.tt[k].closed}
+            keys.update(incons)
+            for entry in self.tt.values():
+                entry.closed = False
+            open_list = [(self.tt[k].g + weight * self.tt[k].h, self.tt[k].h, next(self.counter), k) for k in keys]
+            heapq.heapify(open_list)
+
+    # iterative deepening A*: depth-first search bounded by g + h, the bound grows to the smallest f that
+    # exceeded it; memory is linear in the plan length, the table only caches heuristics and the best g of
+    # each state in the current iteration (up to max_states entries)
+    def idastar(self):
+        key, entry = self.root_entry()
+        bound = entry.h
+        while self.time_left() and self.best_plan is None:
+            self.stats['iterations'] += 1
+            stamp = self.stats['iterations']
+            entry.g = 0
+            entry.stamp = stamp
+            next_bound = float('inf')
+            path = []
+            stack = [self.idastar_frame(key, entry, self.states.edges(entry.state))]
+            while stack and self.time_left():
+                top, succs, edges, tree, ctx = stack[-1]
+                item = next(succs, None)
+                if item is None:
+                    stack.pop()
+                    if path:
+                        path.pop()
+                    continue
+                op, succ = item
+                g = top.g + 1
+                succ_key = self.states.key(succ)
+                succ_entry = self.tt.get(succ_key)
+                if succ_entry is None:
+                    succ_entry = TTEntry(None, self.h.child_value(ctx, op, succ_key), None, succ)
+                    if len(self.tt) < self.max_states:
+                        self.tt[succ_key] = succ_entry
+                elif succ_entry.stamp == stamp and succ_entry.g <= g:
+                    continue  # reached before in this iteration at no higher cost
+                f = g + succ_entry.h
+                if f > bound:
+                    next_bound = min(next_bound, f)
+                    continue
+                succ_entry.g = g
+                succ_entry.stamp = stamp
+                if succ_key == self.goal_key:
+                    self.new_plan(path + [op])
+                    break
+                self.stats['expanded'] += 1
+                path.append(op)
+                stack.append(self.idastar_frame(succ_key, succ_entry, compute_state(edges, op)))
+            if next_bound == float('inf'):
+                break
+            bound = next_bound
+
+    # expanded state on the IDA* stack: its entry, successor generator, edges, tree and heuristic context
+    def idastar_frame(self, key, entry, edges):
+        tree = TreeIndex(edges)
+        return entry, self.successors(entry.state, edges, tree), edges, tree, self.h.context(key, edges, tree)
+
+
+# returns calculated plan and the time it took to calculate the best plan
+@cached_plan
+def calculate_plan(initial_topo, target_topo, options=None):
+    engine = SearchEngine(initial_topo, target_topo, options)
+    return engine.run(options.planner)
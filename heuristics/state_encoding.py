@@ -0,0 +1,92 @@
+import random
+
+__author__ = 'pxsalehi'
+
+
+# state encodings for the bfs planner, each provides:
+#   initial(edges) -> state, successor(state, shift) -> state,
+#   key(state) -> hashable key for the closed list, edges(state) -> set of edge tuples
+
+
+# states are the edge sets themselves, keyed by a frozenset of frozenset edges
+class EdgeSetStates:
+    def initial(self, edges):
+        return set(edges)
+
+    def successor(self, state, shift):
+        new_state = set(state)
+        i, j, k = shift
+        if (i, j) in new_state:
+            new_state.remove((i, j))
+        else:
+            new_state.remove((j, i))
+        new_state.add((i, k))
+        return new_state
+
+    def key(self, state):
+        return frozenset([frozenset(e) for e in state])
+
+    def edges(self, state):
+        return state
+
+
+# a state is a bitset over the edges seen so far plus a Zobrist hash (xor of a random 64 bit key per edge)
+# a shift flips two bits and updates the hash with two xors, states hash in O(1) and take a few bytes
+# per hundred possible edges instead of a set of sets
+class ZobristState:
+    __slots__ = ('bits', 'zhash')
+
+    def __init__(self, bits, zhash):
+        self.bits = bits
+        self.zhash = zhash
+
+    def __hash__(self):
+        return self.zhash
+
+    def __eq__(self, other):
+        return self.bits == other.bits
+
+
+class ZobristStates:
+    def __init__(self, seed=0):
+        self.rand = random.Random(seed)  # do not disturb the planner's random tie breaking
+        self.edge_bit = dict()  # (min, max) -> bit index
+        self.bit_edge = []  # bit index -> edge tuple as first seen
+        self.zkeys = []  # bit index -> Zobrist key
+
+    def bit(self, vi, vj):
+        e = (vi, vj) if vi <= vj else (vj, vi)
+        b = self.edge_bit.get(e)
+        if b is None:
+            b = len(self.bit_edge)
+            self.edge_bit[e] = b
+            self.bit_edge.append((vi, vj))
+            self.zkeys.append(self.rand.getrandbits(64))
+        return b
+
+    def initial(self, edges):
+        bits = zhash = 0
+        for e in edges:
+            b = self.bit(e[0], e[1])
+            bits |= 1 << b
+            zhash ^= self.zkeys[b]
+        return ZobristState(bits, zhash)
+
+    def successor(self, state, shift):
+        i, j, k = shift
+        removed = self.bit(i, j)
+        added = self.bit(i, k)
+        return ZobristState(state.bits ^ (1 << removed) ^ (1 << added),
+                            state.zhash ^ self.zkeys[removed] ^ self.zkeys[added])
+
+    def key(self, state):
+        return state
+
+    def edges(self, state):
+        edges = set()
+        bits = state.bits
+        while bits:
+            low = bits & -bits
+            edges.add(self.bit_edge[low.bit_length() - 1])
+            bits ^= low
+        return edges
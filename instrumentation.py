@@ -0,0 +1,207 @@
+import contextlib
+import json
+import resource
+import threading
+from timeit import default_timer as timer
+
+__author__ = 'pxsalehi'
+
+# instrumentation of a planning run: nested timing spans, counters and peak memory, written as one JSON line per
+# run to the stat file
+# planners call begin(name)/end(name) or use span(name) around phases, count(name, n) for totals (e.g. expanded
+# states) and peak(name, value) for maxima (e.g. variables of the largest model); all of them do nothing until
+# enable() is called, so instrumented code costs a function call per phase when disabled
+# spans with the same name under the same parent are merged into one with the total time and number of calls, so
+# phases inside loops do not grow the report; every thread has its own stack of open spans
+# worker processes (bfs workers, horizon race, regions) do not report into the recorder of the parent
+#
+# {"info": {...}, "time": run time, "peak_rss_kb": ..., "counters": {"variables": 1200, ...},
+#  "spans": [{"name": "plan", "time": 1.5, "calls": 1, "spans": [{"name": "model", ...}, ...]}, ...]}
+
+recorder = None
+null_span = contextlib.nullcontext()
+
+
+class Span:
+    __slots__ = ('name', 'time', 'calls', 'children', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.time = 0.0
+        self.calls = 0
+        self.children = dict()  # name -> span, in order of creation
+        self.start = None
+
+    def child(self, name):
+        span = self.children.get(name)
+        if span is None:
+            span = self.children[name] = Span(name)
+        return span
+
+    def to_json(self):
+        obj = {'name': self.name, 'time': self.time, 'calls': self.calls}
+        if self.children:
+            obj['spans'] = [c.to_json() for c in self.children.values()]
+        return obj
+
+    def lines(self, depth):
+        yield '%s%s: %.3f s%s' % ('  ' * depth, self.name, self.time, ' (%d calls)' % self.calls
+                                  if self.calls > 1 else '')
+        for c in self.children.values():
+            yield from c.lines(depth + 1)
+
+
+class Recorder:
+    def __init__(self):
+        self.root = Span('run')
+        self.start = timer()
+        self.counters = dict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = [self.root]
+        return stack
+
+    def begin(self, name):
+        stack = self.stack()
+        with self.lock:
+            span = stack[-1].child(name)
+        span.start = timer()
+        stack.append(span)
+
+    # ends the innermost open span called name, and the spans opened in it that were left open (by an exception)
+    # without a name the innermost span ends
+    def end(self, name=None):
+        now = timer()
+        stack = self.stack()
+        if name is not None and all(s.name != name for s in stack[1:]):
+            return
+        while len(stack) > 1:
+            span = stack.pop()
+            span.time += now - span.start
+            span.calls += 1
+            if name is None or span.name == name:
+                break
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def peak(self, name, value):
+        with self.lock:
+            if value > self.counters.get(name, value - 1):
+                self.counters[name] = value
+
+    def report(self, **info):
+        # ru_maxrss is in KB on Linux, children are worker processes
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return {'info': info, 'time': timer() - self.start, 'peak_rss_kb': peak_rss,
+                'counters': dict(sorted(self.counters.items())),
+                'spans': [s.to_json() for s in self.root.children.values()]}
+
+    def summary(self):
+        lines = [line for s in self.root.children.values() for line in s.lines(0)]
+        lines += ['%s: %s' % kv for kv in sorted(self.counters.items())]
+        return lines
+
+
+def enable():
+    global recorder
+    recorder = Recorder()
+    return recorder
+
+
+def disable():
+    global recorder
+    recorder = None
+
+
+def enabled():
+    return recorder is not None
+
+
+def begin(name):
+    if recorder is not None:
+        recorder.begin(name)
+
+
+def end(name=None):
+    if recorder is not None:
+        recorder.end(name)
+
+
+@contextlib.contextmanager
+def recorded_span(name):
+    recorder.begin(name)
+    try:
+        yield
+    finally:
+        recorder.end(name)
+
+
+def span(name):
+    return null_span if recorder is None else recorded_span(name)
+
+
+def count(name, value=1):
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def peak(name, value):
+    if recorder is not None:
+        recorder.peak(name, value)
+
+
+# writes the report of the run as a JSON line to the stat file and prints the spans and counters
+# info: description of the run (planner, size, ...), values must be JSON serializable
+def write_report(options, **info):
+    if recorder is None:
+        return
+    for line in recorder.summary():
+        print('***', line)
+    if options.stat_file:
+        options.stat_file.write(json.dumps(recorder.report(**info)) + '\n')
+        options.stat_file.flush()
+
+
+# reads the reports of a stat file
+def read_reports(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.startswith('{')]
+
+
+# total time of all spans called name in a report, at any depth
+def span_time(report, name):
+    def total(spans):
+        return sum(s['time'] if s['name'] == name else total(s.get('spans', [])) for s in spans)
+    return total(report['spans'])
+
+
+if __name__ == '__main__':
+    import time
+    enable()
+    for _ in range(3):
+        with span('outer'):
+            begin('inner')
+            time.sleep(0.01)
+            count('steps')
+            end('inner')
+    begin('left open')
+    begin('nested')
+    end('left open')
+    peak('nodes', 5)
+    peak('nodes', 3)
+    report = recorder.report(test=True)
+    assert report['counters'] == {'nodes': 5, 'steps': 3}
+    outer = report['spans'][0]
+    assert outer['calls'] == 3 and outer['spans'][0]['calls'] == 3 and span_time(report, 'inner') >= 0.03
+    assert report['spans'][1]['spans'][0]['calls'] == 1
+    print(json.dumps(report))
+    disable()
+    with span('ignored'):
+        count('ignored')
@@ -0,0 +1,226 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import config.planner_config as pconf
+import instrumentation as instr
+
+__author__ = 'pxsalehi'
+
+
+# options that do not change the plan a planner computes: output and caching, the description of the instance
+# (its topologies are in the key, calculate_plan sets size from them), and solver resources and limits (only final
+# plans are cached, see incomplete)
+ignored_options = {'stat_file', 'stat_filename', 'output_dir', 'cache_dir', 'cache_size', 'write_model',
+                   'compute_iis', 'no_solve', 'stop_event', 'rng',
+                   'size', 'src', 'dest', 'src_topo', 'dest_topo', 'change_rate', 'topo_max_child', 'topo_generator',
+                   'threads', 'tune', 'prepasses', 'presolve', 'time_limit', 'horizon_workers', 'region_workers'}
+# options the IP model depends on, besides topologies and plan length
+model_options = ('search_space', 'action_cost_model', 'cost_file', 'gen_props_from_actions', 'prune_reachability',
+                 'model_builder', 'use_move')
+evict_fill = 0.9  # fraction of the maximum size the cache is evicted down to
+
+
+# content addressed cache of plans and IP models in a directory: entries are named by a hash of the canonical
+# initial and target edge sets and the options, so identical instances of an experiment sweep are only planned
+# once; least recently used entries are evicted once the directory exceeds max_bytes
+# several processes may share the directory, entries are written to a temporary file and renamed; each process keeps
+# a running total of the directory size from its own puts and only lists the directory when that exceeds max_bytes
+class PlanCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = self.misses = 0
+        self.model_hits = self.model_misses = 0
+        self.evictions = 0
+        self.total = None  # approximate size of the directory in bytes, found by the first put
+
+    @staticmethod
+    def key(kind, initial_topo, target_topo, options):
+        content = {'kind': kind,
+                   'vertices': sorted(initial_topo.vertices),
+                   'initial': canonical_edges(initial_topo.edges),
+                   'target': canonical_edges(target_topo.edges),
+                   'options': options}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    # returns (plan, time) or None
+    def get_plan(self, key):
+        path = self.path(key, '.plan')
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        touch(path)
+        return entry
+
+    def put_plan(self, key, plan, time):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((plan, time), f)
+        self.replace(tmp, self.path(key, '.plan'))
+
+    # path of a cached model file or None
+    def get_model(self, key):
+        path = self.path(key, '.mps')
+        if not os.path.exists(path):
+            self.model_misses += 1
+            return None
+        self.model_hits += 1
+        touch(path)
+        return path
+
+    def put_model(self, key, model):
+        # gurobi picks the format from the extension
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp.mps')
+        os.close(fd)
+        model.write(tmp)
+        self.replace(tmp, self.path(key, '.mps'))
+
+    # moves a written entry into place and adds it to the running total, evicts once the total exceeds max_bytes
+    def replace(self, tmp, path):
+        size = os.path.getsize(tmp)
+        try:
+            size -= os.path.getsize(path)
+        except OSError:  # new entry
+            pass
+        os.replace(tmp, path)
+        if self.total is None:
+            self.evict()
+        else:
+            self.total += size
+            if self.total > self.max_bytes:
+                self.evict()
+
+    # lists the directory and resets the total, once it exceeds max_bytes removes least recently used entries until
+    # it is below evict_fill of max_bytes, so the next puts do not list the directory again
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if '.tmp' in name:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        limit = self.max_bytes if total <= self.max_bytes else self.max_bytes * evict_fill
+        for mtime, size, name in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self.total = total
+
+    def report(self):
+        return 'cache plan hits=%d misses=%d model hits=%d misses=%d evictions=%d' \
+               % (self.hits, self.misses, self.model_hits, self.model_misses, self.evictions)
+
+
+def canonical_edges(edges):
+    return sorted((u, v) if u <= v else (v, u) for u, v in edges)
+
+
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+caches = dict()  # directory -> cache of this process
+local = threading.local()  # complete: false once a planner returned a plan that is not final
+
+
+# planners call incomplete() when the plan they return is not final: the solver or search ran into its time limit
+# or was stopped and returns the best plan so far (e.g. a gurobi incumbent), which a longer run may improve
+# such plans are not cached, nor are plans built from them (merged region and path plans)
+def incomplete():
+    local.complete = False
+
+
+# calls calculate_plan and returns its plan, planning time and whether the plan is final
+def final_plan(calculate_plan, initial_topo, target_topo, options):
+    outer = getattr(local, 'complete', True)
+    local.complete = True
+    try:
+        plan, time = calculate_plan(initial_topo, target_topo, options)
+        final = local.complete and not pconf.stop_requested(options)
+    finally:
+        local.complete = outer
+    if not final:
+        incomplete()
+    return plan, time, final
+
+
+# the cache configured by options or None if caching is disabled
+def get_cache(options):
+    if options is None or not getattr(options, 'cache_dir', None):
+        return None
+    if options.cache_dir not in caches:
+        caches[options.cache_dir] = PlanCache(options.cache_dir, options.cache_size * 1024 * 1024)
+    return caches[options.cache_dir]
+
+
+def plan_options(options):
+    return {k: v for k, v in vars(options).items() if k not in ignored_options}
+
+
+# key of the IP model of an instance with the given plan length
+# random and runtime action costs are drawn from the random generator of the plan, so they depend on the seed
+def model_key(initial_topo, target_topo, plan_len, options):
+    key_options = {k: getattr(options, k, None) for k in model_options}
+    key_options['plan_len'] = plan_len
+    if str(options.action_cost_model).upper() != pconf.CostModelType.FIXED.name:
+        key_options['seed'] = options.seed
+    return PlanCache.key('ip_model', initial_topo, target_topo, key_options)
+
+
+# decorator for the calculate_plan function of a planner: returns the cached plan and planning time of an
+# instance if there is one, otherwise plans and caches the result
+# only final plans are cached: stop events and time limits are not in the key
+def cached_plan(calculate_plan):
+    @functools.wraps(calculate_plan)
+    def cached_calculate_plan(initial_topo, target_topo, options=None):
+        cache = get_cache(options)
+        if cache is None:
+            return calculate_plan(initial_topo, target_topo, options)
+        key = cache.key(calculate_plan.__module__, initial_topo, target_topo, plan_options(options))
+        entry = cache.get_plan(key)
+        if entry is not None:
+            print('Plan cache hit', key)
+            return entry
+        plan, time, final = final_plan(calculate_plan, initial_topo, target_topo, options)
+        if plan is not None and final:
+            cache.put_plan(key, plan, time)
+        return plan, time
+    return cached_calculate_plan
+
+
+# prints statistics of all caches used by this process and adds them to the counters of the run
+def report(options):
+    for cache in caches.values():
+        print(cache.report())
+        instr.count('cache plan hits', cache.hits)
+        instr.count('cache plan misses', cache.misses)
+        instr.count('cache model hits', cache.model_hits)
+        instr.count('cache model misses', cache.model_misses)
+        instr.count('cache evictions', cache.evictions)
@@ -1,12 +1,14 @@
 from collections import OrderedDict
+import json
 import os
 import random
 
-import jsonpickle
-
 from heuristics import bfs_planner
 import config.planner_config as pconf
-from topology.generator import generate_tree, read_topology_from_json, change_links
+import instrumentation as instr
+import plan_cache
+from topology.generator import generate_tree, read_topology_from_json, change_links, generate_tree_fast, \
+    change_links_fast
 from topology.topology import Topology
 
 
@@ -24,8 +26,9 @@ def write_results(out_dir, plan, planning_time, seed):
     # write plan to separate file
     with open(os.path.join(out_dir, 'plan' + str(seed) + '.txt'), 'w') as out:
         if plan:
-            ordered_plan = OrderedDict(sorted(plan.items()))
-            out.write(jsonpickle.encode(ordered_plan))
+            ordered_plan = OrderedDict((step, [list(op) if isinstance(op, tuple) else op for op in ops])
+                                       for step, ops in sorted(plan.items()))
+            out.write(json.dumps(ordered_plan))
 
 
 def plan_stat(plan):
@@ -40,35 +43,56 @@ def plan_stat(plan):
     return plan_steps, plan_ops
 
 
+# calculate_plan function of a planner type
+def get_planner(planner_type):
+    if planner_type == pconf.Planner.IP:
+        import ILP_optiplan.itt_optiplan as optiplan
+        return optiplan.calculate_plan
+    elif planner_type == pconf.Planner.BFS:
+        return bfs_planner.calculate_plan
+    elif planner_type == pconf.Planner.GREEDY:
+        from heuristics import greedy_planner
+        return greedy_planner.calculate_plan
+    elif planner_type in pconf.search_planners:
+        from heuristics import search
+        return search.calculate_plan
+    else:
+        raise RuntimeError("Unknown planner %s" % planner_type)
+
+
 def main():
     (options, args) = pconf.parse_cl()
     print('Running with', sorted(options.__dict__.items()))
-    options.stat_file = open(options.stat_filename, 'a')
+    # an empty --stat-file turns the instrumentation off
+    if options.stat_filename:
+        options.stat_file = open(options.stat_filename, 'a')
+        instr.enable()
     random.seed(options.seed)
+    instr.begin('topologies')
     # create initial topology
+    if pconf.TopologyGeneratorType(options.topo_generator.upper()) == pconf.TopologyGeneratorType.FAST:
+        gen_tree, gen_target = generate_tree_fast, change_links_fast
+    else:
+        gen_tree, gen_target = generate_tree, change_links
     if options.src_topo:
         init_topo = read_topology_from_json(options.src_topo)
         vertices = init_topo.vertices
     else:
         vertices = list(range(0, options.size))
-        init_topo = generate_tree(size=len(vertices), max_child=options.topo_max_child, seed=options.seed)
+        init_topo = gen_tree(size=len(vertices), max_child=options.topo_max_child, seed=options.seed)
     # create target topology
     if options.dest_topo:
         target_topo = read_topology_from_json(options.dest_topo)
     else:
-        target_topo = change_links(init_topo, options.change_rate, options.seed)
+        target_topo = gen_target(init_topo, options.change_rate, options.seed)
     # make sure init and target topo have the same broker set
     assert len(init_topo.vertices) == len(target_topo.vertices)
-    if options.planner == pconf.Planner.IP:
-        import ILP_optiplan.itt_optiplan as optiplan
-        planner = optiplan.calculate_plan
-    elif options.planner == pconf.Planner.BFS:
-        planner = bfs_planner.calculate_plan
-    else:
-        raise RuntimeError("Only ip and bfs planner are supported!")
+    instr.end('topologies')
+    planner = get_planner(options.planner)
     print('init:', init_topo)
     print('target:', target_topo)
-    plan, time = planner(init_topo, target_topo, options)
+    with instr.span('plan'):
+        plan, time = planner(init_topo, target_topo, options)
     if options.output_dir:
         write_results(options.output_dir, plan, time, options.seed)
     else:
@@ -77,6 +101,13 @@ def main():
         print('best plan ops: {}'.format(plan_ops))
         print('plan', plan)
         print('time:', time)
+    plan_cache.report(options)
+    plan_steps, plan_ops = plan_stat(plan)
+    search_space = options.search_space if options.planner == pconf.Planner.IP else None
+    instr.write_report(options, planner=options.planner.value, search_space=search_space,
+                       size=len(init_topo.vertices), change_rate=options.change_rate, seed=options.seed,
+                       time=time, plan_steps=None if plan is None else plan_steps,
+                       plan_ops=None if plan is None else plan_ops)
 
 
 if __name__ == '__main__':
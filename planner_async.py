@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+import copy
+import multiprocessing
+import random
+import threading
+
+import config.planner_config as pconf
+from planner import get_planner
+
+__author__ = 'pxsalehi'
+
+
+# ip plans in threads of one process share the default gurobi environment, which must not be used by two threads
+ip_lock = threading.Lock()
+
+
+def run_planner(initial_topo, target_topo, options, serialize_ip=False):
+    if serialize_ip and options.planner == pconf.Planner.IP:
+        with ip_lock:
+            return get_planner(options.planner)(initial_topo, target_topo, options)
+    return get_planner(options.planner)(initial_topo, target_topo, options)
+
+
+# asyncio interface to the planners: plans run in an executor so the event loop is not blocked, each plan gets a
+# stop event in its options which the ip, bfs and greedy planners check, a deadline sets the time limit of the
+# solver and bfs and stops the plan when it passes; each plan has its own random generator seeded with its seed
+# with processes (default) stop events go through a multiprocessing manager and are polled at most every 0.1 s
+# (pconf.PolledEvent); with threads plans share the process, the python heuristics hold the GIL and ip plans run one
+# at a time; a thread event does not reach the worker processes of the bfs portfolio, so --bfs-workers needs
+# processes
+class AsyncPlanner:
+    def __init__(self, workers=None, processes=True):
+        self.manager = multiprocessing.Manager() if processes else None
+        self.stop_events = set()  # of the running plans
+        if processes:
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    # returns plan and planning time like calculate_plan; deadline: seconds from now
+    # if the deadline passes or stop() is called, the planner is stopped and the best plan found so far is returned
+    # instead (an incumbent of the ip solver, the best bfs plan, or None)
+    # if the task is cancelled, the planner is stopped and CancelledError raised once it returned
+    async def plan(self, initial_topo, target_topo, options, deadline=None):
+        if self.manager is None and options.planner == pconf.Planner.BFS and options.bfs_workers \
+                and options.bfs_workers > 1:
+            raise ValueError('bfs workers cannot be stopped from a thread, use an AsyncPlanner with processes')
+        options = copy.copy(options)
+        options.stat_file = None
+        options.stop_event = pconf.PolledEvent(self.manager.Event()) if self.manager else threading.Event()
+        options.rng = random.Random(options.seed)
+        if deadline is not None:
+            options.time_limit = deadline if options.time_limit is None else min(options.time_limit, deadline)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, run_planner, initial_topo, target_topo, options,
+                                      self.manager is None)
+        deadline_handle = loop.call_later(deadline, options.stop_event.set) if deadline is not None else None
+        self.stop_events.add(options.stop_event)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            print('Planning cancelled, waiting for the planner to stop')
+            options.stop_event.set()
+            await asyncio.wait([future])
+            raise
+        finally:
+            self.stop_events.discard(options.stop_event)
+            if deadline_handle is not None:
+                deadline_handle.cancel()
+
+    # stops all running plans, they return the best plan found so far
+    def stop(self):
+        for stop_event in list(self.stop_events):
+            stop_event.set()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        if self.manager is not None:
+            self.manager.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+async def example(options):
+    from topology.generator import generate_tree, change_links
+    jobs = []
+    async with AsyncPlanner() as planner:
+        for seed in range(1, 5):
+            initial_topo = generate_tree(size=options.size, max_child=options.topo_max_child, seed=seed)
+            target_topo = change_links(initial_topo, options.change_rate, seed)
+            job_options = copy.copy(options)
+            job_options.seed = seed
+            jobs.append(asyncio.ensure_future(planner.plan(initial_topo, target_topo, job_options,
+                                                           deadline=options.time_limit)))
+        for seed, (plan, time) in enumerate(await asyncio.gather(*jobs), 1):
+            print('seed', seed, 'plan', plan, 'time', time)
+
+
+if __name__ == '__main__':
+    asyncio.run(example(pconf.parse_cl()[0]))
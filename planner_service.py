@@ -0,0 +1,236 @@
+import concurrent.futures
+import copy
+import io
+import json
+import os
+import random
+import signal
+import sys
+import threading
+from timeit import default_timer as timer
+
+import config.planner_config as pconf
+from planner import get_planner
+from topology.generator import read_topology_from_json
+from topology.topology import Topology
+
+__author__ = 'pxsalehi'
+
+# long running batch mode of the planner: reads planning requests as JSON lines and writes one JSON line per plan,
+# requests are planned concurrently by a pool of worker processes that import the planners and create the gurobi
+# environment once, so a request does not pay for process startup
+#
+# request: {"id": 1, "init": {"vertices": [0, 1, 2], "edges": [[0, 1], [1, 2]]}, "target": {...},
+#           "options": {"planner": "greedy", "seed": 1}}
+#   "init_file"/"target_file" may name a topology file (see topology.serialization) instead of "init"/"target",
+#   "vertices" default to 0..n-1, "options" override the command line options of the service
+# response: {"id": 1, "plan": {"1": [...], ...}, "time": planning time, "total_time": time in the worker}
+#   or {"id": 1, "error": "..."}
+# a worker that dies (killed, crashed in gurobi) fails the requests of the pool with an error response, the pool is
+# then replaced by a new one for the following requests
+
+worker_options = None  # command line options in a worker process
+
+
+def init_worker(options):
+    global worker_options
+    worker_options = options
+    # stdout carries the responses, planners and gurobi log to stderr
+    os.dup2(2, 1)
+    for planner_type in pconf.Planner:
+        try:
+            get_planner(planner_type)
+        except ImportError as e:
+            print('Planner %s not available: %s' % (planner_type.value, e), file=sys.stderr)
+    try:
+        import gurobipy
+        # creates the default environment, models of this process share it
+        gurobipy.Model('warmup').dispose()
+    except Exception as e:
+        print('No gurobi environment: %s' % e, file=sys.stderr)
+
+
+def request_topology(request, name):
+    if name + '_file' in request:
+        return read_topology_from_json(request[name + '_file'])
+    spec = request[name]
+    edges = [tuple(e) for e in spec['edges']]
+    topo = Topology(len(edges) + 1)
+    if 'vertices' in spec:
+        topo.set_vertices(set(spec['vertices']))
+    topo.set_edges(edges)
+    return topo
+
+
+def request_options(request, initial_topo, target_topo):
+    options = copy.copy(worker_options)
+    for name, value in request.get('options', {}).items():
+        if not hasattr(options, name) or name in ('stat_file', 'stat_filename', 'output_dir'):
+            raise ValueError('Unknown option %s' % name)
+        setattr(options, name, value)
+    if not options.planner:
+        raise ValueError('No planner given')
+    if not isinstance(options.planner, pconf.Planner):
+        options.planner = pconf.Planner(options.planner.lower())
+    if options.planner == pconf.Planner.BFS and options.time_limit is None:
+        raise ValueError('bfs needs a time_limit')
+    options.stat_file = None
+    options.size = len(initial_topo.vertices)
+    if options.change_rate is None:
+        common = initial_topo.common_edges(target_topo)
+        options.change_rate = 1 - float(len(common)) / max(1, len(initial_topo.edges))
+    return options
+
+
+def json_plan(plan):
+    if plan is None:
+        return None
+    return {str(step): [list(op) if isinstance(op, tuple) else op for op in ops] for step, ops in sorted(plan.items())}
+
+
+# plans one request in a worker process
+def plan_request(request):
+    start = timer()
+    response = {'id': request.get('id')}
+    try:
+        initial_topo = request_topology(request, 'init')
+        target_topo = request_topology(request, 'target')
+        options = request_options(request, initial_topo, target_topo)
+        random.seed(options.seed)
+        plan, time = get_planner(options.planner)(initial_topo, target_topo, options)
+    except Exception as e:
+        response['error'] = '%s: %s' % (type(e).__name__, e)
+        return response
+    response['plan'] = json_plan(plan)
+    response['time'] = time
+    response['total_time'] = timer() - start
+    return response
+
+
+# process pool of the service: a pool with a dead worker is broken and refuses further requests, submit replaces it
+# by a new pool of the same size and retries
+class WorkerPool:
+    def __init__(self, workers, options):
+        self.workers = workers
+        self.options = options
+        self.lock = threading.Lock()
+        self.executor = self.create()
+
+    def create(self):
+        return concurrent.futures.ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                                      initargs=(self.options, ))
+
+    def submit(self, fn, *args):
+        with self.lock:
+            try:
+                return self.executor.submit(fn, *args)
+            except concurrent.futures.process.BrokenProcessPool:
+                print('A worker died, restarting the worker pool', file=sys.stderr)
+                self.executor.shutdown(wait=False)
+                self.executor = self.create()
+                return self.executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+class ResponseWriter:
+    def __init__(self, out, max_pending):
+        self.out = out
+        self.lock = threading.Lock()
+        self.pending = threading.BoundedSemaphore(max_pending)
+
+    def write(self, response):
+        with self.lock:
+            self.out.write(json.dumps(response) + '\n')
+            self.out.flush()
+
+    # writes the response of a request as soon as it is planned, in completion order
+    def submit(self, pool, request):
+        self.pending.acquire()
+        try:
+            future = pool.submit(plan_request, request)
+        except Exception as e:  # no new pool either
+            self.pending.release()
+            self.write({'id': request.get('id'), 'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        def done(f):
+            try:
+                self.write(f.result())
+            except Exception as e:  # worker died
+                self.write({'id': request.get('id'), 'error': '%s: %s' % (type(e).__name__, e)})
+            self.pending.release()
+        future.add_done_callback(done)
+
+
+def create_parser():
+    parser = pconf.create_parser()
+    parser.add_option('--input', type='string', dest='input', default=None,
+                      help='file with one JSON request per line, stdin if not given')
+    parser.add_option('--output', type='string', dest='output', default=None,
+                      help='file the JSON responses are written to, stdout if not given')
+    parser.add_option('--service-workers', type='int', dest='service_workers', default=os.cpu_count(),
+                      help='number of requests planned concurrently, --threads are split among them')
+    parser.add_option('--self-check', action='store_true', dest='self_check', default=False,
+                      help='kill a worker, check that the next request is still planned and exit')
+    return parser
+
+
+# kills a worker of the pool and checks that the pool is replaced and a request submitted after it is planned
+def self_check(options):
+    out = io.StringIO()
+    writer = ResponseWriter(out, 2)
+    request = {'id': 1, 'init': {'edges': [[0, 1], [1, 2], [2, 3]]}, 'target': {'edges': [[0, 1], [0, 2], [2, 3]]},
+               'options': {'planner': 'greedy', 'seed': 1}}
+    with WorkerPool(1, options) as pool:
+        pid = pool.submit(os.getpid).result()
+        lost = pool.submit(signal.pause)
+        os.kill(pid, signal.SIGKILL)
+        try:
+            lost.result()
+            raise AssertionError('killed worker returned a result')
+        except concurrent.futures.process.BrokenProcessPool:
+            pass
+        writer.submit(pool, request)
+        pool.shutdown()
+    responses = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(responses) == 1 and responses[0]['id'] == 1 and responses[0]['plan'], responses
+    print('Planned %s after a worker died' % responses[0]['plan'], file=sys.stderr)
+
+
+def main():
+    (options, args) = create_parser().parse_args()
+    workers = max(1, options.service_workers)
+    options.threads = max(1, options.threads // workers)
+    if options.planner:
+        options.planner = pconf.Planner(options.planner.lower())
+    if options.self_check:
+        self_check(options)
+        return
+    out = open(options.output, 'w') if options.output else os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    infile = open(options.input) if options.input else sys.stdin
+    writer = ResponseWriter(out, 2 * workers)
+    print('Planning service with %d workers' % workers, file=sys.stderr)
+    with WorkerPool(workers, options) as pool:
+        for line in infile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                writer.write({'id': None, 'error': 'Invalid request: %s' % e})
+                continue
+            writer.submit(pool, request)
+    out.close()
+
+
+if __name__ == '__main__':
+    main()
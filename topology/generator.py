@@ -1,7 +1,6 @@
 import random
 import sys
 import copy
-import jsonpickle
 import networkx as nx
 import itertools
 from topology.topology import Topology
@@ -60,15 +59,54 @@ def generate_tree(size, min_lat=10, max_lat=40, max_child=3, balanced=True, seed
     return tree
 
 
+# same shape as generate_tree, built with numpy: in level order the children of a node get consecutive ids and
+# nodes are expanded in id order, so the parent of every node follows from the child counts alone
+# numbers are drawn from a numpy generator seeded by seed, not from random, so the trees differ from generate_tree
+def generate_tree_fast(size, min_lat=10, max_lat=40, max_child=3, balanced=True, seed=None):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    if balanced:
+        # gaussian around the middle of [1, max_child], redrawn outside of it like random_gaussian
+        mu = (1 + max_child) / 2.0
+        sigma = abs(max_child - 1) / 6.0
+        counts = np.rint(rng.normal(mu, sigma, size))
+        bad = (counts < 1) | (counts > max_child)
+        while bad.any():
+            counts[bad] = np.rint(rng.normal(mu, sigma, int(bad.sum())))
+            bad = (counts < 1) | (counts > max_child)
+        counts = counts.astype(np.int64)
+    else:
+        # no child a third of the time
+        counts = rng.integers(0, max_child + 1, size)
+        counts[rng.integers(0, 3, size) == 0] = 0
+        # a node must exist before it is expanded, otherwise its predecessor gets a child
+        created = 1
+        for v in range(0, size - 1):
+            created += counts[v]
+            if created <= v + 1:
+                counts[v] += 1
+                created += 1
+    parents = np.repeat(np.arange(size), counts)[:size - 1]
+    children = np.arange(1, size)
+    latencies = rng.integers(min_lat, max_lat + 1, size - 1)
+    tree = Topology(size)
+    tree.root = 0
+    edges = list(zip(parents.tolist(), children.tolist()))
+    tree.edges = set(edges)
+    tree.link_latencies = dict(zip(edges, latencies.tolist()))
+    tree.leaves = np.flatnonzero(np.bincount(parents, minlength=size) == 0).tolist()
+    return tree
+
+
+# reads plain JSON and older jsonpickle files, see topology.serialization
 def read_topology_from_json(filename):
-    with open(filename) as infile:
-        return jsonpickle.decode(infile.read())
+    from topology.serialization import read_topology
+    return read_topology(filename)
 
 
 def write_topology_to_json(topology, filename):
-    with open(filename, 'w') as outfile:
-        json_str = jsonpickle.encode(topology)
-        outfile.write(json_str)
+    from topology.serialization import write_topology
+    write_topology(topology, filename)
 
 def change_links(topo, change_rate, seed=None):
     if seed:
@@ -100,6 +138,69 @@ def change_links(topo, change_rate, seed=None):
     return new_topo
 
 
+# same distribution as change_links without enumerating all node pairs: removes count random edges and reconnects
+# the components with random node pairs that are not edges of topo, rejecting pairs within a component
+# (change_links discards such pairs as they close a cycle)
+# components are kept as a union-find with a component label per node, merging the smaller component into the
+# larger, so labels of a whole batch of sampled pairs are compared at once
+def change_links_fast(topo, change_rate, seed=None):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    edge_list = sorted(topo.edges)
+    count = round(len(edge_list) * change_rate)
+    removed = set(rng.choice(len(edge_list), count, replace=False).tolist())
+    kept = [e for x, e in enumerate(edge_list) if x not in removed]
+    vertices = np.array(sorted(topo.vertices))
+    index = {v: x for x, v in enumerate(vertices.tolist())}
+    n = len(vertices)
+    # components of the kept edges
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for u, v in kept:
+        parent[find(index[u])] = find(index[v])
+    label = np.array([find(x) for x in range(n)])
+    members = dict()
+    for x, l in enumerate(label.tolist()):
+        members.setdefault(l, []).append(x)
+
+    def union(a, b):
+        la, lb = label[a], label[b]
+        if len(members[la]) < len(members[lb]):
+            la, lb = lb, la
+        moved = members.pop(lb)
+        label[moved] = la
+        members[la].extend(moved)
+
+    old_edges = set(edge_list)
+    new_edges = []
+    batch = 1024
+    while len(members) > 1:
+        pairs = rng.integers(0, n, (batch, 2))
+        start = 0
+        while start < batch and len(members) > 1:
+            crossing = np.flatnonzero(label[pairs[start:, 0]] != label[pairs[start:, 1]])
+            if len(crossing) == 0:
+                break
+            a, b = pairs[start + crossing[0]].tolist()
+            start += crossing[0] + 1
+            u, v = vertices[a].item(), vertices[b].item()
+            if ((u, v) if u <= v else (v, u)) in old_edges:
+                continue
+            union(a, b)
+            new_edges.append((u, v))
+    new_topo = Topology()
+    new_topo.set_vertices(set(topo.vertices))
+    new_topo.edges = set(kept) | set(new_edges)
+    assert len(new_topo.edges) == len(topo.edges)
+    return new_topo
+
+
 def get_all_possible_edges(topo):
     edges = set()
     for e in itertools.permutations(topo.vertices, 2):
@@ -132,7 +233,6 @@ if __name__ == '__main__':
     if len(sys.argv) <= 6:
         print(sys.argv[0], ' size seed max_child balanced|unbalanced min_latency max_latency [output_file]')
         exit()
-    jsonpickle.set_encoder_options('simplejson', sort_keys=True, indent=4, compactly=False)
     # collect all parameters
     size = int(sys.argv[1])
     seed = int(sys.argv[2])
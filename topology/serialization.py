@@ -0,0 +1,235 @@
+import json
+import os
+import struct
+import sys
+
+from topology.topology import Topology
+
+__author__ = 'pxsalehi'
+
+# binary topology format (.itt): a file is a sequence of records, one per topology, so corpora are written and read
+# as streams and a single topology is a corpus of one; all numbers are little endian int64
+#   magic b'ITT1', header (vertex count n, edge count m, root or -1, 1 if latencies follow, metadata bytes)
+#   vertices[n], edges[m][2], latencies[m] (optional), metadata as JSON (leaves, uris, ids, ips), zero padding to 8
+# arrays start at multiples of 8 bytes, so a corpus can be memory mapped and edges be read without copying
+# plain JSON variant (.json, or .jsonl with one topology per line):
+#   {"vertices": [...], "edges": [[u, v], ...], "latencies": [...] or null, "root": r, "leaves": [...],
+#    "uris": [[v, uri], ...], "ids": [...], "ips": [...]}
+
+MAGIC = b'ITT1'
+HEADER = struct.Struct('<4s5q')
+INT = '<i8'
+
+
+def topology_columns(topo):
+    edges = sorted(topo.edges)
+    latencies = None
+    if topo.link_latencies and len(topo.link_latencies) == len(edges):
+        latencies = [topo.get_latency(e) for e in edges]
+    meta = {'leaves': list(topo.leaves),
+            'uris': sorted(topo.uris.items()),
+            'ids': sorted(topo.ids.items()),
+            'ips': sorted(topo.ips.items())}
+    return sorted(topo.vertices), edges, latencies, -1 if topo.root is None else topo.root, meta
+
+
+def topology_from_columns(vertices, edges, latencies, root, meta):
+    topo = Topology()
+    topo.set_vertices(set(vertices))
+    topo.edges = set(edges)
+    if latencies is not None:
+        topo.link_latencies = dict(zip(edges, latencies))
+    topo.root = None if root < 0 else root
+    topo.leaves = list(meta.get('leaves', []))
+    topo.uris = {v: uri for v, uri in meta.get('uris', [])}
+    topo.ids = {v: i for v, i in meta.get('ids', [])}
+    topo.ips = {v: ip for v, ip in meta.get('ips', [])}
+    return topo
+
+
+def write_record(out, topo):
+    import numpy as np
+    vertices, edges, latencies, root, meta = topology_columns(topo)
+    meta_bytes = json.dumps(meta).encode()
+    out.write(HEADER.pack(MAGIC, len(vertices), len(edges), root, latencies is not None, len(meta_bytes)))
+    out.write(np.asarray(vertices, dtype=INT).tobytes())
+    out.write(np.asarray(edges, dtype=INT).reshape(-1, 2).tobytes())
+    if latencies is not None:
+        out.write(np.asarray(latencies, dtype=INT).tobytes())
+    out.write(meta_bytes)
+    out.write(b'\0' * (-len(meta_bytes) % 8))
+
+
+# offsets of the parts of the record starting at offset, and the offset of the next record
+def record_layout(header, offset):
+    magic, n, m, root, has_latencies, meta_len = header
+    if magic != MAGIC:
+        raise RuntimeError('Not a topology record at offset %d' % offset)
+    vertices_at = offset + HEADER.size
+    edges_at = vertices_at + 8 * n
+    latencies_at = edges_at + 16 * m
+    meta_at = latencies_at + (8 * m if has_latencies else 0)
+    end = meta_at + meta_len + (-meta_len % 8)
+    return vertices_at, edges_at, latencies_at, meta_at, end
+
+
+def write_topologies(topos, filename):
+    with open(filename, 'wb') as out:
+        for topo in topos:
+            write_record(out, topo)
+
+
+# yields the topologies of a file one by one
+def read_topologies(filename):
+    import numpy as np
+    with open(filename, 'rb') as f:
+        while True:
+            head = f.read(HEADER.size)
+            if not head:
+                return
+            header = HEADER.unpack(head)
+            _, n, m, root, has_latencies, meta_len = header
+            vertices_at, edges_at, latencies_at, meta_at, end = record_layout(header, 0)
+            body = f.read(end - HEADER.size)
+            vertices = np.frombuffer(body, INT, n, vertices_at - HEADER.size).tolist()
+            edges = np.frombuffer(body, INT, 2 * m, edges_at - HEADER.size).reshape(-1, 2)
+            edges = [tuple(e) for e in edges.tolist()]
+            latencies = np.frombuffer(body, INT, m, latencies_at - HEADER.size).tolist() if has_latencies else None
+            meta = json.loads(body[meta_at - HEADER.size:meta_at - HEADER.size + meta_len].decode())
+            yield topology_from_columns(vertices, edges, latencies, root, meta)
+
+
+# memory mapped corpus: records are indexed once, arrays are views into the file and topologies are only built
+# when accessed
+class TopologyCorpus:
+    def __init__(self, filename):
+        import numpy as np
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+        self.records = []
+        offset = 0
+        while offset < len(self.data):
+            header = HEADER.unpack_from(self.data, offset)
+            self.records.append((header, record_layout(header, offset)))
+            offset = self.records[-1][1][-1]
+
+    def __len__(self):
+        return len(self.records)
+
+    def vertices(self, i):
+        import numpy as np
+        header, layout = self.records[i]
+        return np.frombuffer(self.data, INT, header[1], layout[0])
+
+    # edges of topology i as an m x 2 array
+    def edges(self, i):
+        import numpy as np
+        header, layout = self.records[i]
+        return np.frombuffer(self.data, INT, 2 * header[2], layout[1]).reshape(-1, 2)
+
+    def latencies(self, i):
+        import numpy as np
+        header, layout = self.records[i]
+        return np.frombuffer(self.data, INT, header[2], layout[2]) if header[4] else None
+
+    def __getitem__(self, i):
+        header, layout = self.records[i]
+        meta_at = layout[3]
+        meta = json.loads(bytes(self.data[meta_at:meta_at + header[5]]).decode())
+        latencies = self.latencies(i)
+        return topology_from_columns(self.vertices(i).tolist(), [tuple(e) for e in self.edges(i).tolist()],
+                                     None if latencies is None else latencies.tolist(), header[3], meta)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def topology_to_json(topo):
+    vertices, edges, latencies, root, meta = topology_columns(topo)
+    return dict(meta, vertices=vertices, edges=edges, latencies=latencies, root=root)
+
+
+def topology_from_json(obj):
+    return topology_from_columns(obj['vertices'], [tuple(e) for e in obj['edges']], obj.get('latencies'),
+                                 obj.get('root', -1), obj)
+
+
+# one topology per line
+def write_topologies_json(topos, filename):
+    with open(filename, 'w') as out:
+        for topo in topos:
+            out.write(json.dumps(topology_to_json(topo)) + '\n')
+
+
+def read_topologies_json(filename):
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield topology_from_json(json.loads(line))
+
+
+# key of a dict decoded by jsonpickle: '(0, 1)' -> (0, 1), '3' -> 3
+def decode_key(key):
+    if not isinstance(key, str):
+        return key
+    if key.startswith('('):
+        return tuple(json.loads('[' + key[1:-1] + ']'))
+    if key.lstrip('-').isdigit():
+        return int(key)
+    return key
+
+
+# reads the first topology of a file in any supported format: .itt, plain JSON, jsonpickle or the text format
+# of topology.reader
+def read_topology(filename):
+    if filename.endswith('.itt'):
+        return next(read_topologies(filename))
+    if filename.endswith('.jsonl'):
+        return next(read_topologies_json(filename))
+    with open(filename) as f:
+        text = f.read()
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        from topology.reader import create_topology_from_file
+        return create_topology_from_file(filename)
+    if 'py/object' in obj:
+        import jsonpickle
+        topo = jsonpickle.decode(text)
+        # jsonpickle turns tuple and int keys into strings
+        topo.link_latencies = {decode_key(k): v for k, v in topo.link_latencies.items()}
+        topo.uris = {decode_key(k): v for k, v in topo.uris.items()}
+        topo.ids = {decode_key(k): v for k, v in topo.ids.items()}
+        topo.ips = {decode_key(k): v for k, v in topo.ips.items()}
+        return topo
+    return topology_from_json(obj)
+
+
+def write_topology(topo, filename):
+    if filename.endswith('.itt'):
+        write_topologies([topo], filename)
+    elif filename.endswith('.jsonl'):
+        write_topologies_json([topo], filename)
+    else:
+        with open(filename, 'w') as out:
+            json.dump(topology_to_json(topo), out)
+
+
+# converts topology files of any supported format, the format of dst follows from its extension
+def convert(sources, dst):
+    topos = (read_topology(src) for src in sources)
+    if dst.endswith('.itt'):
+        write_topologies(topos, dst)
+    elif dst.endswith('.jsonl'):
+        write_topologies_json(topos, dst)
+    elif len(sources) == 1:
+        write_topology(next(topos), dst)
+    else:
+        raise RuntimeError('Several topologies need an .itt or .jsonl destination')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(sys.argv[0], ' source [source ...] destination(.itt|.json|.jsonl)')
+        exit()
+    convert(sys.argv[1:-1], sys.argv[-1])
+    print('converted', len(sys.argv) - 2, 'topologies to', sys.argv[-1], os.path.getsize(sys.argv[-1]), 'bytes')
@@ -1,17 +1,188 @@
 __author__ = 'pxsalehi'
 
 
+def edge_key(u, v):
+    return (u, v) if u <= v else (v, u)
+
+
+# edges in canonical orientation: an edge set as it is, any other collection of tuples as a new set
+def canonical(edges):
+    return edges if type(edges) is EdgeSet else {edge_key(e[0], e[1]) for e in edges}
+
+
+# set of undirected edges: edges are stored in canonical orientation (smaller node first), so membership of either
+# orientation is a single lookup and set operations between edge sets (difference, intersection, ==) are structural
+# comparisons; the other operand of set operations and comparisons is canonicalized first, so plain sets and lists
+# of edges in either orientation can be mixed with edge sets; results of non-mutating operations are plain sets of
+# canonical edges; adj maps each node to the set of its neighbors and is kept up to date by all mutating methods
+class EdgeSet(set):
+    def __init__(self, edges=()):
+        super().__init__()
+        self.adj = dict()
+        self.update(edges)
+
+    def __reduce__(self):
+        return self.__class__, (list(self), )
+
+    def __contains__(self, e):
+        return set.__contains__(self, e if e[0] <= e[1] else (e[1], e[0]))
+
+    def add(self, e):
+        u, v = edge_key(e[0], e[1])
+        if not set.__contains__(self, (u, v)):
+            set.add(self, (u, v))
+            self.adj.setdefault(u, set()).add(v)
+            self.adj.setdefault(v, set()).add(u)
+
+    def discard(self, e):
+        u, v = edge_key(e[0], e[1])
+        if set.__contains__(self, (u, v)):
+            set.discard(self, (u, v))
+            self.adj[u].discard(v)
+            self.adj[v].discard(u)
+
+    def remove(self, e):
+        if e not in self:
+            raise KeyError(e)
+        self.discard(e)
+
+    def pop(self):
+        e = set.pop(self)
+        self.adj[e[0]].discard(e[1])
+        self.adj[e[1]].discard(e[0])
+        return e
+
+    def clear(self):
+        set.clear(self)
+        self.adj.clear()
+
+    def copy(self):
+        return self.__class__(self)
+
+    def update(self, *others):
+        for edges in others:
+            for e in edges:
+                self.add(e)
+
+    def difference_update(self, *others):
+        for edges in others:
+            for e in edges:
+                self.discard(e)
+
+    def intersection_update(self, *others):
+        keep = EdgeSet(self)
+        for edges in others:
+            keep = keep & EdgeSet(edges)
+        self.difference_update(self - keep)
+
+    def symmetric_difference_update(self, other):
+        other = EdgeSet(other)
+        common = self & other
+        self.update(other - common)
+        self.difference_update(common)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def neighbors(self, v):
+        return self.adj.get(v, ())
+
+    def issubset(self, other):
+        return set.issubset(self, canonical(other))
+
+    def issuperset(self, other):
+        return set.issuperset(self, canonical(other))
+
+    def isdisjoint(self, other):
+        return set.isdisjoint(self, canonical(other))
+
+    def union(self, *others):
+        return set.union(self, *map(canonical, others))
+
+    def intersection(self, *others):
+        return set.intersection(self, *map(canonical, others))
+
+    def difference(self, *others):
+        return set.difference(self, *map(canonical, others))
+
+    def symmetric_difference(self, other):
+        return set.symmetric_difference(self, canonical(other))
+
+    # operators and comparisons only take sets, like those of set
+    def __eq__(self, other):
+        return set.__eq__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __ne__(self, other):
+        return set.__ne__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __le__(self, other):
+        return set.__le__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __lt__(self, other):
+        return set.__lt__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __ge__(self, other):
+        return set.__ge__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __gt__(self, other):
+        return set.__gt__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __and__(self, other):
+        return set.__and__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return set.__or__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    __ror__ = __or__
+
+    def __xor__(self, other):
+        return set.__xor__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    __rxor__ = __xor__
+
+    def __sub__(self, other):
+        return set.__sub__(self, canonical(other)) if isinstance(other, (set, frozenset)) else NotImplemented
+
+    def __rsub__(self, other):
+        return set.__sub__(canonical(other), self) if isinstance(other, (set, frozenset)) else NotImplemented
+
+
+
 class Topology:
     def __init__(self, size=0):
         self.root = None
         self.leaves = []
         self.size = size
         self.vertices = {i for i in range(0, size)}
-        self.edges = set()  # set of tuples
+        self.edges = EdgeSet()
         self.uris = dict()
         self.ids = dict()
         self.ips = dict()
-        self.link_latencies = dict()  # tuple (from edges) to int
+        self.link_latencies = dict()  # tuple (from edges, either orientation) to int
+
+    # assigning any collection of tuples converts it to an edge set, so the index stays consistent
+    @property
+    def edges(self):
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges):
+        self._edges = edges if type(edges) is EdgeSet else EdgeSet(edges)
 
     def set_vertices(self, vertices):
         if self.vertices != vertices:
@@ -26,16 +197,13 @@ class Topology:
         self.uris = uris.copy()
 
     def get_latency(self, e):
-        if (e[0], e[1]) not in self.edges:
-            e = (e[1], e[0])
-        # decoded topologies have string instead of tuple
-        if type(next(iter(self.link_latencies.keys()))) is str:
-            return self.link_latencies[str(e)]
-        return self.link_latencies[e]
+        latency = self.link_latencies.get((e[0], e[1]))
+        if latency is None:
+            return self.link_latencies[(e[1], e[0])]
+        return latency
 
     def add_edge(self, vi, vj):
-        if vi != vj and (vi, vj) not in self.vertices and (vj, vi) not in self.vertices \
-                and vi in self.vertices and vj in self.vertices:
+        if vi != vj and vi in self.vertices and vj in self.vertices:
             self.edges.add((vi, vj))
 
     def set_edges(self, edges):  # takes list of tuples
@@ -46,15 +214,32 @@ class Topology:
             self.add_edge(e[0], e[1])
 
     def rem_edge(self, vi, vj):
-        if (vi, vj) in self.edges:
-            self.edges.remove((vi, vj))
-        elif (vj, vi) in self.edges:
-            self.edges.remove((vj, vi))
+        self.edges.discard((vi, vj))
 
     def contains_edge(self, e):
-        if (e[0], e[1]) in self.edges or (e[1], e[0]) in self.edges:
-            return True
-        return False
+        return e in self.edges
+
+    def neighbors(self, v):
+        return self.edges.neighbors(v)
+
+    def degree(self, v):
+        return len(self.edges.neighbors(v))
+
+    # structural diff, edges in canonical orientation and sorted so planners iterate them in a fixed order
+    # edges of this topology that are not in edges (a topology's edge set or any collection of tuples)
+    def missing_edges(self, edges):
+        return sorted(self.edges - canonical(edges))
+
+    # edges of target that have to be created
+    def goal_edges(self, target):
+        return target.missing_edges(self.edges)
+
+    # edges that are not in target and can be shifted
+    def removable_edges(self, target):
+        return self.missing_edges(target.edges)
+
+    def common_edges(self, target):
+        return sorted(self.edges & target.edges)
 
     def __str__(self):
         res = 'Vertices: '
@@ -66,17 +251,33 @@ class Topology:
         return res
 
     def equals(self, other):
-        for e in self.edges:
-            if not other.contains_edge(e):
-                return False
-        for e in other.edges:
-            if not self.contains_edge(e):
-                return False
-        return True
+        return self.edges == other.edges
 
 if __name__ == '__main__':
+    import copy
+    import pickle
     topo = Topology(4)
-    topo.set_edges([(0, 1), (0, 2), (1, 3)])
+    topo.set_edges([(0, 1), (0, 2), (3, 1)])
     assert topo.contains_edge((0, 1))
     assert topo.contains_edge((1, 0))
-    assert not topo.contains_edge((2, 3))
\ No newline at end of file
+    assert not topo.contains_edge((2, 3))
+    assert sorted(topo.neighbors(1)) == [0, 3] and topo.degree(0) == 2
+    target = Topology(4)
+    target.set_edges([(1, 0), (2, 3), (1, 3)])
+    assert topo.goal_edges(target) == [(2, 3)] and topo.removable_edges(target) == [(0, 2)]
+    assert target.missing_edges([(3, 2)]) == [(0, 1), (1, 3)]
+    topo.rem_edge(2, 0)
+    topo.add_edge(3, 2)
+    assert topo.equals(target) and not topo.neighbors(0) - {1}
+    for other in (pickle.loads(pickle.dumps(topo)), copy.deepcopy(topo)):
+        assert other.equals(topo) and other.edges.adj == topo.edges.adj
+    topo.edges = {(2, 1)}
+    assert topo.edges.adj == {1: {2}, 2: {1}}
+    # plain sets and lists in either orientation
+    edges = EdgeSet([(1, 2), (3, 2)])
+    assert edges == {(2, 1), (2, 3)} and {(2, 1), (2, 3)} == edges and not edges != {(2, 1), (3, 2)}
+    assert edges <= {(2, 1), (2, 3), (4, 5)} and edges.issubset([(2, 1), (3, 2)]) and edges > {(2, 1)}
+    assert edges - {(2, 1)} == {(2, 3)} and {(2, 1), (5, 4)} - edges == {(4, 5)}
+    assert edges & {(3, 2)} == {(2, 3)} and {(3, 2)} & edges == {(2, 3)} and edges.intersection([(2, 1)]) == {(1, 2)}
+    assert edges | {(2, 1)} == {(1, 2), (2, 3)} and edges ^ {(2, 1), (4, 3)} == {(2, 3), (3, 4)}
+    assert edges.difference([(1, 2)], [(3, 2)]) == set() and not edges.isdisjoint([(3, 2)])
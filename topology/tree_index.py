@@ -0,0 +1,160 @@
+__author__ = 'pxsalehi'
+
+
+# rooted index over the edges of a tree: parent and depth per node plus binary lifting tables for
+# lowest common ancestor queries, so a path length takes O(log n) and a path O(len + log n)
+# nodes are mapped to dense indices internally, queries take and return the original nodes
+# shift(i, j, k) is applied in place and only updates the subtree that moves
+class TreeIndex:
+    def __init__(self, edges, root=None):
+        nodes = set()
+        for e in edges:
+            nodes.update(e)
+        if root is not None:
+            nodes.add(root)
+        self.nodes = sorted(nodes)  # dense index -> node
+        self.index = {v: i for i, v in enumerate(self.nodes)}
+        n = len(self.nodes)
+        self.adj = [set() for _ in range(n)]
+        for u, v in edges:
+            self.adj[self.index[u]].add(self.index[v])
+            self.adj[self.index[v]].add(self.index[u])
+        self.log = max(1, n.bit_length())
+        self.parent = [0] * n
+        self.depth = [0] * n
+        self.up = [[0] * n for _ in range(self.log)]  # up[k][v]: 2^k-th ancestor of v
+        self.root = self.index[root] if root is not None else 0
+        if n > 0:
+            self._update_subtree(self.root, self.root)
+
+    def copy(self):
+        other = TreeIndex.__new__(TreeIndex)
+        other.nodes = self.nodes
+        other.index = self.index
+        other.adj = [set(a) for a in self.adj]
+        other.log = self.log
+        other.parent = self.parent[:]
+        other.depth = self.depth[:]
+        other.up = [row[:] for row in self.up]
+        other.root = self.root
+        return other
+
+    # (re)compute parent, depth and ancestors of the subtree hanging from r, whose parent is p
+    def _update_subtree(self, r, p):
+        parent, depth, up, adj = self.parent, self.depth, self.up, self.adj
+        parent[r] = p
+        depth[r] = 0 if r == p else depth[p] + 1
+        queue = [r]
+        for v in queue:
+            pv = parent[v]
+            up[0][v] = pv
+            for k in range(1, self.log):
+                up[k][v] = up[k - 1][up[k - 1][v]]
+            for w in adj[v]:
+                if w != pv:
+                    parent[w] = v
+                    depth[w] = depth[v] + 1
+                    queue.append(w)
+
+    def _lca(self, a, b):
+        depth, up = self.depth, self.up
+        if depth[a] < depth[b]:
+            a, b = b, a
+        diff = depth[a] - depth[b]
+        k = 0
+        while diff:
+            if diff & 1:
+                a = up[k][a]
+            diff >>= 1
+            k += 1
+        if a == b:
+            return a
+        for k in range(self.log - 1, -1, -1):
+            if up[k][a] != up[k][b]:
+                a = up[k][a]
+                b = up[k][b]
+        return up[0][a]
+
+    def lca(self, u, v):
+        return self.nodes[self._lca(self.index[u], self.index[v])]
+
+    # number of edges on the path between u and v
+    def path_length(self, u, v):
+        a = self.index[u]
+        b = self.index[v]
+        return self.depth[a] + self.depth[b] - 2 * self.depth[self._lca(a, b)]
+
+    # nodes on the path from u to v, both included (same as nx.shortest_path on a tree)
+    def path(self, u, v):
+        a = self.index[u]
+        b = self.index[v]
+        l = self._lca(a, b)
+        left = []
+        while a != l:
+            left.append(a)
+            a = self.parent[a]
+        right = []
+        while b != l:
+            right.append(b)
+            b = self.parent[b]
+        left.append(l)
+        left.extend(reversed(right))
+        return [self.nodes[x] for x in left]
+
+    # edges on the path from u to v, oriented along the path
+    def path_edges(self, u, v):
+        path = self.path(u, v)
+        return [(path[i], path[i + 1]) for i in range(0, len(path) - 1)]
+
+    def has_edge(self, u, v):
+        return self.index[v] in self.adj[self.index[u]]
+
+    def neighbors(self, v):
+        return [self.nodes[w] for w in self.adj[self.index[v]]]
+
+    def edges(self):
+        return [(self.nodes[a], self.nodes[b]) for a in range(len(self.nodes)) for b in self.adj[a] if a < b]
+
+    # shift(i, j, k): remove (i, j) and add (i, k), j and k must be connected
+    # the subtree that gets a new parent is re-indexed, the rest of the tree is untouched
+    # shift(i, k, j) undoes it
+    def apply_shift(self, i, j, k):
+        a = self.index[i]
+        b = self.index[j]
+        c = self.index[k]
+        assert b in self.adj[a] and c in self.adj[b] and c not in self.adj[a], (i, j, k)
+        self.adj[a].discard(b)
+        self.adj[b].discard(a)
+        self.adj[a].add(c)
+        self.adj[c].add(a)
+        if self.parent[a] == b:
+            # subtree of i moves below k
+            self._update_subtree(a, c)
+        else:
+            # j is a child of i and k a child of j: the subtree of j now hangs from i through k
+            self._update_subtree(c, a)
+
+
+if __name__ == '__main__':
+    import random
+    import networkx as nx
+    from topology.generator import generate_tree
+    random.seed(7)
+    topo = generate_tree(60, max_child=3, seed=7)
+    tree = TreeIndex(topo.edges)
+    g = nx.Graph(list(topo.edges))
+    for _ in range(200):
+        i, j = random.choice(list(g.edges()))
+        if random.random() < 0.5:
+            i, j = j, i
+        ks = [k for k in g.neighbors(j) if k != i]
+        if ks:
+            k = random.choice(ks)
+            tree.apply_shift(i, j, k)
+            g.remove_edge(i, j)
+            g.add_edge(i, k)
+        u, v = random.sample(list(g.nodes()), 2)
+        assert tree.path(u, v) == nx.shortest_path(g, u, v)
+        assert tree.path_length(u, v) == nx.shortest_path_length(g, u, v)
+    assert sorted(map(sorted, tree.edges())) == sorted(map(sorted, g.edges()))
+    print('tree index agrees with networkx')